@@ -546,19 +546,13 @@ def split_text(settings={}, preview=False):
     return title_tags
 
 
-def norepeat_filename(prefix, order):
+def norepeat_filename(prefix, order, reserved=()):
     filename = prefix + order + ".xhtml"
-    repeat = False
-    while True:
-        for mid, href in bk.text_iter():
-            if href.lower().endswith(filename.lower()):
-                repeat = True
-                break
-        if not repeat:
-            break
+    # 文件名同时作为 manifest id，两者都不能重复；文件名不区分大小写
+    # reserved 为本次已分配但尚未添加的文件名（casefold）
+    while filename.casefold() in reserved or bk.basename_to_id(filename, ci=True) is not None or bk.id_to_href(filename) is not None:
         prefix += '_'
         filename = prefix + order + ".xhtml"
-        repeat = False
     return filename
 
 
@@ -580,23 +574,22 @@ def build_xhtml(title_tags, mainform):
         xhtml_template = tpl.read()
         indent = re.search(r"([ \t]*)\[MAIN\]", xhtml_template)
         indent = indent.group(1) if indent else ""
+    files = []
+    reserved = set()
     for chapter_text in chapter_list:
         title = title_tags.pop(0)
         xhtml = re.sub(r"\[TITLE\]", title, xhtml_template)
         xhtml = re.sub(r"[ \t]*\[MAIN\]", set_p_em(chapter_text, indent), xhtml, 1)
         suffix_order = '0' * (chapter_order_len - len(str(order_index))) + str(order_index)
-        chapter_filename = chapter_filename_prefix + suffix_order + '.xhtml'
         order_index += 1
+        chapter_filename = norepeat_filename(chapter_filename_prefix, suffix_order, reserved)
+        reserved.add(chapter_filename.casefold())
         unique_id = chapter_filename
         mime = 'application/xhtml+xml'
-        try:
-            bk.addfile(unique_id, chapter_filename, xhtml, mime)
-        except:
-            chapter_filename = norepeat_filename(chapter_filename_prefix, suffix_order)
-            unique_id = chapter_filename
-            bk.addfile(unique_id, chapter_filename, xhtml, mime)
+        files.append((unique_id, chapter_filename, xhtml, mime))
         bk_spine.append((unique_id, None, None))
 
+    bk.addfiles(files)
     bk.setspine_epub3(bk_spine)
 
 
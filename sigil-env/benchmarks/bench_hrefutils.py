@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+"""Time hrefutils.urlencodepart and urldecodepart on ASCII, CJK and mixed paths.
+
+    python benchmarks/bench_hrefutils.py [--reference OLD.py] [--rounds N]
+
+Every sample is 1000 distinct paths.  "uncached" bypasses the lru caches,
+"cached" repeats paths that are already in them.
+
+--reference loads another copy of hrefutils.py, checks it encodes and
+decodes every sample the same way and times it too:
+
+    git show <commit>:sigil-env/src/sigil_env/hrefutils.py > /tmp/hrefutils_old.py
+    python benchmarks/bench_hrefutils.py --reference /tmp/hrefutils_old.py
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "src", "sigil_env"))
+
+import hrefutils
+
+SAMPLES = [
+    ('ascii', ['Text/chapter%04d.xhtml' % i for i in range(1000)]),
+    ('ascii+space', ['Text/chapter %04d.xhtml' % i for i in range(1000)]),
+    ('cjk', ['Text/第%04d章 测试.xhtml' % i for i in range(1000)]),
+    ('mixed', ['Images/图 %04d (copy)#1.jpg' % i for i in range(1000)]),
+]
+
+
+def load_reference(path):
+    spec = importlib.util.spec_from_file_location("hrefutils_reference", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# fastest of rounds, in microseconds per call. The functions take turns
+# within each round so load on the machine hits them alike
+def best_times(funcs, parts, rounds):
+    best = [None] * len(funcs)
+    for _ in range(rounds):
+        for i, func in enumerate(funcs):
+            start = time.perf_counter()
+            for part in parts:
+                func(part)
+            elapsed = time.perf_counter() - start
+            if best[i] is None or elapsed < best[i]:
+                best[i] = elapsed
+    return [elapsed / len(parts) * 1e6 for elapsed in best]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Time hrefutils.urlencodepart and urldecodepart.")
+    ap.add_argument("--reference", help="another hrefutils.py to compare against")
+    ap.add_argument("--rounds", type=int, default=20)
+    args = ap.parse_args(argv)
+
+    reference = load_reference(args.reference) if args.reference else None
+    print("best of %d rounds, us per call" % args.rounds)
+    header = "    %-12s %9s %9s %9s %9s" % ("", "encode", "cached", "decode", "cached")
+    if reference is not None:
+        header += " %9s %9s" % ("ref enc", "ref dec")
+    print(header)
+    for name, parts in SAMPLES:
+        encoded = [hrefutils.urlencodepart(part) for part in parts]
+        if reference is not None:
+            if [reference.urlencodepart(part) for part in parts] != encoded:
+                print("    urlencodepart differs from the reference on %s" % name)
+                return 1
+            if [reference.urldecodepart(part) for part in encoded] != parts:
+                print("    urldecodepart differs from the reference on %s" % name)
+                return 1
+        encoders = [hrefutils._urlencode_str.__wrapped__, hrefutils.urlencodepart]
+        decoders = [hrefutils._urldecode_str.__wrapped__, hrefutils.urldecodepart]
+        if reference is not None:
+            encoders.append(reference.urlencodepart)
+            decoders.append(reference.urldecodepart)
+        enc = best_times(encoders, parts, args.rounds)
+        dec = best_times(decoders, encoded, args.rounds)
+        line = "    %-12s %9.2f %9.2f %9.2f %9.2f" % (name, enc[0], enc[1], dec[0], dec[1])
+        if reference is not None:
+            line += " %9.2f %9.2f" % (enc[2], dec[2])
+        print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+"""Time Opf_Parser on a generated OPF with a very large manifest.
+
+    python benchmarks/bench_opf.py [--reference OLD.py] [--rounds N] [--items N]
+
+The OPF has --items manifest items (50000 by default) in several folders,
+with properties, a spine over the xhtml items, a guide and epub3 metadata.
+
+--reference loads another copy of opf_parser.py, checks it parses the OPF
+into the same state and times it too:
+
+    git show <commit>:sigil-env/src/sigil_env/opf_parser.py > /tmp/opf_parser_old.py
+    python benchmarks/bench_opf.py --reference /tmp/opf_parser_old.py
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "src", "sigil_env"))
+
+import opf_parser
+from opf_parser import Opf_Parser
+
+# (href pattern, media type, share of the items)
+KINDS = [
+    ("Text/part%d/chapter%05d.xhtml", "application/xhtml+xml", 6),
+    ("Images/set%d/image%05d.jpg", "image/jpeg", 3),
+    ("Styles/style%d_%05d.css", "text/css", 1),
+]
+
+
+def load_reference(path):
+    spec = importlib.util.spec_from_file_location("opf_parser_reference", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.Opf_Parser
+
+
+def large_opf(items):
+    pattern = [kind for kind in KINDS for _ in range(kind[2])]
+    manifest = []
+    spine = []
+    for i in range(items):
+        href, mime, share = pattern[i % len(pattern)]
+        href = href % (i % 7, i)
+        props = ' properties="svg"' if mime == "application/xhtml+xml" and i % 50 == 0 else ""
+        manifest.append('    <item id="item%d" href="%s" media-type="%s"%s/>' % (i, href, mime, props))
+        if mime == "application/xhtml+xml":
+            spine.append('    <itemref idref="item%d"%s/>' % (i, ' linear="no"' if i % 100 == 0 else ""))
+    return ('<?xml version="1.0" encoding="utf-8"?>\n'
+            '<package version="3.0" unique-identifier="BookId" xmlns="http://www.idpf.org/2007/opf">\n'
+            '  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:opf="http://www.idpf.org/2007/opf">\n'
+            '    <dc:identifier id="BookId">urn:uuid:00000000-0000-0000-0000-000000000000</dc:identifier>\n'
+            '    <dc:title>A very large book</dc:title>\n'
+            '    <dc:creator id="cre">Someone</dc:creator>\n'
+            '    <meta refines="#cre" property="role" scheme="marc:relators">aut</meta>\n'
+            '    <dc:language>en</dc:language>\n'
+            '    <meta property="dcterms:modified">2020-01-01T00:00:00Z</meta>\n'
+            '    <meta name="cover" content="item1"/>\n'
+            '  </metadata>\n'
+            '  <manifest>\n%s\n  </manifest>\n'
+            '  <spine page-progression-direction="ltr">\n%s\n  </spine>\n'
+            '  <guide>\n    <reference type="text" title="Start" href="Text/part0/chapter00000.xhtml"/>\n  </guide>\n'
+            '</package>\n') % ("\n".join(manifest), "\n".join(spine))
+
+
+def state(op):
+    return {name: getattr(op, name, None) for name in opf_parser._SNAPSHOT_FIELDS}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Time Opf_Parser on a generated OPF with a very large manifest.")
+    ap.add_argument("--reference", help="another opf_parser.py to compare against")
+    ap.add_argument("--rounds", type=int, default=5)
+    ap.add_argument("--items", type=int, default=50000)
+    args = ap.parse_args(argv)
+
+    opf = large_opf(args.items)
+    parsers = [("current", Opf_Parser)]
+    if args.reference:
+        reference = load_reference(args.reference)
+        if state(reference("content.opf", "OEBPS/content.opf", opf_data=opf)) != \
+                state(Opf_Parser("content.opf", "OEBPS/content.opf", opf_data=opf)):
+            print("    parsed state differs from the reference")
+            return 1
+        parsers.append(("reference", reference))
+    # the parsers take turns within each round so load on the
+    # machine hits them alike, the fastest round is kept
+    best = {}
+    for _ in range(args.rounds):
+        for name, parser_class in parsers:
+            start = time.perf_counter()
+            parser_class("content.opf", "OEBPS/content.opf", opf_data=opf)
+            elapsed = time.perf_counter() - start
+            best[name] = min(best.get(name, elapsed), elapsed)
+
+    print("%d manifest items, %.1f MB of opf, best of %d rounds" % (args.items, len(opf) / 1e6, args.rounds))
+    for name, elapsed in best.items():
+        line = "    %-10s %8.3f s" % (name, elapsed)
+        if "reference" in best and name != "reference":
+            line += "  %5.2fx" % (best["reference"] / elapsed)
+        print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+"""Time the hrefutils path helpers on a link-heavy book.
+
+    python benchmarks/bench_pathresolver.py [--reference OLD.py] [--rounds N] [--chapters N]
+
+Three cases:
+  links        buildBookPath and buildRelativePath for 50 links in each of
+               --chapters chapters, and a PathResolver doing the same with
+               empty and with warm caches
+  graph        building a LinkGraph over every chapter of a book whose
+               chapters, images and stylesheet all sit next to the opf
+  standardize  Wrapper.standardize_epub (memory backend) on that book
+
+--reference loads another copy of hrefutils.py and times the three cases
+with its functions in place of the current ones:
+
+    git show <commit>:sigil-env/src/sigil_env/hrefutils.py > /tmp/hrefutils_old.py
+    python benchmarks/bench_pathresolver.py --reference /tmp/hrefutils_old.py
+"""
+
+import argparse
+import importlib.util
+import io
+import os
+import sys
+import tempfile
+import time
+import types
+import zipfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "src", "sigil_env"))
+
+import hrefutils
+import epub_utils
+import wrapper
+from epub_utils import LinkGraph
+from hrefutils import PathResolver
+from opf_parser import Opf_Parser
+from wrapper import Wrapper
+
+LINKS_PER_CHAPTER = 50
+
+# the hrefutils names that wrapper and epub_utils import
+PATH_FUNCTIONS = ("buildBookPath", "buildRelativePath", "startingDir")
+
+CONTAINER_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+'''
+
+
+def load_reference(path):
+    spec = importlib.util.spec_from_file_location("hrefutils_reference", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def link_heavy_book(chapters):
+    """epub bytes: chapters, images and a stylesheet in OEBPS/, each chapter
+    links to the stylesheet, its neighbours and a few images."""
+    images = max(1, chapters // 10)
+    items = ['<item id="css" href="style.css" media-type="text/css"/>']
+    items += ['<item id="i%d" href="img%d.jpg" media-type="image/jpeg"/>' % (j, j) for j in range(images)]
+    items += ['<item id="c%d" href="chapter%d.xhtml" media-type="application/xhtml+xml"/>' % (i, i) for i in range(chapters)]
+    itemrefs = ['<itemref idref="c%d"/>' % i for i in range(chapters)]
+    opf = ('<?xml version="1.0" encoding="utf-8"?>\n'
+           '<package version="3.0" unique-identifier="uid" xmlns="http://www.idpf.org/2007/opf">\n'
+           '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:identifier id="uid">bench</dc:identifier>'
+           '<dc:title>bench</dc:title><dc:language>en</dc:language></metadata>\n'
+           '<manifest>\n%s\n</manifest>\n<spine>\n%s\n</spine>\n</package>\n') % ("\n".join(items), "\n".join(itemrefs))
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr("mimetype", "application/epub+zip", zipfile.ZIP_STORED)
+        zf.writestr("META-INF/container.xml", CONTAINER_XML)
+        zf.writestr("OEBPS/content.opf", opf)
+        zf.writestr("OEBPS/style.css", "body { background: url(img0.jpg); }\n")
+        for j in range(images):
+            zf.writestr("OEBPS/img%d.jpg" % j, b"\xff\xd8\xff")
+        for i in range(chapters):
+            links = ['<a href="chapter%d.xhtml#p%d">%d</a>' % ((i + k) % chapters, k, k) for k in range(LINKS_PER_CHAPTER - 5)]
+            links += ['<img src="img%d.jpg" alt=""/>' % ((i + k) % images) for k in range(4)]
+            zf.writestr("OEBPS/chapter%d.xhtml" % i,
+                        '<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n'
+                        '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>%d</title>'
+                        '<link href="style.css" type="text/css" rel="stylesheet"/></head>\n'
+                        '<body><p>%s</p></body></html>\n' % (i, "".join(links)))
+    return buf.getvalue()
+
+
+def open_book(epub_path):
+    with zipfile.ZipFile(epub_path) as zf:
+        opf_data = zf.read("OEBPS/content.opf")
+    op = Opf_Parser("OEBPS/content.opf", "OEBPS/content.opf", opf_data=opf_data)
+    return Wrapper("", epub_path, "", op, "", "", backend="memory")
+
+
+def use_path_functions(module):
+    for name in PATH_FUNCTIONS:
+        for target in (wrapper, epub_utils):
+            setattr(target, name, getattr(module, name))
+
+
+def time_links(chapters, module=hrefutils):
+    """seconds for resolving every link of the book and building the relative
+    path back from its chapter with the module functions, then with a new
+    PathResolver and again with its caches warm"""
+    links = [('OEBPS/Text/chapter%04d.xhtml' % i, 'OEBPS/Text') for i in range(chapters)]
+    hrefs = ['../Images/img%03d.jpg' % j for j in range(LINKS_PER_CHAPTER // 2)]
+    hrefs += ['chapter%04d.xhtml' % j for j in range(LINKS_PER_CHAPTER // 2)]
+
+    def resolve_links(build_bookpath, build_relativepath):
+        start = time.perf_counter()
+        for bkpath, start_dir in links:
+            for href in hrefs:
+                build_relativepath(bkpath, build_bookpath(href, start_dir))
+        return time.perf_counter() - start
+
+    functions = resolve_links(module.buildBookPath, module.buildRelativePath)
+    if module is not hrefutils:
+        return functions, None, None
+    resolver = PathResolver()
+    cold = resolve_links(resolver.build_bookpath, resolver.build_relativepath)
+    return functions, cold, resolve_links(resolver.build_bookpath, resolver.build_relativepath)
+
+
+def chapter_texts(epub_path, chapters):
+    with zipfile.ZipFile(epub_path) as zf:
+        return [("c%d" % i, "OEBPS/chapter%d.xhtml" % i, zf.read("OEBPS/chapter%d.xhtml" % i).decode("utf-8"))
+                for i in range(chapters)]
+
+
+def time_graph(texts, module=hrefutils):
+    """seconds for building a link graph over texts, resolving its links with
+    the graph's own PathResolver or with module.buildBookPath"""
+    graph = LinkGraph()
+    if module is not hrefutils:
+        graph._paths = types.SimpleNamespace(build_bookpath=module.buildBookPath)
+    start = time.perf_counter()
+    for id, bookpath, text in texts:
+        graph.add(id, bookpath, "application/xhtml+xml", text)
+    return time.perf_counter() - start, graph
+
+
+def time_standardize(epub_path, module=hrefutils):
+    w = open_book(epub_path)
+    use_path_functions(module)
+    try:
+        start = time.perf_counter()
+        w.standardize_epub()
+        return time.perf_counter() - start
+    finally:
+        use_path_functions(hrefutils)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Time the hrefutils path helpers on a link-heavy book.")
+    ap.add_argument("--reference", help="another hrefutils.py to compare against")
+    ap.add_argument("--rounds", type=int, default=5)
+    ap.add_argument("--chapters", type=int, default=2000)
+    args = ap.parse_args(argv)
+
+    reference = load_reference(args.reference) if args.reference else None
+    fd, epub_path = tempfile.mkstemp(suffix=".epub")
+    with os.fdopen(fd, "wb") as fp:
+        fp.write(link_heavy_book(args.chapters))
+    # the implementations take turns within each round so load on the
+    # machine hits them alike, the fastest round is kept
+    best = {}
+
+    def keep(name, elapsed):
+        best[name] = min(best.get(name, elapsed), elapsed)
+
+    try:
+        texts = chapter_texts(epub_path, args.chapters)
+        if reference is not None:
+            graph, ref_graph = time_graph(texts)[1], time_graph(texts, reference)[1]
+            if any(graph.links_from(id) != ref_graph.links_from(id) for id, bookpath, text in texts):
+                print("    link graph differs from the reference")
+                return 1
+        for _ in range(args.rounds):
+            functions, cold, warm = time_links(args.chapters)
+            keep("links", functions)
+            keep("links resolver", cold)
+            keep("links warm", warm)
+            keep("graph", time_graph(texts)[0])
+            keep("standardize", time_standardize(epub_path))
+            if reference is not None:
+                keep("ref links", time_links(args.chapters, reference)[0])
+                keep("ref graph", time_graph(texts, reference)[0])
+                keep("ref standardize", time_standardize(epub_path, reference))
+    finally:
+        os.remove(epub_path)
+
+    print("%d chapters, %d links each, best of %d rounds" % (args.chapters, LINKS_PER_CHAPTER, args.rounds))
+    for name, elapsed in best.items():
+        print("    %-16s %8.3f s" % (name, elapsed))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
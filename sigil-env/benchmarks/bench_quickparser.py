@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+"""Time QuickXHTMLParser on real xhtml documents.
+
+    python benchmarks/bench_quickparser.py [--reference OLD.py] [--rounds N] [FILE ...]
+
+FILE is an .xhtml/.html file or an .epub, whose xhtml members are all used.
+Without FILE the documents in benchmarks/data are parsed.
+
+--reference loads another copy of quickparser.py, times parse_iter on the
+same documents, checks it yields the same tokens and prints the speedup.
+To compare against an older tokenizer:
+
+    git show <commit>:sigil-env/src/sigil_env/quickparser.py > /tmp/quickparser_old.py
+    python benchmarks/bench_quickparser.py --reference /tmp/quickparser_old.py
+"""
+
+import argparse
+import glob
+import importlib.util
+import os
+import sys
+import time
+import zipfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "src", "sigil_env"))
+
+from quickparser import QuickXHTMLParser
+
+
+def load_documents(paths):
+    docs = []
+    for path in paths:
+        if path.lower().endswith(".epub"):
+            with zipfile.ZipFile(path) as zf:
+                for name in zf.namelist():
+                    if name.lower().endswith((".xhtml", ".html", ".htm")):
+                        docs.append((path + "!" + name, zf.read(name).decode("utf-8")))
+        else:
+            with open(path, "rb") as fp:
+                docs.append((path, fp.read().decode("utf-8")))
+    return docs
+
+
+def load_reference(path):
+    spec = importlib.util.spec_from_file_location("quickparser_reference", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.QuickXHTMLParser
+
+
+def tokens(parser_class, text):
+    qp = parser_class()
+    qp.setContent(text)
+    return list(qp.parse_iter())
+
+
+# fastest of rounds, in seconds, for one pass of each run over all documents.
+# The runs take turns within each round so load on the machine hits them alike
+def best_times(runs, docs, rounds):
+    best = [None] * len(runs)
+    for _ in range(rounds):
+        for i, run in enumerate(runs):
+            start = time.perf_counter()
+            for name, text in docs:
+                run(text)
+            elapsed = time.perf_counter() - start
+            if best[i] is None or elapsed < best[i]:
+                best[i] = elapsed
+    return best
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Time QuickXHTMLParser on real xhtml documents.")
+    ap.add_argument("files", nargs="*", help="xhtml files or epubs, default benchmarks/data/*.xhtml")
+    ap.add_argument("--reference", help="another quickparser.py to compare against")
+    ap.add_argument("--rounds", type=int, default=20)
+    args = ap.parse_args(argv)
+
+    paths = args.files or sorted(glob.glob(os.path.join(HERE, "data", "*.xhtml")))
+    docs = load_documents(paths)
+    ntokens = sum(len(tokens(QuickXHTMLParser, text)) for name, text in docs)
+    nchars = sum(len(text) for name, text in docs)
+    print("%d documents, %d characters, %d tokens, best of %d rounds" % (len(docs), nchars, ntokens, args.rounds))
+
+    def parse_iter(parser_class):
+        def run(text):
+            qp = parser_class()
+            qp.setContent(text)
+            for token in qp.parse_iter():
+                pass
+        return run
+
+    def token_iter(text):
+        qp = QuickXHTMLParser()
+        qp.setContent(text)
+        for token in qp.token_iter():
+            pass
+
+    runs = [parse_iter(QuickXHTMLParser), token_iter]
+    if args.reference:
+        reference_class = load_reference(args.reference)
+        for name, text in docs:
+            if tokens(reference_class, text) != tokens(QuickXHTMLParser, text):
+                print("    tokens differ from the reference on %s" % name)
+                return 1
+        runs.append(parse_iter(reference_class))
+    times = best_times(runs, docs, args.rounds)
+    for label, elapsed in zip(("parse_iter", "token_iter", "reference"), times):
+        print("    %-10s  %8.2f ms  %6.2f us/token" % (label, elapsed * 1e3, elapsed / ntokens * 1e6))
+    if args.reference:
+        print("    speedup: parse_iter %.2fx, token_iter %.2fx" % (times[2] / times[0], times[2] / times[1]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
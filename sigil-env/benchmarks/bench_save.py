@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+"""Time Wrapper.save_as on an image-heavy book with one edited chapter.
+
+    python benchmarks/bench_save.py [--reference OLD.py] [--rounds N] [--images N] [--image-size KB]
+
+The book has 50 chapters and --images incompressible images.  Each round
+opens it on every backend, rewrites one chapter and times save_as alone.
+
+--reference loads another copy of wrapper.py, runs the same edit and save
+through it on an extracted workspace (the only mode older wrappers have)
+and checks both saved books hold the same files:
+
+    git show <commit>:sigil-env/src/sigil_env/wrapper.py > /tmp/wrapper_old.py
+    python benchmarks/bench_save.py --reference /tmp/wrapper_old.py
+"""
+
+import argparse
+import importlib.util
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "src", "sigil_env"))
+
+from opf_parser import Opf_Parser
+from wrapper import Wrapper
+
+CHAPTERS = 50
+BACKENDS = ("disk", "zip", "memory")
+
+CONTAINER_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+'''
+
+XHTML = ('<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n'
+         '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>%d</title></head>\n'
+         '<body>%s</body></html>\n')
+
+
+def load_reference(path):
+    spec = importlib.util.spec_from_file_location("wrapper_reference", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.Wrapper
+
+
+def image_heavy_book(path, images, image_size):
+    rng = random.Random(0)
+    items = ['<item id="c%d" href="Text/c%d.xhtml" media-type="application/xhtml+xml"/>' % (i, i) for i in range(CHAPTERS)]
+    items += ['<item id="i%d" href="Images/i%d.jpg" media-type="image/jpeg"/>' % (j, j) for j in range(images)]
+    itemrefs = ['<itemref idref="c%d"/>' % i for i in range(CHAPTERS)]
+    opf = ('<?xml version="1.0" encoding="utf-8"?>\n'
+           '<package version="3.0" unique-identifier="uid" xmlns="http://www.idpf.org/2007/opf">\n'
+           '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:identifier id="uid">bench</dc:identifier>'
+           '<dc:title>bench</dc:title><dc:language>en</dc:language></metadata>\n'
+           '<manifest>\n%s\n</manifest>\n<spine>\n%s\n</spine>\n</package>\n') % ("\n".join(items), "\n".join(itemrefs))
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("mimetype", "application/epub+zip", zipfile.ZIP_STORED)
+        zf.writestr("META-INF/container.xml", CONTAINER_XML)
+        zf.writestr("OEBPS/content.opf", opf)
+        for i in range(CHAPTERS):
+            zf.writestr("OEBPS/Text/c%d.xhtml" % i, XHTML % (i, "<p>chapter %d</p>" % i * 200))
+        for j in range(images):
+            zf.writestr("OEBPS/Images/i%d.jpg" % j, rng.randbytes(image_size))
+
+
+def open_book(wrapper_class, epub_src, workdir, backend):
+    """A wrapper on epub_src with workdir as its workspace, as Ebook sets it up.
+    backend None opens an older wrapper without backends on an extracted copy."""
+    ebook_root = outdir = ""
+    mode = backend or "disk"
+    if mode != "memory":
+        outdir = os.path.join(workdir, "outdir")
+        os.makedirs(outdir)
+    with zipfile.ZipFile(epub_src) as zf:
+        opf_data = zf.read("OEBPS/content.opf")
+        if mode == "disk":
+            ebook_root = os.path.join(workdir, "ebook")
+            zf.extractall(ebook_root)
+    op = Opf_Parser(os.path.join(ebook_root, "OEBPS", "content.opf"), "OEBPS/content.opf", opf_data=opf_data)
+    if backend is None:
+        return wrapper_class(ebook_root, epub_src, outdir, op, "", "")
+    return wrapper_class(ebook_root, epub_src, outdir, op, "", "", backend=backend)
+
+
+def time_save(wrapper_class, epub_src, tmpdir, backend):
+    workdir = tempfile.mkdtemp(dir=tmpdir)
+    try:
+        w = open_book(wrapper_class, epub_src, workdir, backend)
+        w.writefile("c0", XHTML % (0, "<p>edited</p>"))
+        save_path = os.path.join(workdir, "saved.epub")
+        start = time.perf_counter()
+        w.save_as(save_path)
+        elapsed = time.perf_counter() - start
+        with zipfile.ZipFile(save_path) as zf:
+            contents = {info.filename: zf.read(info) for info in zf.infolist()}
+        del w
+        return elapsed, contents
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Time Wrapper.save_as on an image-heavy book.")
+    ap.add_argument("--reference", help="another wrapper.py to compare against")
+    ap.add_argument("--rounds", type=int, default=5)
+    ap.add_argument("--images", type=int, default=200)
+    ap.add_argument("--image-size", type=int, default=100, help="KB per image")
+    args = ap.parse_args(argv)
+
+    reference = load_reference(args.reference) if args.reference else None
+    tmpdir = tempfile.mkdtemp()
+    try:
+        epub_src = os.path.join(tmpdir, "book.epub")
+        image_heavy_book(epub_src, args.images, args.image_size * 1024)
+        # the implementations take turns within each round so load on the
+        # machine hits them alike, the fastest round is kept
+        best = {}
+        for _ in range(args.rounds):
+            saved = {}
+            for backend in BACKENDS:
+                elapsed, saved[backend] = time_save(Wrapper, epub_src, tmpdir, backend)
+                best[backend] = min(best.get(backend, elapsed), elapsed)
+            if reference is not None:
+                elapsed, contents = time_save(reference, epub_src, tmpdir, None)
+                best["reference"] = min(best.get("reference", elapsed), elapsed)
+                for backend in BACKENDS:
+                    if saved[backend] != contents:
+                        print("    %s save differs from the reference" % backend)
+                        return 1
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    print("%d chapters, %d images of %d KB, one chapter edited, best of %d rounds"
+          % (CHAPTERS, args.images, args.image_size, args.rounds))
+    for name, elapsed in best.items():
+        line = "    %-10s %8.3f s" % (name, elapsed)
+        if "reference" in best and name != "reference":
+            line += "  %5.1fx" % (best["reference"] / elapsed)
+        print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
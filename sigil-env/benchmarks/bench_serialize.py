@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+"""Time sigil_bs4 serialize_xhtml and prettyprint_xhtml on a large chapter.
+
+    python benchmarks/bench_serialize.py [--reference OLD.py] [--rounds N] [--size KB] [--parser NAME]
+
+The chapter repeats the bodies of the documents in benchmarks/data until it
+is --size KB (1 MB by default) and is parsed once with --parser.
+
+--reference loads another copy of sigil_bs4/element.py, swaps its Tag
+methods in, checks both serializers give the same output and times it too:
+
+    git show <commit>:sigil-env/src/sigil_env/sigil_bs4/element.py > /tmp/element_old.py
+    python benchmarks/bench_serialize.py --reference /tmp/element_old.py
+"""
+
+import argparse
+import glob
+import importlib.util
+import os
+import re
+import sys
+import time
+import types
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "src", "sigil_env"))
+
+from sigil_bs4 import BeautifulSoup, element
+
+BODY = re.compile(r"<body[^>]*>(.*)</body>", re.S)
+
+HEAD = ('<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n'
+        '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">\n'
+        '<head>\n  <title>bench</title>\n'
+        '  <link href="../Styles/stylesheet.css" type="text/css" rel="stylesheet"/>\n</head>\n<body>\n')
+
+
+def large_chapter(size):
+    bodies = []
+    for path in sorted(glob.glob(os.path.join(HERE, "data", "*.xhtml"))):
+        with open(path, "rb") as fp:
+            m = BODY.search(fp.read().decode("utf-8"))
+        if m:
+            bodies.append(m.group(1))
+    pieces = [HEAD]
+    length = len(HEAD)
+    while length < size:
+        for body in bodies:
+            pieces.append("<div>%s</div>\n" % body)
+            length += len(body) + 13
+    pieces.append("</body>\n</html>\n")
+    return "".join(pieces)
+
+
+# another element.py, its module level classes replaced by the current ones so
+# its Tag methods can run on trees built by the current sigil_bs4
+def load_reference(path):
+    spec = importlib.util.spec_from_file_location("element_reference", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    methods = {name: value for name, value in vars(module.Tag).items() if isinstance(value, types.FunctionType)}
+    for name, value in vars(element).items():
+        if isinstance(value, type) and hasattr(module, name):
+            setattr(module, name, value)
+    return methods
+
+
+def use_tag_methods(methods):
+    """Set methods on Tag and return what they replaced, for restoring."""
+    saved = {name: vars(element.Tag).get(name) for name in methods}
+    for name, value in methods.items():
+        if value is None:
+            delattr(element.Tag, name)
+        else:
+            setattr(element.Tag, name, value)
+    return saved
+
+
+def outputs(soup):
+    return soup.serialize_xhtml(), soup.prettyprint_xhtml()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Time sigil_bs4 serialize_xhtml and prettyprint_xhtml.")
+    ap.add_argument("--reference", help="another sigil_bs4/element.py to compare against")
+    ap.add_argument("--rounds", type=int, default=5)
+    ap.add_argument("--size", type=int, default=1024, help="KB of xhtml")
+    ap.add_argument("--parser", default="html.parser", help="sigil_bs4 tree builder, lxml if installed")
+    args = ap.parse_args(argv)
+
+    text = large_chapter(args.size * 1024)
+    soup = BeautifulSoup(text, args.parser)
+    print("%d KB chapter, %d tags, %s, best of %d rounds"
+          % (len(text) // 1024, len(soup.find_all(True)), args.parser, args.rounds))
+
+    impls = [("current", None)]
+    if args.reference:
+        reference = load_reference(args.reference)
+        expected = outputs(soup)
+        saved = use_tag_methods(reference)
+        try:
+            if outputs(soup) != expected:
+                print("    output differs from the reference")
+                return 1
+        finally:
+            use_tag_methods(saved)
+        impls.append(("reference", reference))
+
+    # the implementations take turns within each round so load on the
+    # machine hits them alike, the fastest round is kept
+    best = {}
+    for _ in range(args.rounds):
+        for name, methods in impls:
+            saved = use_tag_methods(methods) if methods else None
+            try:
+                for label, run in (("serialize", soup.serialize_xhtml), ("prettyprint", soup.prettyprint_xhtml)):
+                    start = time.perf_counter()
+                    run()
+                    elapsed = time.perf_counter() - start
+                    key = (label, name)
+                    best[key] = min(best.get(key, elapsed), elapsed)
+            finally:
+                if saved is not None:
+                    use_tag_methods(saved)
+
+    for label in ("serialize", "prettyprint"):
+        line = "    %-12s %8.3f s" % (label, best[(label, "current")])
+        if args.reference:
+            ref = best[(label, "reference")]
+            line += "  reference %8.3f s  %5.2fx" % (ref, ref / best[(label, "current")])
+        print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+"""Time deleting spine items from a book with many chapters.
+
+    python benchmarks/bench_spine.py [--reference OLD.py] [--rounds N] [--chapters N]
+
+The book has --chapters chapters (10000 by default), all in the spine.  Each
+round opens it on the memory backend and times two cases:
+  deletefile    deletefile on every other chapter, half of the spine
+  itemref       setspine_itemref_epub3_attributes on every remaining chapter
+
+--reference loads another copy of wrapper.py, runs the same edits through
+it and checks both end up with the same spine:
+
+    git show <commit>:sigil-env/src/sigil_env/wrapper.py > /tmp/wrapper_old.py
+    python benchmarks/bench_spine.py --reference /tmp/wrapper_old.py
+"""
+
+import argparse
+import importlib.util
+import io
+import os
+import sys
+import tempfile
+import time
+import zipfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "src", "sigil_env"))
+
+from opf_parser import Opf_Parser
+from wrapper import Wrapper
+
+CONTAINER_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+'''
+
+XHTML = ('<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n'
+         '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>%d</title></head>\n'
+         '<body><p>%d</p></body></html>\n')
+
+
+def load_reference(path):
+    spec = importlib.util.spec_from_file_location("wrapper_reference", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.Wrapper
+
+
+def many_chapters_book(chapters):
+    items = ['<item id="c%d" href="Text/c%d.xhtml" media-type="application/xhtml+xml"/>' % (i, i) for i in range(chapters)]
+    itemrefs = ['<itemref idref="c%d"/>' % i for i in range(chapters)]
+    opf = ('<?xml version="1.0" encoding="utf-8"?>\n'
+           '<package version="3.0" unique-identifier="uid" xmlns="http://www.idpf.org/2007/opf">\n'
+           '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:identifier id="uid">bench</dc:identifier>'
+           '<dc:title>bench</dc:title><dc:language>en</dc:language></metadata>\n'
+           '<manifest>\n%s\n</manifest>\n<spine>\n%s\n</spine>\n</package>\n') % ("\n".join(items), "\n".join(itemrefs))
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr("mimetype", "application/epub+zip", zipfile.ZIP_STORED)
+        zf.writestr("META-INF/container.xml", CONTAINER_XML)
+        zf.writestr("OEBPS/content.opf", opf)
+        for i in range(chapters):
+            zf.writestr("OEBPS/Text/c%d.xhtml" % i, XHTML % (i, i))
+    return buf.getvalue()
+
+
+def open_book(wrapper_class, epub_path, opf_data):
+    op = Opf_Parser("OEBPS/content.opf", "OEBPS/content.opf", opf_data=opf_data)
+    return wrapper_class("", epub_path, "", op, "", "", backend="memory")
+
+
+def time_edits(wrapper_class, epub_path, opf_data, chapters):
+    """(deletefile seconds, itemref seconds, resulting spine)"""
+    w = open_book(wrapper_class, epub_path, opf_data)
+    start = time.perf_counter()
+    for i in range(0, chapters, 2):
+        w.deletefile("c%d" % i)
+    deleted = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(1, chapters, 2):
+        w.setspine_itemref_epub3_attributes("c%d" % i, "no", "page-spread-left")
+    updated = time.perf_counter() - start
+    return deleted, updated, w.getspine_epub3()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Time deleting spine items from a book with many chapters.")
+    ap.add_argument("--reference", help="another wrapper.py to compare against")
+    ap.add_argument("--rounds", type=int, default=3)
+    ap.add_argument("--chapters", type=int, default=10000)
+    args = ap.parse_args(argv)
+
+    impls = [("current", Wrapper)]
+    if args.reference:
+        impls.append(("reference", load_reference(args.reference)))
+    data = many_chapters_book(args.chapters)
+    fd, epub_path = tempfile.mkstemp(suffix=".epub")
+    with os.fdopen(fd, "wb") as fp:
+        fp.write(data)
+    with zipfile.ZipFile(epub_path) as zf:
+        opf_data = zf.read("OEBPS/content.opf")
+    # the implementations take turns within each round so load on the
+    # machine hits them alike, the fastest round is kept
+    best = {}
+    try:
+        for _ in range(args.rounds):
+            spines = []
+            for name, wrapper_class in impls:
+                deleted, updated, spine = time_edits(wrapper_class, epub_path, opf_data, args.chapters)
+                best[("deletefile", name)] = min(best.get(("deletefile", name), deleted), deleted)
+                best[("itemref", name)] = min(best.get(("itemref", name), updated), updated)
+                spines.append(spine)
+            if any(spine != spines[0] for spine in spines):
+                print("    spine differs from the reference")
+                return 1
+    finally:
+        os.remove(epub_path)
+
+    print("%d chapters, %d spine items deleted, best of %d rounds"
+          % (args.chapters, (args.chapters + 1) // 2, args.rounds))
+    for label in ("deletefile", "itemref"):
+        line = "    %-10s %8.3f s" % (label, best[(label, "current")])
+        if args.reference:
+            ref = best[(label, "reference")]
+            line += "  reference %8.3f s  %6.1fx" % (ref, ref / best[(label, "current")])
+        print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
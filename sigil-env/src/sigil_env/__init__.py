@@ -7,6 +7,8 @@ sys.path.append(curdir)
 sys.path.append(realpath(join(curdir,"plugin_launchers")))
 
 from .launcher import Ebook
+from .batch import BookResult, iter_batch, run_batch
+from .opf_cache import OpfCache
 
 
-__all__ = ["Ebook"]
\ No newline at end of file
+__all__ = ["Ebook", "BookResult", "iter_batch", "run_batch", "OpfCache"]
\ No newline at end of file
@@ -0,0 +1,107 @@
+import os
+import gc
+import time
+import shutil
+import tempfile
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from .launcher import Ebook
+
+# 批量处理的单本结果，result 为 run(bk) 的返回值，出错时 error 为异常的 traceback 文本
+# timings 记录 open（打开epub）、run（执行插件）两个阶段的耗时（秒），elapsed 为总耗时
+class BookResult:
+    def __init__(self, epub_src, result=None, error=None, timings=None):
+        self.epub_src = epub_src
+        self.result = result
+        self.error = error
+        self.timings = timings or {}
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def elapsed(self):
+        return sum(self.timings.values())
+
+    def __repr__(self):
+        state = "ok" if self.ok else "error"
+        return "BookResult(%r, %s, %.3fs)" % (self.epub_src, state, self.elapsed)
+
+
+# 在子进程中处理一本书，每本书使用独立的临时工作区，处理结束后删除
+def _process_book(epub_src, run, plugin_type, backend, workspace_root, opf_cache):
+    timings = {}
+    workspace = tempfile.mkdtemp(prefix="__temp_workspace__", dir=workspace_root)
+    bk = None
+    try:
+        start = time.perf_counter()
+        bk = Ebook(epub_src, plugin_type, backend=backend, workspace=workspace, opf_cache=opf_cache)
+        timings["open"] = time.perf_counter() - start
+        start = time.perf_counter()
+        try:
+            result = run(bk)
+        finally:
+            timings["run"] = time.perf_counter() - start
+        return BookResult(epub_src, result=result, timings=timings)
+    except Exception:
+        return BookResult(epub_src, error=traceback.format_exc(), timings=timings)
+    finally:
+        # 先释放 Wrapper 关闭源epub，再清理工作区
+        del bk
+        gc.collect()
+        shutil.rmtree(workspace, ignore_errors=True)
+
+
+# 按完成顺序逐本返回 BookResult，同时在途（已提交未完成）的书不超过 max_in_flight 本，
+# 用于控制内存占用：每本书的数据只在其进程内存在，结果返回后即释放。
+def iter_batch(epub_paths, run, workers:int=None, max_in_flight:int=None, plugin_type:str="edit", backend:str="disk", workspace:str=None, opf_cache:str=""):
+    '''
+    epub_paths\xa0\xa0\xa0\xa0\xa0\xa0epub路径的可迭代对象，按需读取，可以是生成器。\n
+    run\xa0\xa0\xa0\xa0\xa0\xa0\xa0\xa0\xa0\xa0\xa0\xa0\xa0\xa0\xa0\xa0插件函数 run(bk)，须为模块顶层函数（可被 pickle），返回值也须可被 pickle。\n
+    workers\xa0\xa0\xa0\xa0\xa0\xa0\xa0\xa0\xa0\xa0进程数，默认为 cpu 核心数。\n
+    max_in_flight\xa0同时提交的最大书数，默认为 workers 的两倍。\n
+    plugin_type\xa0\xa0\xa0\xa0插件类型，同 Ebook 。\n
+    backend\xa0\xa0\xa0\xa0\xa0\xa0\xa0\xa0\xa0工作区模式，同 Ebook 。\n
+    workspace\xa0\xa0\xa0\xa0\xa0临时工作区所在目录，默认为系统临时目录，每本书在其中创建独立的子目录。\n
+    opf_cache\xa0\xa0\xa0\xa0\xa0OPF 解析结果的缓存目录，同 Ebook ，多个进程可以共用同一个缓存目录。
+    '''
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if max_in_flight is None:
+        max_in_flight = workers * 2
+    max_in_flight = max(max_in_flight, 1)
+    epub_paths = iter(epub_paths)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        while True:
+            while len(pending) < max_in_flight:
+                epub_src = next(epub_paths, None)
+                if epub_src is None:
+                    break
+                epub_src = os.path.realpath(epub_src)
+                future = pool.submit(_process_book, epub_src, run, plugin_type, backend, workspace, opf_cache)
+                pending[future] = epub_src
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                epub_src = pending.pop(future)
+                try:
+                    yield future.result()
+                except Exception:
+                    # 子进程崩溃或结果无法 pickle 等情况
+                    yield BookResult(epub_src, error=traceback.format_exc())
+
+
+# 批量处理多本epub，返回与 epub_paths 顺序一致的 BookResult 列表
+def run_batch(epub_paths, run, workers:int=None, max_in_flight:int=None, plugin_type:str="edit", backend:str="disk", workspace:str=None, opf_cache:str=""):
+    '''
+    参数同 iter_batch ，返回与 epub_paths 顺序一致的 BookResult 列表。
+    '''
+    epub_paths = [os.path.realpath(path) for path in epub_paths]
+    results = {}
+    for book_result in iter_batch(epub_paths, run, workers, max_in_flight, plugin_type, backend, workspace, opf_cache):
+        results.setdefault(book_result.epub_src, []).append(book_result)
+    return [results[path].pop(0) for path in epub_paths]
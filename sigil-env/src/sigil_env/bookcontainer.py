@@ -151,7 +151,11 @@ class BookContainer(object):
     # New for epub3
     def setspine_idref_epub3_attributes(self, idref:str, linear:str, properties:str):
         '''set the spine with provided idref with linear and properties values'''
-        self._w.setspine_idref_attributes(idref, linear, properties)
+        self._w.setspine_itemref_epub3_attributes(idref, linear, properties)
+
+    def spine_contains(self, idref:str):
+        '''returns True if the manifest id is referenced in the spine'''
+        return self._w.spine_contains(idref)
 
 
 # guide get/set
@@ -251,6 +255,17 @@ class BookContainer(object):
         # creates a new file in the manifest with unique manifest id, basename, data, and mimetype
         self._w.addfile(uniqueid, basename, data, mime, properties, fallback, overlay)
 
+    def addfiles(self, files:typing.Iterable[tuple], spine:bool=False, workers:int=None):
+        '''
+        批量添加文件，files 的每一项为 addfile 的参数元组：\n
+        (uniqueid, basename, data[, mime[, properties[, fallback[, overlay]]]])\n
+        所有 id 和文件名会在写入前一次性检查，任一项重复则全部不添加。\n
+        spine\xa0\xa0\xa0\xa0\xa0\xa0\xa0\xa0\xa0为 True 时按顺序将新文件追加到 spine 末尾。\n
+        workers\xa0\xa0\xa0\xa0\xa0写出文件内容的线程数，默认由线程池决定，小于等于 1 时单线程写出。\n
+        返回新文件的 manifest id 列表。
+        '''
+        return self._w.addfiles(files, spine, workers)
+
     def deletefile(self, id:str):
         '''removes the file associated with that manifest id unicode string and removes any existing spine entries as well'''
         # removes the file associated with that manifest id, removes any existing spine entries as well
@@ -470,9 +485,10 @@ class BookContainer(object):
         '''given a manifest id, return the media-type, if the manifest_id does not exist return ow'''
         return self._w.map_id_to_mime(id, ow)
 
-    def basename_to_id(self, basename, ow=None):
-        '''given a file's basename (with extension) return its manifest id, otherwise return ow'''
-        return self._w.map_basename_to_id(basename, ow)
+    def basename_to_id(self, basename, ow=None, ci=False):
+        '''given a file's basename (with extension) return its manifest id, otherwise return ow\n
+        if ci is True the basename is matched case-insensitively'''
+        return self._w.map_basename_to_id(basename, ow, ci)
 
     def id_to_href(self, id, ow=None):
         '''given a manifest_id return its OPF href, otherwise return ow'''
@@ -596,6 +612,12 @@ class BookContainer(object):
         '''
         return self._w.map_bookpath_to_id(bookpath, ow)
 
+    # 大小写不敏感地检查 bookpath 是否已存在于 manifest 中，
+    # 用于避免在大小写不敏感的文件系统（Windows、macOS）上出现同名文件
+    def bookpath_exists_ci(self, bookpath):
+        '''returns True if a file in the OPF manifest has this bookpath, ignoring case'''
+        return self._w.map_bookpath_ci_to_id(bookpath, None) is not None
+
     def id_to_bookpath(self, id, ow=None):
         '''
         looks up the provided manifest id and returns the corresponding bookpath of the file\n
@@ -630,13 +652,68 @@ class BookContainer(object):
         '''Newly Added to Support Plugins running in Automate Lists'''
         return self._w.automate_parameter
     
-    def save_as(self,save_path:str=""):
+    def save_as(self,save_path:str="",workers:int=None,compress_policy:typing.Callable=None,incremental:bool=False):
         '''
         将处理过的EPUB保存到指定路径（带文件名）。\n
-        save_path\xa0\xa0\xa0\xa0指定保存路径，未指定时默认保存至同级OUTPUT目录下的同名EPUB文件。
+        save_path\xa0\xa0\xa0\xa0\xa0\xa0\xa0\xa0\xa0\xa0指定保存路径，未指定时默认保存至同级OUTPUT目录下的同名EPUB文件。\n
+        workers\xa0\xa0\xa0\xa0\xa0\xa0\xa0\xa0\xa0\xa0\xa0\xa0\xa0压缩线程数，未指定时由线程池自动决定，1 表示单线程压缩。\n
+        compress_policy\xa0\xa0按文件路径返回 zipfile.ZIP_STORED 或 zipfile.ZIP_DEFLATED 的函数，未指定时图片、字体、音视频等已压缩格式不再压缩。\n
+        incremental\xa0\xa0\xa0\xa0\xa0\xa0覆盖上一次保存的EPUB时，只重写改动文件之后的部分，结果与完整保存相同。
         '''
-        return self._w.save_as(save_path)
+        return self._w.save_as(save_path, workers, compress_policy, incremental)
+
+    def memory_usage(self):
+        '''返回保存在内存中的文件数据大小（字节）。memory 模式下初始值约等于源EPUB的文件大小，可据此选择工作区模式。'''
+        return self._w.memory_usage()
 
-    def standardize_epub(self):
-        '''重构EPUB为Sigil规范格式'''
-        return self._w.standardize_epub()
\ No newline at end of file
+    def plan_standardize_epub(self):
+        '''
+        计算重构为Sigil规范格式需要的文件移动和删除，不读取、不修改任何文件。\n
+        已经是规范格式时返回 None 。返回的计划可以传给 standardize_epub 执行，执行前不应再增删文件。
+        '''
+        return self._w.plan_standardize_epub()
+
+    def standardize_epub(self, workers:int=None, processes:bool=False, plan=None):
+        '''
+        重构EPUB为Sigil规范格式，返回执行的计划，已经是规范格式时返回 None 。\n
+        workers\xa0\xa0\xa0\xa0\xa0改写文件链接的线程数（processes 为 True 时为进程数），默认由线程池或进程池决定。\n
+        processes\xa0\xa0\xa0在多个进程中改写文件链接，适合文件数量很多的书。各文件的改写结果与线程模式完全一致。\n
+        plan\xa0\xa0\xa0\xa0\xa0\xa0\xa0\xa0plan_standardize_epub 返回的计划，默认重新计算。
+        '''
+        return self._w.standardize_epub(workers, processes, plan)
+
+    # 链接图：xhtml、svg、css、ncx 中的 href/src/url()/@import 引用，第一次查询时建立，
+    # 之后 writefile、addfile、deletefile 等修改只会重新扫描涉及的文件
+    def build_link_graph(self):
+        '''立即建立链接图，不调用时在第一次查询时建立。'''
+        self._w.build_link_graph()
+
+    def links_from(self, id):
+        '''
+        返回 id 对应文件中的链接 [(target_bookpath, fragment, href, kind, start, end)] ，按在文件中出现的顺序排列。\n
+        fragment 为 # 之后的部分（已还原 xml 实体并解码），没有时为 None ；href 为文件中的原始链接文本；\n
+        kind 为 href、src、xlink:href、poster、url 或 import ；start、end 为 href 在文件文本（readfile 的结果）中的位置。\n
+        外部链接和只有 fragment 的文件内链接不包括在内。
+        '''
+        return self._w.links_from(id)
+
+    def links_to(self, id):
+        '''返回指向 id 对应文件的链接 [(source_id, fragment, href, kind, start, end)] ，各项含义同 links_from 。'''
+        return self._w.links_to(id)
+
+    def links_to_bookpath(self, bookpath):
+        '''同 links_to ，按 bookpath 查询，可用于查找不在 manifest 中的文件或失效链接的来源。'''
+        return self._w.links_to_bookpath(bookpath)
+
+    def linking_ids(self, id):
+        '''返回链接到 id 对应文件的所有文件的 id 。'''
+        return self._w.linking_ids(id)
+
+    def move_files(self, mapping:dict, workers:int=None):
+        '''
+        批量移动 manifest 中的文件，id、属性和 spine 位置保持不变，返回内容被改写的文件的 id 列表。\n
+        mapping\xa0\xa0\xa0\xa0\xa0{旧 bookpath: 新 bookpath} ，可以互换位置。\n
+        workers\xa0\xa0\xa0\xa0\xa0改写文件链接的线程数，默认由线程池决定。\n
+        引用了被移动文件的 xhtml、svg、css、ncx 以及被移动文件自身的相对链接都会改写，guide 同时更新。
+        '''
+        return self._w.move_files(mapping, workers)
@@ -29,11 +29,18 @@
 import os
 import binascii
 import re
+import shutil
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from itertools import cycle
 
 import zipfile
 from zipfile import ZipFile
 
+from hrefutils import urldecodepart, buildBookPath, startingDir, PathResolver
+
 import hashlib
 
 def SHA1(message):
@@ -76,19 +83,349 @@ def unzip_epub_to_dir(path_to_epub, destdir):
     f.close()
 
 
-def epub_zip_up_book_contents(ebook_path, epub_filepath):
-    outzip = zipfile.ZipFile(os.fsdecode(epub_filepath), 'w')
+# update the archive at zip_path in place so that it holds members, where srczip is
+# that same archive opened for reading. The leading members that are raw copies of
+# the archive's own entries in their current order are left untouched on disk and
+# only the remaining tail and the central directory are rewritten. The result is
+# identical to writing members into a new archive with zip_write_members.
+def zip_update_members(zip_path, srczip, members, workers=None, compress_policy=None):
+    if not _zip_raw_writable(srczip):
+        # no way to truncate the archive here, write the whole of it instead
+        update_path = zip_path + '.update'
+        try:
+            with zipfile.ZipFile(update_path, 'w') as outzip:
+                zip_write_members(outzip, members, workers, compress_policy)
+            srczip.close()
+            os.replace(update_path, zip_path)
+        finally:
+            if os.path.exists(update_path):
+                os.remove(update_path)
+        return
+    infos = srczip.infolist()
+    prefix = 0
+    while prefix < len(members) and prefix < len(infos):
+        arcname, source = members[prefix]
+        if callable(source) or source[0] is not srczip or source[1] is not infos[prefix]:
+            break
+        if arcname != infos[prefix].filename:
+            break
+        prefix += 1
+    if prefix < len(infos):
+        keep_offset = infos[prefix].header_offset
+    else:
+        keep_offset = srczip.start_dir
+    kept = [_zip_raw_info(info) for info in infos[:prefix]]
+    for zinfo, info in zip(kept, infos[:prefix]):
+        zinfo.header_offset = info.header_offset
+    tail = members[prefix:]
+
+    # the tail is about to be overwritten, so first copy its bytes out. The copy is
+    # the source of the unchanged tail members and is written back if the update fails,
+    # leaving the archive as it was
+    tail_path = zip_path + '.tail'
+    with open(zip_path, 'rb') as src_fp, open(tail_path, 'wb') as dst_fp:
+        src_fp.seek(keep_offset)
+        shutil.copyfileobj(src_fp, dst_fp, 1024 * 1024)
+    srczip.close()
+    # intact is cleared while the archive is being rewritten. A failed restore
+    # leaves the copy of the tail behind so the archive can still be recovered
+    intact = True
+    try:
+        with open(tail_path, 'rb') as tail_fp:
+            tailzip = zipfile.ZipFile(_TailFile(tail_fp, keep_offset), 'r')
+            new_tail = []
+            for arcname, source in tail:
+                if not callable(source) and source[0] is srczip:
+                    source = (tailzip, tailzip.getinfo(source[1].filename))
+                new_tail.append((arcname, source))
+            intact = False
+            try:
+                with zipfile.ZipFile(zip_path, 'a') as outzip:
+                    outzip.filelist = kept
+                    outzip.NameToInfo = {zinfo.filename: zinfo for zinfo in kept}
+                    outzip.start_dir = keep_offset
+                    outzip._didModify = True
+                    zip_write_members(outzip, new_tail, workers, compress_policy)
+            except BaseException:
+                with open(zip_path, 'r+b') as fp:
+                    fp.truncate(keep_offset)
+                    fp.seek(keep_offset)
+                    tail_fp.seek(0)
+                    shutil.copyfileobj(tail_fp, fp, 1024 * 1024)
+                intact = True
+                raise
+            finally:
+                tailzip.close()
+            intact = True
+    finally:
+        if intact:
+            os.remove(tail_path)
+
+
+# a read only file holding the bytes of another file from offset on, read at their
+# original positions so an archive tail copied out by zip_update_members opens as the
+# whole archive. The bytes before offset read as zeros and are never used.
+class _TailFile(object):
+
+    def __init__(self, fp, offset):
+        self._fp = fp
+        self._offset = offset
+        self._pos = 0
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            pos += self._pos
+        elif whence == os.SEEK_END:
+            pos += self._offset + self._fp.seek(0, os.SEEK_END)
+        self._pos = pos
+        return pos
+
+    def read(self, n=-1):
+        hole = b''
+        if self._pos < self._offset:
+            size = self._offset - self._pos
+            if n >= 0:
+                size = min(n, size)
+                n -= size
+            hole = bytes(size)
+            self._pos += size
+            if n == 0:
+                return hole
+        self._fp.seek(self._pos - self._offset)
+        data = self._fp.read(n)
+        self._pos += len(data)
+        return hole + data
+
+
+def epub_zip_up_book_contents(ebook_path, epub_filepath, workers=None, compress_policy=None):
     book_path = os.fsdecode(ebook_path)
     files = epub_file_walk(book_path)
-    if 'mimetype' in files:
-        outzip.write(os.path.join(book_path, 'mimetype'), 'mimetype', zipfile.ZIP_STORED)
-    else:
+    if 'mimetype' not in files:
         raise Exception('mimetype file is missing')
     files.remove('mimetype')
+    files.insert(0, 'mimetype')
+
+    def loader(filepath):
+        def load():
+            with open(filepath, 'rb') as fp:
+                return fp.read()
+        return load
+
+    members = []
     for file in files:
-        filepath = os.path.join(book_path, file)
-        outzip.write(filepath, file, zipfile.ZIP_DEFLATED)
-    outzip.close()
+        arcname = file.replace(os.sep, '/')
+        members.append((arcname, loader(os.path.join(book_path, file))))
+    with zipfile.ZipFile(os.fsdecode(epub_filepath), 'w') as outzip:
+        zip_write_members(outzip, members, workers, compress_policy)
+
+
+# media types that are already compressed gain nothing from being deflated again
+_STORED_EXTENSIONS = ('.gif', '.jpeg', '.jpg', '.m4a', '.m4v', '.mp3', '.mp4', '.oga',
+                      '.ogg', '.ogv', '.png', '.webm', '.webp', '.woff', '.woff2')
+
+
+# default per member compression policy used when packing an epub
+# the mimetype file must always be stored uncompressed
+def epub_compress_type(bookpath):
+    if bookpath == 'mimetype':
+        return zipfile.ZIP_STORED
+    ext = os.path.splitext(bookpath)[1].lower()
+    if ext in _STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+# compression methods that members may be packed with
+SUPPORTED_COMPRESS_TYPES = (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED)
+
+
+def _check_compress_type(compress_type):
+    if compress_type not in SUPPORTED_COMPRESS_TYPES:
+        raise ValueError('Unsupported compression method %r' % (compress_type,))
+
+
+# returns the crc and the compressed form of data
+# zlib releases the GIL so this may be run from worker threads
+def zip_compress_data(data, compress_type, compresslevel=None):
+    _check_compress_type(compress_type)
+    crc = zlib.crc32(data)
+    if compress_type == zipfile.ZIP_DEFLATED:
+        if compresslevel is None:
+            compresslevel = zlib.Z_DEFAULT_COMPRESSION
+        co = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+        data = co.compress(data) + co.flush()
+    return crc, data
+
+
+# zipfile has no public api for writing already compressed data or for
+# truncating an archive, so _zip_write_raw and zip_update_members use its
+# internals. Where they are missing the ordinary ZipFile api is used instead.
+def _zip_raw_writable(zf):
+    return (hasattr(zf, '_writecheck') and hasattr(zf, '_lock')
+            and hasattr(zf, '_didModify') and hasattr(zf, 'start_dir')
+            and hasattr(zf, 'fp') and hasattr(zipfile.ZipInfo, 'FileHeader'))
+
+
+# write a member whose zinfo already holds its crc and sizes and whose
+# compressed data is provided as an iterable of byte chunks
+def _zip_write_raw(outzip, zinfo, chunks):
+    # sizes and crc are known up front so no data descriptor will follow
+    zinfo.flag_bits &= ~0x08
+    # zipfile has no public api for writing pre-compressed data so mimic ZipFile.write
+    with outzip._lock:
+        outzip._writecheck(zinfo)
+        outzip._didModify = True
+        outzip.fp.seek(outzip.start_dir)
+        zinfo.header_offset = outzip.fp.tell()
+        outzip.fp.write(zinfo.FileHeader())
+        for chunk in chunks:
+            outzip.fp.write(chunk)
+        outzip.start_dir = outzip.fp.tell()
+        outzip.filelist.append(zinfo)
+        outzip.NameToInfo[zinfo.filename] = zinfo
+    return zinfo
+
+
+# build the zipinfo used when a member is copied raw into another archive
+def _zip_raw_info(srcinfo, arcname=None):
+    if arcname is None:
+        arcname = srcinfo.filename
+    zinfo = zipfile.ZipInfo(arcname, srcinfo.date_time)
+    zinfo.compress_type = srcinfo.compress_type
+    zinfo.CRC = srcinfo.CRC
+    zinfo.compress_size = srcinfo.compress_size
+    zinfo.file_size = srcinfo.file_size
+    zinfo.external_attr = srcinfo.external_attr
+    zinfo.flag_bits = srcinfo.flag_bits & ~0x08
+    return zinfo
+
+
+# copy the already compressed data of a member from one zip archive into another
+# without decompressing and recompressing it
+def zip_copy_raw_member(srczip, srcinfo, outzip, arcname=None, chunk_size=1024 * 1024):
+    zinfo = _zip_raw_info(srcinfo, arcname)
+
+    def read_chunks():
+        fp = srczip.fp
+        fp.seek(srcinfo.header_offset)
+        header = fp.read(zipfile.sizeFileHeader)
+        if len(header) != zipfile.sizeFileHeader or header[0:4] != zipfile.stringFileHeader:
+            raise zipfile.BadZipFile('Bad magic number for file header')
+        fnlen, extralen = struct.unpack('<HH', header[26:30])
+        fp.seek(fnlen + extralen, os.SEEK_CUR)
+        remaining = srcinfo.compress_size
+        while remaining > 0:
+            data = fp.read(min(chunk_size, remaining))
+            if not data:
+                raise zipfile.BadZipFile('Truncated file data for %s' % srcinfo.filename)
+            remaining -= len(data)
+            yield data
+
+    if not (_zip_raw_writable(outzip) and hasattr(srczip, '_lock')):
+        # decompress and compress again through the public api
+        zinfo.flag_bits = 0
+        with srczip.open(srcinfo) as src_fp, outzip.open(zinfo, 'w') as dst_fp:
+            shutil.copyfileobj(src_fp, dst_fp, chunk_size)
+        return outzip.getinfo(zinfo.filename)
+
+    # hold the source archive lock as other threads may be reading from it
+    with srczip._lock:
+        return _zip_write_raw(outzip, zinfo, read_chunks())
+
+
+# 新写入成员的时间戳，zip格式能表示的最早时间，保证重复保存结果一致
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+# write an ordered list of members into outzip, compressing them in a thread pool
+# members is a list of (arcname, source) where source is either a callable returning
+# the file data or a (srczip, zipinfo) tuple whose compressed data is copied as is.
+# A callable may also return a (fileobj, size) tuple for large files, these are
+# streamed into the archive in chunks instead of being held in memory.
+# Members are always written in list order and new members get a fixed timestamp
+# unless date_time is given, so saving the same book twice gives the same bytes.
+def zip_write_members(outzip, members, workers=None, compress_policy=None, date_time=None):
+    if compress_policy is None:
+        compress_policy = epub_compress_type
+    if date_time is None:
+        date_time = ZIP_DATE_TIME
+    raw_writable = _zip_raw_writable(outzip)
+
+    # check every compression method before anything is written
+    compress_types = {}
+    for arcname, source in members:
+        if callable(source):
+            compress_type = compress_policy(arcname)
+            if arcname == 'mimetype':
+                compress_type = zipfile.ZIP_STORED
+            _check_compress_type(compress_type)
+            compress_types[arcname] = compress_type
+
+    def load_and_compress(arcname, load):
+        compress_type = compress_types[arcname]
+        data = load()
+        if isinstance(data, tuple):
+            return compress_type, data
+        if isinstance(data, str):
+            data = utf8str(data)
+        if not raw_writable:
+            # leave the compression to ZipFile.writestr
+            return compress_type, (data,)
+        return compress_type, zip_compress_data(data, compress_type) + (len(data),)
+
+    def write_member(arcname, source, result):
+        if not callable(source):
+            srczip, srcinfo = source
+            zip_copy_raw_member(srczip, srcinfo, outzip, arcname)
+            return
+        compress_type, data = result
+        zinfo = zipfile.ZipInfo(arcname, date_time)
+        zinfo.compress_type = compress_type
+        zinfo.external_attr = 0o600 << 16
+        if len(data) == 1:
+            outzip.writestr(zinfo, data[0])
+            return
+        if len(data) == 2:
+            fp, zinfo.file_size = data
+            with fp, outzip.open(zinfo, 'w') as dst_fp:
+                shutil.copyfileobj(fp, dst_fp, 1024 * 1024)
+            return
+        crc, cdata, zinfo.file_size = data
+        zinfo.CRC = crc
+        zinfo.compress_size = len(cdata)
+        _zip_write_raw(outzip, zinfo, (cdata,))
+
+    if workers is None:
+        workers = min(32, (os.cpu_count() or 1) + 4)
+    if workers <= 1:
+        for arcname, source in members:
+            result = None
+            if callable(source):
+                result = load_and_compress(arcname, source)
+            write_member(arcname, source, result)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # bound the number of compressed members held in memory at once
+        window = workers * 4
+        pending = deque()
+        for arcname, source in members:
+            future = None
+            if callable(source):
+                future = pool.submit(load_and_compress, arcname, source)
+            pending.append((arcname, source, future))
+            while len(pending) > window:
+                arcname, source, future = pending.popleft()
+                write_member(arcname, source, future.result() if future else None)
+        while pending:
+            arcname, source, future = pending.popleft()
+            write_member(arcname, source, future.result() if future else None)
 
 
 def build_container_xml(bookpath_to_opf):
@@ -178,3 +515,376 @@ def Idpf_mangle_fonts(encryption_key, data):
     key = cycle(iter(map(bord, encryption_key)))
     encrypt = b''.join([bytes([x ^ next(key)]) for x in crypt])
     return encrypt + data[1040:]
+
+
+# standardize_epub 的链接改写引擎。
+# 文件移动的映射表在改写开始前一次性建立：
+#     old_to_basename   旧 bookpath（小写） -> 标准化后的文件名
+#     new_to_old_group  新 bookpath -> 文件原来所在的目录
+# 每个文件只扫描一遍，href、src、url() 等链接在同一次扫描中改写，
+# 改写结果只依赖映射表和文件内容，因此可以在多个线程或进程中并发执行。
+_STD_SKIP_PREFIXES = ("http:", "https:", "res:", "file:", "data:")
+_STD_IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp', '.svg')
+_STD_FONT_EXTS = ('.ttf', '.otf')
+_STD_TEXT_EXTS = ('.xhtml', '.html', '.htm')
+_STD_SRC_DIRS = ((_STD_IMAGE_EXTS, '../Images/'), (('.mp3',), '../Audio/'), (('.mp4',), '../Video/'), (('.js',), '../Misc/'))
+_STD_URL_DIRS = ((_STD_FONT_EXTS, '../Fonts/'), (_STD_IMAGE_EXTS, '../Images/'))
+
+# xhtml 中的标签或标签外的 url()
+_STD_XHTML_TOKENS = re.compile(r'''<[^>]*>|(url\(['"]?)(.*?)(['"]?\))''')
+_STD_TAG_HREF = re.compile(r'''(<[^>]*href=(['"]))(.*?)(\2[^>]*>)''')
+_STD_TAG_SRC = re.compile(r'''(<[^>]* src=(['"]))(.*?)(\2[^>]*>)''')
+_STD_URL = re.compile(r'''(url\(['"]?)(.*?)(['"]?\))''')
+# css 中的 @import 或 url()
+_STD_CSS_TOKENS = re.compile(r'''@import (['"])(.*?)\1|@import url\(['"]?(.*?)['"]?\)|(url\(['"]?)(.*?)(['"]?\))''')
+_STD_NCX_SRC = re.compile(r'''src=(['"])(.*?)\1''')
+# 改写前的字节层面扫描，只取出链接的值：引号内的值整体取出，不带引号的 url() 取到右括号为止，
+# 文件名中的括号和空格不会截断链接
+_STD_SCAN_LINKS = re.compile(rb'''(?:href|src)\s*=\s*(?:"([^"]*)"|'([^']*)')|url\(\s*(?:"([^"]*)"|'([^']*)'|([^)]*))''')
+
+
+class StdLinkRewriter(object):
+
+    # moved_basenames 为移动过的文件的旧文件名（小写），用于 needs_rewrite 的快速检查
+    def __init__(self, old_to_basename, new_to_old_group, epub_version, moved_basenames=None):
+        self.old_to_basename = old_to_basename
+        self.new_to_old_group = new_to_old_group
+        self.epub_version = epub_version
+        self.moved_basenames = moved_basenames
+        self._resolved = {}
+
+    def __getstate__(self):
+        # 缓存不随映射表一起传给子进程
+        return (self.old_to_basename, self.new_to_old_group, self.epub_version, self.moved_basenames)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    # 文件改写前所在的目录，没有移动过的文件就是它当前的目录
+    def _old_group(self, bkpath):
+        return self.new_to_old_group.get(bkpath, os.path.dirname(bkpath))
+
+    # 返回 href 在旧目录 old_group 下指向的文件的新文件名，不存在则返回 None
+    def _new_basename(self, href, old_group):
+        key = (href, old_group)
+        try:
+            return self._resolved[key]
+        except KeyError:
+            pass
+        old_bkpath = buildBookPath(urldecodepart(href), old_group)
+        basename = None
+        if old_bkpath:
+            basename = self.old_to_basename.get(old_bkpath.lower())
+        self._resolved[key] = basename
+        return basename
+
+    def _sub_href(self, match, old_group):
+        href = match.group(3)
+        if href == "" or href.startswith(_STD_SKIP_PREFIXES):
+            return match.group()
+        href = urldecodepart(href).strip()
+        href, sep, target_id = href.partition('#')
+        target_id = sep + target_id
+        lhref = href.lower()
+        if not lhref.endswith(_STD_IMAGE_EXTS + _STD_TEXT_EXTS + ('.css',)):
+            return match.group()
+        filename = self._new_basename(href, old_group)
+        if filename is None:
+            return match.group()
+        if lhref.endswith(_STD_IMAGE_EXTS):
+            return match.group(1) + '../Images/' + filename + match.group(4)
+        if lhref.endswith('.css'):
+            return '<link href="../Styles/' + filename + '" type="text/css" rel="stylesheet"/>'
+        return match.group(1) + filename + target_id + match.group(4)
+
+    def _sub_to_dir(self, href, old_group, ext_dirs):
+        if href == "" or href.startswith(_STD_SKIP_PREFIXES):
+            return None
+        href = urldecodepart(href).strip()
+        lhref = href.lower()
+        for exts, group_dir in ext_dirs:
+            if lhref.endswith(exts):
+                filename = self._new_basename(href, old_group)
+                if filename is None:
+                    return None
+                return group_dir + filename
+        return None
+
+    def _sub_src(self, match, old_group):
+        href = self._sub_to_dir(match.group(3), old_group, _STD_SRC_DIRS)
+        if href is None:
+            return match.group()
+        return match.group(1) + href + match.group(4)
+
+    def _sub_url(self, match, old_group, start=1):
+        url = self._sub_to_dir(match.group(start + 1), old_group, _STD_URL_DIRS)
+        if url is None:
+            return match.group()
+        return match.group(start) + url + match.group(start + 2)
+
+    def _sub_tag(self, tag, old_group):
+        if 'href=' in tag:
+            tag = _STD_TAG_HREF.sub(lambda m: self._sub_href(m, old_group), tag)
+        if ' src=' in tag:
+            tag = _STD_TAG_SRC.sub(lambda m: self._sub_src(m, old_group), tag)
+        if 'url(' in tag:
+            tag = _STD_URL.sub(lambda m: self._sub_url(m, old_group), tag)
+        return tag
+
+    def rewrite_xhtml(self, text, bkpath):
+        if not text.startswith('<?xml'):
+            text = '<?xml version="1.0" encoding="utf-8"?>\n' + text
+        if '<!DOCTYPE html' not in text:
+            if self.epub_version.startswith("2"):
+                text = re.sub(r'(<\?xml.*?>)\n*', r'\1\n<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN"\n  "http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd">\n', text, 1)
+            elif self.epub_version.startswith("3"):
+                text = re.sub(r'(<\?xml.*?>)\n*', r'\1\n<!DOCTYPE html>\n', text, 1)
+        old_group = self._old_group(bkpath)
+
+        def sub_token(match):
+            if match.group(1) is None:
+                return self._sub_tag(match.group(), old_group)
+            return self._sub_url(match, old_group)
+
+        return _STD_XHTML_TOKENS.sub(sub_token, text)
+
+    def rewrite_css(self, css, bkpath):
+        old_group = self._old_group(bkpath)
+
+        def sub_token(match):
+            if match.group(4) is not None:
+                return self._sub_url(match, old_group, 4)
+            href = match.group(2) or match.group(3)
+            href = urldecodepart(href).strip()
+            if not href.lower().endswith('.css'):
+                # 未改写的 @import url() 仍按普通 url() 处理
+                return _STD_URL.sub(lambda m: self._sub_url(m, old_group), match.group())
+            return '@import "' + os.path.basename(href) + '"'
+
+        return _STD_CSS_TOKENS.sub(sub_token, css)
+
+    def rewrite_ncx(self, toc, bkpath):
+        old_toc_dir = self._old_group(bkpath)
+
+        def sub_src(match):
+            href = match.group(2)
+            if href == "" or href.startswith(_STD_SKIP_PREFIXES):
+                return match.group()
+            href = urldecodepart(href).strip()
+            href, sep, target_id = href.partition('#')
+            basename = self._new_basename(href, old_toc_dir)
+            if not basename:
+                return match.group()
+            return 'src="Text/' + basename + sep + target_id + '"'
+
+        return _STD_NCX_SRC.sub(sub_src, toc)
+
+    # 只在字节层面检查文件是否需要改写：文件本身没有移动、链接也不指向移动过的文件时，
+    # 改写不会改变任何链接，可以跳过解码和改写。moved_basenames 为 None 时总是返回 True
+    def needs_rewrite(self, mime, data, bkpath):
+        if self.moved_basenames is None or self._old_group(bkpath) != os.path.dirname(bkpath):
+            return True
+        if mime == "application/xhtml+xml":
+            if not data.startswith(b'<?xml') or b'<!DOCTYPE html' not in data:
+                return True
+        elif mime == "text/css" and b'@import' in data:
+            return True
+        for match in _STD_SCAN_LINKS.finditer(data):
+            href = next(value for value in match.groups() if value is not None)
+            href = href.decode('utf-8', errors='replace').partition('#')[0]
+            basename = urldecodepart(href).rpartition('/')[2].strip().lower()
+            if basename in self.moved_basenames:
+                return True
+        return False
+
+    # 按 mime 改写一个文件，内容没有变化时返回 None
+    def rewrite(self, mime, text, bkpath):
+        if mime == "application/xhtml+xml":
+            new_text = self.rewrite_xhtml(text, bkpath)
+        elif mime == "text/css":
+            new_text = self.rewrite_css(text, bkpath)
+        elif mime == "application/x-dtbncx+xml":
+            new_text = self.rewrite_ncx(text, bkpath)
+        else:
+            return None
+        if new_text == text:
+            return None
+        return new_text
+
+    # 改写 utf-8 数据，内容没有变化时返回 None
+    def rewrite_data(self, mime, data, bkpath):
+        if not self.needs_rewrite(mime, data, bkpath):
+            return None
+        text = self.rewrite(mime, data.decode('utf-8', errors='replace'), bkpath)
+        if text is None:
+            return None
+        return text.encode('utf-8', errors='replace')
+
+
+# 进程池模式：映射表随改写器在每个子进程启动时传入一次，之后只传递文件数据
+_std_worker_rewriter = None
+
+def _std_init_worker(rewriter):
+    global _std_worker_rewriter
+    _std_worker_rewriter = rewriter
+
+def _std_rewrite_batch(batch):
+    return [_std_worker_rewriter.rewrite_data(mime, data, bkpath) for mime, data, bkpath in batch]
+
+def _std_batches(files, batch_size):
+    batch = []
+    for file in files:
+        batch.append(file)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# files 为 (mime, data, bkpath) 的可迭代对象，data 为 utf-8 编码的文件内容。
+# 按 files 的顺序返回改写后的数据，内容没有变化的文件为 None 。
+# 结果只取决于映射表和文件内容，与进程数和各批次的完成顺序无关。
+# files 按需读取，同时提交（在途）的批次不超过 max_in_flight 个，默认为进程数的两倍。
+def std_rewrite_in_processes(rewriter, files, workers=None, batch_size=64, max_in_flight=None):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if max_in_flight is None:
+        max_in_flight = workers * 2
+    max_in_flight = max(max_in_flight, 1)
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_std_init_worker, initargs=(rewriter,)) as pool:
+        pending = deque()
+        for batch in _std_batches(files, batch_size):
+            pending.append(pool.submit(_std_rewrite_batch, batch))
+            if len(pending) >= max_in_flight:
+                results.extend(pending.popleft().result())
+        while pending:
+            results.extend(pending.popleft().result())
+    return results
+
+
+# 链接图：记录 manifest 文件之间的 href/src/url()/@import 引用
+# 只扫描以下类型的文件
+LINK_SOURCE_MIMES = ("application/xhtml+xml", "image/svg+xml", "text/css", "application/x-dtbncx+xml")
+
+_LINK_ATTR = re.compile(r'''[\s<](href|src|xlink:href|poster)\s*=\s*(?:"([^"]*)"|'([^']*)')''')
+_LINK_CSS_URL = re.compile(r'''url\(\s*(?:"([^"]*)"|'([^']*)'|([^)"'\s]*))\s*\)''')
+_LINK_CSS_IMPORT = re.compile(r'''@import\s+(?:"([^"]*)"|'([^']*)')''')
+
+# 从文本中按出现顺序提取 (kind, href, start, end) ，start、end 为 href 在文本中的位置
+def extract_links(mime, text):
+    found = []
+    if mime != "text/css":
+        for m in _LINK_ATTR.finditer(text):
+            g = 2 if m.group(2) is not None else 3
+            found.append((m.group(1), m.group(g), m.start(g), m.end(g)))
+    if mime == "application/x-dtbncx+xml":
+        return found
+    for kind, regex in (("url", _LINK_CSS_URL), ("import", _LINK_CSS_IMPORT)):
+        for m in regex.finditer(text):
+            g = m.lastindex
+            found.append((kind, m.group(g), m.start(g), m.end(g)))
+    found.sort(key=lambda link: link[2])
+    return found
+
+
+# xhtml、svg、ncx 中的链接是 xml 属性或文本，其中的实体（如 &amp;）需要还原后才是链接的值，
+# 写回时再转义。css 中没有实体，原样使用
+_XML_ENTITY = re.compile(r'&(?:#[xX]([0-9a-fA-F]+)|#([0-9]+)|(amp|lt|gt|quot|apos));')
+_XML_ENTITIES = {'amp': '&', 'lt': '<', 'gt': '>', 'quot': '"', 'apos': "'"}
+_XML_ESCAPES = {'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&apos;'}
+
+
+def _xml_entity(m):
+    if m.group(3):
+        return _XML_ENTITIES[m.group(3)]
+    cp = int(m.group(1), 16) if m.group(1) else int(m.group(2))
+    if cp > 0x10FFFF:
+        return m.group()
+    return chr(cp)
+
+
+def link_value(mime, href):
+    if mime == "text/css" or '&' not in href:
+        return href
+    return _XML_ENTITY.sub(_xml_entity, href)
+
+
+def link_text(mime, value):
+    if mime == "text/css":
+        return value
+    return re.sub('[&<>"\']', lambda m: _XML_ESCAPES[m.group()], value)
+
+
+# 双向索引，源文件以 manifest id 标识，目标为解析后的 bookpath 。
+# 每条链接为 (target, fragment, href, kind, start, end)：
+#   target    链接指向的 bookpath
+#   fragment  # 之后的部分（已还原实体并解码），没有时为 None
+#   href      文件中的原始链接文本
+#   kind      href、src、xlink:href、poster、url 或 import
+#   start, end href 在文件文本中的位置
+# 外部链接（含 ":"）和只有 fragment 的文件内链接不记录。
+class LinkGraph(object):
+
+    def __init__(self):
+        self._out = {}
+        self._in = {}
+        # 同一本书的链接大多共用几个起始目录，路径解析结果随图保留
+        self._paths = PathResolver()
+
+    def __contains__(self, id):
+        return id in self._out
+
+    def __len__(self):
+        return len(self._out)
+
+    def add(self, id, bookpath, mime, text):
+        if id in self._out:
+            self.remove(id)
+        start_dir = startingDir(bookpath)
+        links = []
+        for kind, href, start, end in extract_links(mime, text):
+            value = link_value(mime, href)
+            if value.find(':') != -1:
+                continue
+            path, sep, fragment = value.partition('#')
+            path = path.partition('?')[0]
+            if path == "":
+                continue
+            target = self._paths.build_bookpath(urldecodepart(path), start_dir)
+            links.append((target, urldecodepart(fragment) if sep else None, href, kind, start, end))
+            # 每个目标只记一次来源，值为该来源的链接数
+            sources = self._in.setdefault(target, {})
+            sources[id] = sources.get(id, 0) + 1
+        self._out[id] = links
+
+    def remove(self, id):
+        links = self._out.pop(id, None)
+        if not links:
+            return
+        for link in links:
+            target = link[0]
+            sources = self._in.get(target)
+            if sources is None or id not in sources:
+                continue
+            del sources[id]
+            if not sources:
+                del self._in[target]
+
+    def links_from(self, id):
+        return list(self._out.get(id, ()))
+
+    def sources_of(self, bookpath):
+        return list(self._in.get(bookpath, ()))
+
+    # 返回 [(source_id, fragment, href, kind, start, end)] ，按来源的加入顺序和链接在文件中的位置排列
+    def links_to(self, bookpath):
+        result = []
+        for id in self._in.get(bookpath, ()):
+            for link in self._out[id]:
+                if link[0] == bookpath:
+                    result.append((id,) + link[1:])
+        return result
+
+    def targets(self):
+        return list(self._in)
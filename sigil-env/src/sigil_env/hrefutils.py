@@ -3,7 +3,9 @@
 # vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
 
 import sys
+import re
 
+from functools import lru_cache
 from urllib.parse import unquote
 from urllib.parse import urlsplit
 
@@ -153,25 +155,59 @@ def need_to_percent_encode(char):
     return True;
 
 
+# the same ranges as need_to_percent_encode, for whole-string checks
+_UCS_SAFE_CHARS = ('\u00a0-\ud7ff\uf900-\ufdcf\ufdf0-\uffef'
+                   '\U00010000-\U0001fffd\U00020000-\U0002fffd\U00030000-\U0003fffd')
+_IRI_SAFE_CHARS = 'A-Za-z0-9_.\\-/~' + _UCS_SAFE_CHARS
+_IRI_SAFE_PART = re.compile('[%s]*' % _IRI_SAFE_CHARS)
+_IRI_UNSAFE_RUN = re.compile('[^%s]+' % _IRI_SAFE_CHARS)
+_NON_ASCII_UNSAFE = re.compile('[^\x00-\x7f%s]' % _UCS_SAFE_CHARS)
+_ASCII_UNSAFE_CHAR = re.compile('[^A-Za-z0-9_.\\-/~\x80-\U0010ffff]')
+
+# percent encoding of every byte value
+_PCT_ENCODED = ['%%%02X' % b for b in range(256)]
+_ASCII_PCT_ENCODED = {chr(b): _PCT_ENCODED[b] for b in range(128)}
+
+# hrefs repeat a lot (manifest, links, rewrites), keep recent results around
+_URLPART_CACHE_SIZE = 8192
+
+
+def _percent_encode_ascii(m):
+    return _ASCII_PCT_ENCODED[m.group()]
+
+
+def _percent_encode_run(m):
+    return ''.join([_PCT_ENCODED[b] for b in m.group().encode('utf-8')])
+
+
+@lru_cache(maxsize=_URLPART_CACHE_SIZE)
+def _urlencode_str(part):
+    # most hrefs need no encoding at all
+    if _IRI_SAFE_PART.fullmatch(part):
+        return part
+    # usually only ascii characters (spaces, punctuation) need encoding
+    if _NON_ASCII_UNSAFE.search(part) is None:
+        return _ASCII_UNSAFE_CHAR.sub(_percent_encode_ascii, part)
+    return _IRI_UNSAFE_RUN.sub(_percent_encode_run, part)
+
+
 def urlencodepart(part):
     if isinstance(part,bytes):
         part = part.decode('utf-8')
-    result = []
-    for char in part:
-        if need_to_percent_encode(char):
-            bs = char.encode('utf-8')
-            for b in bs:
-                result.append("%%%02X" % b)
-        else:
-            result.append(char)
-    return ''.join(result)
+    return _urlencode_str(part)
+
+
+@lru_cache(maxsize=_URLPART_CACHE_SIZE)
+def _urldecode_str(part):
+    return unquote(part)
 
 
 def urldecodepart(part):
     if isinstance(part,bytes):
         part = part.decode('utf-8')
-    part = unquote(part)
-    return part
+    if '%' not in part:
+        return part
+    return _urldecode_str(part)
 
 
 # return a properly url encoded relative href
@@ -200,34 +236,49 @@ def parseRelativeHREF(href):
     return apath, afragment
 
 
-def relativePath(to_bkpath, start_dir):
-    # remove any trailing path separators from both paths
-    dsegs = to_bkpath.rstrip('/').split('/')
-    ssegs = start_dir.rstrip('/').split('/')
+# a "." or ".." segment anywhere in a path
+_DOT_SEGMENT = re.compile(r'(?:^|/)\.\.?(?:/|$)')
+
+_PATH_CACHE_SIZE = 16384
+
+
+# resolves segs onto res in place, False if a ".." went above the top
+def _resolve_segments(res, segs):
+    ok = True
+    for seg in segs:
+        if seg == '.': continue
+        if seg == '..':
+            if res:
+                res.pop()
+            else:
+                print("Error resolving relative path segments")
+                ok = False
+        else:
+            res.append(seg)
+    return ok
+
+
+def _relative_path(dsegs, ssegs):
     if dsegs == ['']: dsegs = []
-    if ssegs == ['']: ssegs = []
-    res = []
     i = 0
     for s1, s2 in zip(dsegs, ssegs):
         if s1 != s2: break
         i += 1
-    for p in range(i, len(ssegs), 1): res.append('..')
-    for p in range(i, len(dsegs), 1): res.append(dsegs[p])
-    return '/'.join(res)
+    return '/'.join(['..'] * (len(ssegs) - i) + dsegs[i:])
+
+
+def relativePath(to_bkpath, start_dir):
+    # remove any trailing path separators from both paths
+    ssegs = start_dir.rstrip('/').split('/')
+    if ssegs == ['']: ssegs = []
+    return _relative_path(to_bkpath.rstrip('/').split('/'), ssegs)
 
 
 def resolveRelativeSegmentsInFilePath(file_path):
+    if _DOT_SEGMENT.search(file_path) is None:
+        return file_path
     res = []
-    segs = file_path.split('/')
-    for i in range(len(segs)):
-        if segs[i] == '.': continue
-        if segs[i] == '..':
-            if res:
-                res.pop()
-            else:
-                print("Error resolving relative path segments")
-        else:
-            res.append(segs[i])
+    _resolve_segments(res, file_path.split('/'))
     return '/'.join(res)
 
 
@@ -243,10 +294,87 @@ def buildBookPath(dest_relpath, start_folder):
     return resolveRelativeSegmentsInFilePath(bookpath)
 
 
+# Memoizing path resolution for one pass over one book, such as building
+# its link graph.  Starting directories are split once and kept as tuples,
+# and (href, start_dir) -> bookpath and (to, start_dir) -> relative path
+# results are remembered, since the links in a book mostly share a few
+# starting directories.  Results that printed the resolve warning are not
+# remembered, so every bad path still reports it.  Drop the instance when
+# the pass is done.
+class PathResolver(object):
+
+    def __init__(self, cache_size=_PATH_CACHE_SIZE):
+        self._cache_size = cache_size
+        # start_dir -> segments, and start_folder -> (resolved segments, resolved path, ok)
+        self._dirs = {}
+        self._book_dirs = {}
+        self._bookpaths = {}
+        self._relpaths = {}
+
+    def cache_clear(self):
+        self._dirs.clear()
+        self._book_dirs.clear()
+        self._bookpaths.clear()
+        self._relpaths.clear()
+
+    def _remember(self, cache, key, value):
+        if len(cache) >= self._cache_size:
+            cache.clear()
+        cache[key] = value
+
+    def _dir_segments(self, start_dir):
+        segs = self._dirs.get(start_dir)
+        if segs is None:
+            segs = start_dir.rstrip('/').split('/')
+            if segs == ['']: segs = []
+            segs = tuple(segs)
+            self._remember(self._dirs, start_dir, segs)
+        return segs
+
+    def _book_dir(self, start_folder):
+        info = self._book_dirs.get(start_folder)
+        if info is None:
+            resolved = []
+            ok = _resolve_segments(resolved, start_folder.rstrip('/').split('/'))
+            info = (tuple(resolved), '/'.join(resolved), ok)
+            if ok:
+                self._remember(self._book_dirs, start_folder, info)
+        return info
+
+    def build_bookpath(self, dest_relpath, start_folder):
+        key = (dest_relpath, start_folder)
+        bookpath = self._bookpaths.get(key)
+        if bookpath is not None:
+            return bookpath
+        if start_folder == "" or start_folder.strip() == "":
+            return dest_relpath
+        resolved, resolved_path, ok = self._book_dir(start_folder)
+        if _DOT_SEGMENT.search(dest_relpath) is None:
+            bookpath = resolved_path + '/' + dest_relpath if resolved else dest_relpath
+        else:
+            res = list(resolved)
+            ok = _resolve_segments(res, dest_relpath.split('/')) and ok
+            bookpath = '/'.join(res)
+        if ok:
+            self._remember(self._bookpaths, key, bookpath)
+        return bookpath
+
+    def relative_path(self, to_bkpath, start_dir):
+        key = (to_bkpath, start_dir)
+        relpath = self._relpaths.get(key)
+        if relpath is None:
+            # remove any trailing path separators from both paths
+            relpath = _relative_path(to_bkpath.rstrip('/').split('/'), self._dir_segments(start_dir))
+            self._remember(self._relpaths, key, relpath)
+        return relpath
+
+    def build_relativepath(self, from_bkpath, to_bkpath):
+        if from_bkpath == to_bkpath: return ""
+        return self.relative_path(to_bkpath, startingDir(from_bkpath))
+
+
 def startingDir(file_path):
-    ssegs = file_path.split('/')
-    ssegs.pop()
-    return '/'.join(ssegs)
+    return file_path.rpartition('/')[0]
 
 
 def longestCommonPath(bookpaths):
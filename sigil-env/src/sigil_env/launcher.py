@@ -1,9 +1,10 @@
 
 import os,re,sys
 import zipfile
-import random,uuid
+import uuid
 
 from plugin_launchers.opf_parser import Opf_Parser
+from plugin_launchers.opf_cache import OpfCache
 from plugin_launchers.wrapper import Wrapper
 from plugin_launchers.bookcontainer import BookContainer
 from plugin_launchers.inputcontainer import InputContainer
@@ -12,40 +13,71 @@ from plugin_launchers.validationcontainer import ValidationContainer
 
 SUPPORTED_SCRIPT_TYPES = ['input', 'output', 'edit', 'validation']
 
+SUPPORTED_BACKENDS = ['disk', 'zip', 'memory']
+
 # Ebook负责EPUB的基本文件信息，创建临时工作目录和初始化 Opf_Parser、Wrapper 等类所需变量。
 # 继承多个类仅仅是为了方便IDE智能提示，无实际作用，因为 __new__ 方法的存在，Ebook类最终不会赋予任何对象，
 # 而是根据 plugin_type 返回 BookContainer、InputContainer、OutputContainer、ValidationContainer 之一的对象，
 class Ebook(BookContainer, InputContainer, OutputContainer):
-    def __init__(self, epub_src:str, plugin_type:str = "edit", plugin_dir:str = "", plugin_name:str = ""):
+    def __init__(self, epub_src:str, plugin_type:str = "edit", plugin_dir:str = "", plugin_name:str = "", backend:str = "disk", workspace:str = "", opf_cache:str = ""):
         '''
         epub_src\xa0\xa0\xa0\xa0\xa0\xa0\xa0\xa0源epub完整路径，必填。\n
         script_type\xa0\xa0\xa0\xa0\xa0插件类型，edit（默认） | input | output | validation 。\n
         plugin_dir\xa0\xa0\xa0\xa0\xa0\xa0插件位置，一般不填，除非需要。\n
-        plugin_name\xa0\xa0插件名称，一般不填，除非需要。
+        plugin_name\xa0\xa0插件名称，一般不填，除非需要。\n
+        backend\xa0\xa0\xa0\xa0\xa0\xa0\xa0\xa0\xa0工作区模式，disk（默认，解压到临时目录） | zip（不解压，按需从源epub读取） | memory（不创建临时目录，全部在内存中处理）。\n
+        workspace\xa0\xa0\xa0\xa0\xa0临时工作区所在目录，默认为源epub所在目录下的 __temp_workspace__ 。\n
+        opf_cache\xa0\xa0\xa0\xa0\xa0OPF 解析结果的缓存目录，默认不缓存。同一本 epub 再次打开时（文件大小、修改时间和 OPF 的 CRC 均未变）直接使用缓存，不再解析 OPF 。
         '''
         if plugin_type not in SUPPORTED_SCRIPT_TYPES:
             raise ValueError("Ebook: script type %s is not supported" % plugin_type)
+        if backend not in SUPPORTED_BACKENDS:
+            raise ValueError("Ebook: backend %s is not supported" % backend)
         if os.path.exists(epub_src):
             epub_src = os.path.realpath(epub_src)
         else:
             raise FileNotFoundError("EPUB路径无效！")
-        src_dir = os.path.dirname(epub_src)
-        random_id = str(uuid.uuid5(uuid.NAMESPACE_DNS,str(random.randint(0, 10000))))
-        self.ebook_root = ebook_root = os.path.join(src_dir,"__temp_workspace__","Ebook-%s"%(random_id))
-        self.outdir = outdir = os.path.join(src_dir,"__temp_workspace__","Outdir-%s"%(random_id))
-        self.epub = zipfile.ZipFile(epub_src,'a')
+        if not workspace:
+            workspace = os.path.join(os.path.dirname(epub_src),"__temp_workspace__")
+        random_id = str(uuid.uuid4())
+        self.ebook_root = ebook_root = os.path.join(workspace,"Ebook-%s"%(random_id))
+        self.outdir = outdir = os.path.join(workspace,"Outdir-%s"%(random_id))
+        if backend == "memory":
+            # memory 模式不使用任何临时目录
+            self.ebook_root = ebook_root = ""
+            self.outdir = outdir = ""
+        self.backend = backend
+        self.epub = zipfile.ZipFile(epub_src,'r')
         opfbookpath = self.find_opf(self)
         opf_path = os.path.join(ebook_root, opfbookpath.replace("/", os.sep))
         self.create_temp_workspace(self)
         plugin_dir = ""
         plugin_name = ""
         op = None
-        if os.path.exists(opf_path) and os.path.isfile(opf_path):
-            op = Opf_Parser(opf_path, opfbookpath)
-        self.rk = Wrapper(ebook_root, epub_src, outdir, op, plugin_dir, plugin_name)
+        cache = cache_key = None
+        if opf_cache and opfbookpath in self.epub.namelist():
+            # 缓存命中时不再解析 opf
+            cache = OpfCache(opf_cache)
+            cache_key = cache.make_key(epub_src, opfbookpath, self.epub.getinfo(opfbookpath))
+            snapshot = cache.load(epub_src, cache_key)
+            if snapshot is not None:
+                op = Opf_Parser.from_snapshot(snapshot)
+                cache = None
+        if op is None:
+            if backend in ("zip", "memory"):
+                # zip 和 memory 模式不解压，直接从源epub中读取 opf 内容
+                if opfbookpath in self.epub.namelist():
+                    op = Opf_Parser(opf_path, opfbookpath, opf_data=self.epub.read(opfbookpath))
+            elif os.path.exists(opf_path) and os.path.isfile(opf_path):
+                op = Opf_Parser(opf_path, opfbookpath)
+            # Wrapper 会直接接管 op 中的字典，所以要在创建 Wrapper 之前写入缓存
+            if cache is not None and op is not None:
+                cache.store(epub_src, cache_key, op.get_snapshot())
+        self.epub.close()
+        self.rk = Wrapper(ebook_root, epub_src, outdir, op, plugin_dir, plugin_name, backend=backend)
     
-    def __new__(cls, epub_src:str, plugin_type:str = "edit", plugin_dir:str = "", plugin_name:str = ""):
-        cls.__init__(cls,epub_src,plugin_type,plugin_dir,plugin_name)
+    def __new__(cls, epub_src:str, plugin_type:str = "edit", plugin_dir:str = "", plugin_name:str = "", backend:str = "disk", workspace:str = "", opf_cache:str = ""):
+        cls.__init__(cls,epub_src,plugin_type,plugin_dir,plugin_name,backend,workspace,opf_cache)
         # get the correct container
         if plugin_type == 'edit':
             bc = BookContainer(cls.rk)
@@ -57,13 +89,20 @@ class Ebook(BookContainer, InputContainer, OutputContainer):
             bc = OutputContainer(cls.rk)
         else:
             raise ValueError("不支持的插件类型！")
+        # 不在类属性上保留 Wrapper ，否则容器释放后临时目录要等到下一次创建 Ebook 才会被删除
+        cls.rk = None
         return bc
     
     def create_temp_workspace(self):
-        if not os.path.exists(self.ebook_root):
-            os.makedirs(self.ebook_root)
+        if self.backend == "memory":
+            return
         if not os.path.exists(self.outdir):
             os.makedirs(self.outdir)
+        # zip 模式下只需要 outdir 存放修改或新增的文件
+        if self.backend == "zip":
+            return
+        if not os.path.exists(self.ebook_root):
+            os.makedirs(self.ebook_root)
         self.epub.extractall(self.ebook_root)
     
     def find_opf(self):
@@ -59,6 +59,15 @@ def xmldecode(data):
     newdata = newdata.replace('&amp;', '&')
     return newdata
 
+# qp.parse_iter without copying attributes, tattr is the tag's read only
+# attrs mapping and the tag fields are None for text
+def _nav_tokens(qp):
+    for txt, tp, tag in qp.token_iter():
+        if tag is None:
+            yield txt, tp, None, None, None
+        else:
+            yield None, tp, tag.name, tag.type, tag.attrs
+
 
 class NavProcessor(object):
 
@@ -85,7 +94,7 @@ class NavProcessor(object):
         title = ""
         nav_type = None
         href = None
-        for txt, tp, tname, ttype, tattr in qp.parse_iter():
+        for txt, tp, tname, ttype, tattr in _nav_tokens(qp):
             if txt is not None:
                 if ".a." in tp or tp.endswith(".a"):
                     title = title + txt
@@ -130,7 +139,7 @@ class NavProcessor(object):
         nav_type = None
         res = []
         skip_output = False
-        for txt, tp, tname, ttype, tattr in qp.parse_iter():
+        for txt, tp, tname, ttype, tattr in _nav_tokens(qp):
             if txt is not None:
                 if not skip_output:
                     res.append(txt)
@@ -171,7 +180,7 @@ class NavProcessor(object):
         nav_type = None
         href = None
         epubtype = None
-        for txt, tp, tname, ttype, tattr in qp.parse_iter():
+        for txt, tp, tname, ttype, tattr in _nav_tokens(qp):
             if txt is not None:
                 if ".a." in tp or tp.endswith(".a"):
                     title = title + txt
@@ -214,7 +223,7 @@ class NavProcessor(object):
         nav_type = None
         res = []
         skip_output = False
-        for txt, tp, tname, ttype, tattr in qp.parse_iter():
+        for txt, tp, tname, ttype, tattr in _nav_tokens(qp):
             if txt is not None:
                 if not skip_output:
                     res.append(txt)
@@ -255,7 +264,7 @@ class NavProcessor(object):
         nav_type = None
         href = None
         title = ""
-        for txt, tp, tname, ttype, tattr in qp.parse_iter():
+        for txt, tp, tname, ttype, tattr in _nav_tokens(qp):
             if txt is not None:
                 if ".a." in tp or tp.endswith(".a"):
                     title = title + txt
@@ -296,7 +305,7 @@ class NavProcessor(object):
         skip_output = False
         found_page_list = False
 
-        for txt, tp, tname, ttype, tattr in qp.parse_iter():
+        for txt, tp, tname, ttype, tattr in _nav_tokens(qp):
             if txt is not None:
                 if not skip_output:
                     res.append(txt)
@@ -0,0 +1,65 @@
+import os
+import pickle
+import hashlib
+
+# 缓存格式版本，Opf_Parser 的快照字段变化时递增，旧缓存随之失效
+OPF_CACHE_VERSION = 1
+
+# 已解析 OPF 的磁盘缓存，供同一本 epub 被多次打开时跳过 Opf_Parser 的解析。
+# 每本 epub 对应缓存目录下的一个 pickle 文件（文件名取 epub 绝对路径的 sha1），
+# 内容为 (key, snapshot)，key 由 epub 文件大小、修改时间以及 OPF 成员的路径、CRC、大小组成，
+# 其中 CRC 直接取自 zip 目录，不需要解压 OPF 。key 不一致即视为失效，重新解析后覆盖。
+# 注意：缓存以 pickle 读取，缓存目录必须是可信的。
+class OpfCache:
+    def __init__(self, cache_dir:str):
+        self.cache_dir = cache_dir
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _cache_path(self, epub_src):
+        name = hashlib.sha1(os.fsencode(os.path.realpath(epub_src))).hexdigest()
+        return os.path.join(self.cache_dir, name + ".pickle")
+
+    # zinfo 为 OPF 成员的 zipfile.ZipInfo
+    def make_key(self, epub_src, opfbookpath, zinfo):
+        st = os.stat(epub_src)
+        return (OPF_CACHE_VERSION, st.st_size, st.st_mtime_ns, opfbookpath, zinfo.CRC, zinfo.file_size)
+
+    # 返回缓存的快照（Opf_Parser.get_snapshot() 的结果），未命中或已失效时返回 None
+    def load(self, epub_src, key):
+        try:
+            with open(self._cache_path(epub_src), "rb") as fp:
+                cached_key, snapshot = pickle.load(fp)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # 缓存文件损坏或格式不兼容，当作未命中，之后会被覆盖
+            return None
+        if cached_key != key:
+            return None
+        return snapshot
+
+    # 先写临时文件再替换，多个进程同时写同一本书的缓存也不会读到半个文件
+    def store(self, epub_src, key, snapshot):
+        path = self._cache_path(epub_src)
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        try:
+            with open(tmp_path, "wb") as fp:
+                pickle.dump((key, snapshot), fp, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError:
+            # 缓存只是加速手段，写入失败不影响打开 epub
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def clear(self, epub_src=None):
+        '''
+        epub_src\xa0\xa0\xa0\xa0\xa0\xa0\xa0\xa0只删除该 epub 的缓存，默认删除缓存目录下的全部缓存。
+        '''
+        if epub_src is not None:
+            paths = [self._cache_path(epub_src)]
+        else:
+            paths = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir) if name.endswith(".pickle")]
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
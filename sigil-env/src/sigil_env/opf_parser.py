@@ -28,10 +28,12 @@
 
 import sys
 import os
+import re
 
 from hrefutils import urldecodepart, buildBookPath, startingDir, longestCommonPath
 from hrefutils import mime_group_map
-from collections import OrderedDict
+from collections import OrderedDict, Counter
+from types import MappingProxyType
 
 SPECIAL_HANDLING_TAGS = OrderedDict([
     ('?xml', ('xmlheader', -1)),
@@ -43,6 +45,35 @@ SPECIAL_HANDLING_TYPES = ['xmlheader', 'doctype', 'comment']
 
 _OPF_PARENT_TAGS = ['package', 'metadata', 'dc-metadata', 'x-metadata', 'manifest', 'spine', 'tours', 'guide', 'bindings']
 
+# section each parent tag opens, dc-metadata and x-metadata count as metadata
+_OPF_SECTIONS = {
+    'package': 'package',
+    'metadata': 'metadata',
+    'dc-metadata': 'metadata',
+    'x-metadata': 'metadata',
+    'manifest': 'manifest',
+    'spine': 'spine',
+    'tours': 'tours',
+    'guide': 'guide',
+    'bindings': 'bindings',
+}
+
+# tag name scanning, attribute names run up to the "=" and values are
+# quoted (possibly unterminated) or run up to the next delimiter
+_OPF_TAG_NAME = re.compile(r'[^>/ "\'\r\n]*')
+_OPF_TAG_ATTR = re.compile(r'''[ \r\n\t]*([^=]*)=[ \r\n\t]*(?:"([^"]*)"?|'([^']*)'?|([^>/ \r\n\t]*))''')
+
+# everything Wrapper and the get_* methods need from a parsed opf
+_SNAPSHOT_FIELDS = (
+    'opfname', 'opf_bookpath', 'opf_dir', 'package', 'metadata_attr', 'metadata', 'cover_id',
+    'manifest_id_to_href', 'manifest_id_to_bookpath', 'manifest_id_to_mime',
+    'manifest_id_to_properties', 'manifest_id_to_fallback', 'manifest_id_to_overlay',
+    'spine', 'spine_ppd', 'guide', 'bindings', 'group_folder',
+)
+
+# returned by _parsetag for every end tag, _opf_tag_iter never hands it out
+_END_TAG_ATTRS = MappingProxyType({})
+
 def build_short_name(bookpath, lvl):
     pieces = bookpath.split("/")
     if lvl == 1: return pieces.pop()
@@ -53,15 +84,21 @@ def build_short_name(bookpath, lvl):
 
 class Opf_Parser(object):
 
-    def __init__(self, opf_path, opf_bookpath, debug=False):
+    def __init__(self, opf_path, opf_bookpath, debug=False, opf_data=None):
         self._debug = debug
         opf_path = os.fsdecode(opf_path)
         self.opfname = os.path.basename(opf_path)
         self.opf_bookpath = opf_bookpath
         self.opf_dir = startingDir(opf_bookpath)
         self.opf = None
-        with open(opf_path, 'rb') as fp:
-            self.opf = fp.read().decode('utf-8')
+        # opf_data allows the opf to be parsed without first extracting it to disk
+        if opf_data is not None:
+            if isinstance(opf_data, bytes):
+                opf_data = opf_data.decode('utf-8')
+            self.opf = opf_data
+        else:
+            with open(opf_path, 'rb') as fp:
+                self.opf = fp.read().decode('utf-8')
         self.opos = 0
         self.package = None
         self.metadata_attr = None
@@ -84,13 +121,12 @@ class Opf_Parser(object):
         self.guide = []
         self.bindings = []
 
-        # determine folder structure
+        # determine folder structure, group_count maps each group to a
+        # Counter of files per folder and group_folder is built from it
         self.group_folder = OrderedDict()
         self.group_count = OrderedDict()
-        self.group_folder["epub"] = ['META-INF']
-        self.group_count["epub"] = [1]
-        self.group_folder["opf"] = [self.opf_dir]
-        self.group_count["opf"] = [1]
+        self.group_count["epub"] = Counter({'META-INF': 1})
+        self.group_count["opf"] = Counter({self.opf_dir: 1})
 
         # self.bookpaths = []
         # self.bookpaths.append(self.opf_bookpath)
@@ -99,9 +135,11 @@ class Opf_Parser(object):
 
 
     # OPF tag iterator
+    # sections counts the currently open parent tags by section name and is
+    # updated in place, so test it with sections["manifest"] and do not keep it
     def _opf_tag_iter(self):
         tcontent = last_tattr = None
-        prefix = []
+        sections = Counter()
         while True:
             text, tag = self._parseopf()
             if text is None and tag is None:
@@ -112,30 +150,36 @@ class Opf_Parser(object):
                 ttype, tname, tattr = self._parsetag(tag)
                 if ttype == "begin":
                     tcontent = None
-                    prefix.append(tname)
-                    if tname in _OPF_PARENT_TAGS:
-                        yield ".".join(prefix), tname, tattr, tcontent
+                    section = _OPF_SECTIONS.get(tname)
+                    if section is not None:
+                        sections[section] += 1
+                        yield sections, tname, tattr, tcontent
                     else:
                         last_tattr = tattr
                 else:  # single or end
                     if ttype == "end":
-                        prefix.pop()
-                        tattr = last_tattr
-                        if tattr is None:
-                            tattr = OrderedDict()
+                        section = _OPF_SECTIONS.get(tname)
+                        if section is not None:
+                            if sections[section] > 0:
+                                sections[section] -= 1
+                        else:
+                            tattr = last_tattr
+                            if tattr is None:
+                                tattr = OrderedDict()
+                            yield sections, tname, tattr, tcontent
                         last_tattr = None
                     elif ttype == 'single':
-                        tcontent = None
-                    if ttype == 'single' or (ttype == 'end' and tname not in _OPF_PARENT_TAGS):
-                        yield ".".join(prefix), tname, tattr, tcontent
+                        yield sections, tname, tattr, None
                     tcontent = None
 
     # now parse the OPF to extract manifest, spine , and metadata
     def _parseData(self):
         cnt = 0
-        for prefix, tname, tattr, tcontent in self._opf_tag_iter():
+        opf_dir = self.opf_dir
+        group_count = self.group_count
+        for sections, tname, tattr, tcontent in self._opf_tag_iter():
             if self._debug:
-                print("   Parsing OPF: ", prefix, tname, tattr, tcontent)
+                print("   Parsing OPF: ", dict(sections), tname, tattr, tcontent)
             # package
             if tname == "package":
                 ver = tattr.pop("version", "2.0")
@@ -146,7 +190,7 @@ class Opf_Parser(object):
             if tname == "metadata":
                 self.metadata_attr = tattr
                 continue
-            if tname in ["meta", "link"] or tname.startswith("dc:") and "metadata" in prefix:
+            if tname in ["meta", "link"] or tname.startswith("dc:") and sections["metadata"]:
                 self.metadata.append((tname, tattr, tcontent))
                 if tattr.get("name", "") == "cover":
                     self.cover_id = tattr.get("content", None)
@@ -154,10 +198,11 @@ class Opf_Parser(object):
             # manifest
             # Note: manifest hrefs when relative may not contain a fragment
             # as they must refer to and entire file
-            if tname == "item" and "manifest" in prefix:
-                nid = "xid%03d" % cnt
+            if tname == "item" and sections["manifest"]:
+                id = tattr.pop("id", None)
+                if id is None:
+                    id = "xid%03d" % cnt
                 cnt += 1
-                id = tattr.pop("id", nid)
                 href = tattr.pop("href", '')
                 mtype = tattr.pop("media-type", '')
                 if mtype == "text/html":
@@ -177,23 +222,16 @@ class Opf_Parser(object):
 
                 bookpath = ""
                 if href.find(":") == -1:
-                    bookpath = buildBookPath(href, self.opf_dir)
+                    bookpath = buildBookPath(href, opf_dir)
                 self.manifest_id_to_bookpath[id] = bookpath
                 self.manifest_id_to_mime[id] = mtype
                 # self.bookpaths.append(bookpath)
                 group = mime_group_map.get(mtype, '')
                 if bookpath != "" and group != "":
-                    folderlst = self.group_folder.get(group, [])
-                    countlst = self.group_count.get(group, [])
-                    sdir = startingDir(bookpath)
-                    if sdir not in folderlst:
-                        folderlst.append(sdir)
-                        countlst.append(1)
-                    else:
-                        pos = folderlst.index(sdir)
-                        countlst[pos] = countlst[pos] + 1
-                    self.group_folder[group] = folderlst
-                    self.group_count[group] = countlst
+                    counts = group_count.get(group)
+                    if counts is None:
+                        counts = group_count[group] = Counter()
+                    counts[startingDir(bookpath)] += 1
                 self.manifest_id_to_properties[id] = properties
                 self.manifest_id_to_fallback[id] = fallback
                 self.manifest_id_to_overlay[id] = overlay
@@ -203,7 +241,7 @@ class Opf_Parser(object):
                 if tattr is not None:
                     self.spine_ppd = tattr.get("page-progression-direction", None)
                 continue
-            if tname == "itemref" and "spine" in prefix:
+            if tname == "itemref" and sections["spine"]:
                 idref = tattr.pop("idref", "")
                 linear = tattr.pop("linear", None)
                 properties = tattr.pop("properties", None)
@@ -213,14 +251,14 @@ class Opf_Parser(object):
             # Note: guide hrefs may have fragments, so leave any
             # guide hrefs in their raw urlencoded form to prevent
             # errors
-            if tname == "reference" and "guide" in prefix:
+            if tname == "reference" and sections["guide"]:
                 type = tattr.pop("type", '')
                 title = tattr.pop("title", '')
                 href = tattr.pop("href", '')
                 self.guide.append((type, title, href))
                 continue
             # bindings (stored but ignored for now)
-            if tname in ["mediaType", "mediatype"] and "bindings" in prefix:
+            if tname in ["mediaType", "mediatype"] and sections["bindings"]:
                 mtype = tattr.pop("media-type", "")
                 handler = tattr.pop("handler", "")
                 self.bindings.append((mtype, handler))
@@ -264,10 +302,8 @@ class Opf_Parser(object):
         # finally sort by number of files in dir to find default folders for each group
         dirlst = []
         use_lower_case = False
-        for group in self.group_folder.keys():
-            folders = self.group_folder[group]
-            cnts = self.group_count[group]
-            folders = [x for _, x in sorted(zip(cnts, folders), reverse=True)]
+        for group, counts in group_count.items():
+            folders = [x for _, x in sorted(((c, x) for x, c in counts.items()), reverse=True)]
             self.group_folder[group] = folders
             if group in ["Text", "Styles", "Images", "Audio", "Fonts", "Video", "Misc"]:
                 afolder = folders[0]
@@ -323,7 +359,6 @@ class Opf_Parser(object):
         p = 1
         tname = None
         ttype = None
-        tattr = OrderedDict()
         while p < n and s[p:p + 1] == ' ' : p += 1
         if s[p:p + 1] == '/':
             ttype = 'end'
@@ -336,9 +371,10 @@ class Opf_Parser(object):
             p = b + 3
             tname = '!--'
             ttype, backstep = SPECIAL_HANDLING_TAGS[tname]
+            tattr = OrderedDict()
             tattr['special'] = s[p:backstep].strip()
             return tname, ttype, tattr
-        while p < n and s[p:p + 1] not in ('>', '/', ' ', '"', "'", "\r", "\n") : p += 1
+        p = _OPF_TAG_NAME.match(s, b).end()
         tname = s[b:p].lower()
         # remove redundant opf: namespace prefixes on opf tags
         if tname.startswith("opf:"):
@@ -348,37 +384,27 @@ class Opf_Parser(object):
             tname = '!DOCTYPE'
         if tname in SPECIAL_HANDLING_TAGS:
             ttype, backstep = SPECIAL_HANDLING_TAGS[tname]
+            tattr = OrderedDict()
             tattr['special'] = s[p:backstep]
-        if tname == "package":
-            a = 111
+            return ttype, tname, tattr
+        # end tags carry no attributes, share one empty mapping for all of them
+        if ttype == 'end':
+            return ttype, tname, _END_TAG_ATTRS
+        tattr = OrderedDict()
         if ttype is None:
             # parse any attributes of begin or single tags
-            while s.find('=', p) != -1 :
-                # 修改：标签属性的分割符由空格改为包括空格、换行符、制表符在内的空白符
-                # 可能是因为Sigil本身会处理掉 OPF 标签内部的换行符和制表符等，所以它这里没有把这些符号算在属性分割符内。
-                #while p < n and s[p:p + 1] == ' ' : p += 1
-                while p < n and s[p:p + 1] in (' ','\r','\n','\t') : p += 1 
-                b = p
-                while p < n and s[p:p + 1] != '=' : p += 1
-                aname = s[b:p].lower()
-                aname = aname.rstrip(' ')
-                p += 1
-                #while p < n and s[p:p + 1] == ' ' : p += 1 
-                while p < n and s[p:p + 1] in (' ','\r','\n','\t') : p += 1
-                if s[p:p + 1] in ('"', "'") :
-                    qt = s[p:p + 1]
-                    p = p + 1
-                    b = p
-                    while p < n and s[p:p + 1] != qt: p += 1
-                    val = s[b:p]
-                    p += 1
-                else :
-                    b = p
-                    #while p < n and s[p:p + 1] not in ('>', '/', ' '): p += 1
-                    while p < n and s[p:p + 1] not in ('>', '/', ' ','\r','\n','\t'): p += 1
-                    val = s[b:p]
-                tattr[aname] = val
-        if ttype is None:
+            # 修改：标签属性的分割符由空格改为包括空格、换行符、制表符在内的空白符
+            # 可能是因为Sigil本身会处理掉 OPF 标签内部的换行符和制表符等，所以它这里没有把这些符号算在属性分割符内。
+            for m in _OPF_TAG_ATTR.finditer(s, p):
+                aname, dq, sq, uq = m.groups()
+                if dq is not None:
+                    val = dq
+                elif sq is not None:
+                    val = sq
+                else:
+                    val = uq
+                tattr[aname.lower().rstrip(' ')] = val
+                p = m.end()
             ttype = 'begin'
             if s.find('/', p) >= 0:
                 ttype = 'single'
@@ -476,6 +502,22 @@ class Opf_Parser(object):
     def get_group_paths(self):
         return self.group_folder
 
+    # parsed state as a plain dict (for caching), the raw opf text is left out
+    def get_snapshot(self):
+        return {name: getattr(self, name) for name in _SNAPSHOT_FIELDS}
+
+    # rebuild a parser from get_snapshot() output without parsing anything
+    @classmethod
+    def from_snapshot(cls, state, debug=False):
+        op = cls.__new__(cls)
+        op._debug = debug
+        op.opf = None
+        op.opos = 0
+        for name in _SNAPSHOT_FIELDS:
+            setattr(op, name, state[name])
+        op.group_count = None
+        return op
+
 
 
 def main():
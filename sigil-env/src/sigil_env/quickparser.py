@@ -26,6 +26,9 @@
 # CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY
 # WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import re
+import codecs
+from types import MappingProxyType
 from collections import OrderedDict
 
 SPECIAL_HANDLING_TAGS = OrderedDict([
@@ -39,6 +42,113 @@ SPECIAL_HANDLING_TAGS = OrderedDict([
 
 SPECIAL_HANDLING_TYPES = ['xmlheader', 'doctype', 'comment', 'cdata', 'pi']
 
+# precompiled pieces of parsetag, each matches exactly what the original
+# character by character scan consumed
+# the '<', then any spaces, then an optional '/' and spaces for end tags
+_TAG_OPEN = re.compile(r'(?s).? *(/ *)?')
+# the tag name, only these characters delimit it
+_TAG_NAME = re.compile(r'''[^>/ "'\r\n]*''')
+# one attribute: only spaces are skipped, the name runs up to the '=' and
+# the value is either quoted (possibly unterminated) or runs up to '>', '/' or ' '
+_TAG_ATTR = re.compile(r''' *([^=]*)= *(?:(["'])(.*?)(?:\2|\Z)|([^>/ ]*))''', re.S)
+# one token of parseml: text, a comment or cdata section, a tag, or a stray '<'
+# that parseml returns as text up to the next '<'
+# (parseml looks for the end of a comment from just after the '<', so '<!-->' is a comment)
+_TOKEN = re.compile(r'''([^<]+)|(<!(?=--)(?s:.*?)-->|<!\[CDATA\[(?s:.*?)\]\]>)|(<[^<>]*>)|(<[^<>]*(?=<))''')
+# parsed tags are memoized per document
+_TAG_CACHE_SIZE = 4096
+# bytes read from the stream at a time in streaming mode
+_STREAM_CHUNK_SIZE = 64 * 1024
+
+# attributes of end tags and of tags without attributes
+_EMPTY_ATTRS = MappingProxyType({})
+
+def _special_attrs(info):
+    return MappingProxyType({'special': info})
+
+# parse the attributes of tag string s starting at p, returns (attrs, p) with
+# p just after the last attribute
+def _parse_attrs(s, p):
+    attrs = {}
+    # each match needs an '=' so the matches follow each other
+    # exactly as long as an '=' remains
+    m = None
+    for m in _TAG_ATTR.finditer(s, p):
+        aname, qt, qval, val = m.groups()
+        # attribute names can be mixed case and are in SVG
+        attrs[aname.rstrip(' ')] = val if qt is None else qval
+    if m is None:
+        return _EMPTY_ATTRS, p
+    return MappingProxyType(attrs), m.end()
+
+
+# a parsed tag as yielded by QuickXHTMLParser.token_iter
+# name and type are as returned by parsetag, attrs is a read only mapping that
+# is only parsed from the tag string when first accessed. Identical tags of a
+# document share one QuickTag, use dict(tag.attrs) to get a modifiable copy
+class QuickTag(object):
+
+    __slots__ = ('name', 'type', '_tag', '_start', '_attrs')
+
+    def __init__(self, name, type, attrs=None, tag=None, start=0):
+        self.name = name
+        self.type = type
+        self._tag = tag
+        self._start = start
+        self._attrs = attrs
+
+    @property
+    def attrs(self):
+        attrs = self._attrs
+        if attrs is None:
+            attrs = self._attrs = _parse_attrs(self._tag, self._start)[0]
+        return attrs
+
+    def __repr__(self):
+        return "QuickTag(%r, %r, %r)" % (self.name, self.type, dict(self.attrs))
+
+
+# builds the QuickTag for tag string s, same rules as QuickXHTMLParser.parsetag
+def _quick_tag(s):
+    m = _TAG_OPEN.match(s)
+    is_end = m.group(1) is not None
+    b = p = m.end()
+    # handle comment special case as there may be no spaces to
+    # delimit name begin or end
+    if s.startswith('!--', b):
+        ttype, backstep = SPECIAL_HANDLING_TAGS['!--']
+        return QuickTag('!--', ttype, _special_attrs(s[b + 3:backstep]))
+    # handle cdata special case as there may be no spaces to delimit name begin or end
+    if s.startswith("![CDATA[", b):
+        ttype, backstep = SPECIAL_HANDLING_TAGS["![CDATA["]
+        return QuickTag("![CDATA[", ttype, _special_attrs(s[b + 8:backstep]))
+    p = _TAG_NAME.match(s, b).end()
+    tname = s[b:p].lower()
+    # deal with other remaining special cases
+    # generic xml processing instruction (pi)
+    if tname != "?xml" and s.startswith("?", b):
+        ttype, backstep = SPECIAL_HANDLING_TAGS["?"]
+        return QuickTag("?", ttype, _special_attrs(s[b + 1:backstep]))
+    # remaining special cases
+    if tname == '!doctype':
+        tname = '!DOCTYPE'
+    if tname in SPECIAL_HANDLING_TAGS:
+        ttype, backstep = SPECIAL_HANDLING_TAGS[tname]
+        return QuickTag(tname, ttype, _special_attrs(s[p:backstep]))
+    if is_end:
+        return QuickTag(tname, 'end', _EMPTY_ATTRS)
+    # without a '/' after the name the tag is a begin tag whatever its
+    # attributes are, so they can be parsed later
+    if s.find('/', p) == -1:
+        return QuickTag(tname, 'begin', None, s, p)
+    # label beginning and single tags
+    attrs, p = _parse_attrs(s, p)
+    ttype = 'begin'
+    if s.find('/', p) >= 0:
+        ttype = 'single'
+    return QuickTag(tname, ttype, attrs)
+
+
 class QuickXHTMLParser(object):
 
     def __init__(self):
@@ -46,6 +156,9 @@ class QuickXHTMLParser(object):
         self.content = None
         self.clen = 0
         self.tagpath = None
+        self._stream = None
+        self._decoder = None
+        self._chunksize = _STREAM_CHUNK_SIZE
 
     def setContent(self, data, codec='utf-8'):
         if data is None:
@@ -57,84 +170,40 @@ class QuickXHTMLParser(object):
         self.pos = 0
         self.clen = len(self.content)
         self.tagpath = ['']
+        self._stream = None
+
+    # streaming mode: parse from a binary file object or mmap, anything with
+    # read(n), decoding chunksize bytes at a time. parse_iter yields exactly
+    # what it yields for setContent(fp.read()), but only the current chunk
+    # and the token being read are kept in memory
+    def setStream(self, fp, codec='utf-8', chunksize=_STREAM_CHUNK_SIZE):
+        self.content = ''
+        self.pos = 0
+        self.clen = 0
+        self.tagpath = ['']
+        self._stream = fp
+        self._decoder = codecs.getincrementaldecoder(codec)()
+        self._chunksize = chunksize
+
+    # drop the parsed part of the buffer and append the next decoded chunk,
+    # the decoder keeps multibyte sequences split across chunks
+    def _fill(self):
+        data = self._stream.read(self._chunksize)
+        final = not data
+        text = self._decoder.decode(data, final)
+        self.content = self.content[self.pos:] + text
+        self.pos = 0
+        self.clen = len(self.content)
+        if final:
+            self._stream = None
 
 
     # parses string version of tag to identify its name,
     # its type 'begin', 'end' or 'single',
     # plus build a hashtable of its atributes
     def parsetag(self, s):
-        n = len(s)
-        p = 1
-        # get the tag name
-        tname = None
-        ttype = None
-        tattr = OrderedDict()
-        while p < n and s[p:p + 1] == ' ' : p += 1
-        if s[p:p + 1] == '/':
-            ttype = 'end'
-            p += 1
-            while p < n and s[p:p + 1] == ' ' : p += 1
-        b = p
-        # handle comment special case as there may be no spaces to
-        # delimit name begin or end
-        if s[b:].startswith('!--'):
-            p = b + 3
-            tname = '!--'
-            ttype, backstep = SPECIAL_HANDLING_TAGS[tname]
-            tattr['special'] = s[p:backstep]
-            return tname, ttype, tattr
-        # handle cdata special case as there may be no spaces to delimit name begin or end
-        if s[b:b+8] == "![CDATA[":
-            p = b+8
-            tname = "![CDATA["
-            ttype, backstep = SPECIAL_HANDLING_TAGS[tname]
-            tattr['special'] = s[p:backstep]
-            return tname, ttype, tattr
-        while p < n and s[p:p + 1] not in ('>', '/', ' ', '"', "'", "\r", "\n") : p += 1
-        tname = s[b:p].lower()
-        # deal with other remaining special cases
-        # generic xml processing instruction (pi)
-        if tname != "?xml" and s[b:b+1] == "?":
-            p = b+1
-            tname = "?"
-            ttype, backstep = SPECIAL_HANDLING_TAGS[tname]
-            tattr['special'] = s[p:backstep]
-            return tname, ttype, tattr
-        # remaining special cases
-        if tname == '!doctype':
-            tname = '!DOCTYPE'
-        if tname in SPECIAL_HANDLING_TAGS:
-            ttype, backstep = SPECIAL_HANDLING_TAGS[tname]
-            tattr['special'] = s[p:backstep]
-        if ttype is None:
-            # parse any attributes
-            while s.find('=', p) != -1 :
-                while p < n and s[p:p + 1] == ' ' : p += 1
-                b = p
-                while p < n and s[p:p + 1] != '=' : p += 1
-                # attribute names can be mixed case and are in SVG
-                aname = s[b:p]
-                aname = aname.rstrip(' ')
-                p += 1
-                while p < n and s[p:p + 1] == ' ' : p += 1
-                if s[p:p + 1] in ('"', "'") :
-                    qt = s[p:p + 1]
-                    p = p + 1
-                    b = p
-                    while p < n and s[p:p + 1] != qt : p += 1
-                    val = s[b:p]
-                    p += 1
-                else :
-                    b = p
-                    while p < n and s[p:p + 1] not in ('>', '/', ' ') : p += 1
-                    val = s[b:p]
-                tattr[aname] = val
-        # label beginning and single tags
-        if ttype is None:
-            ttype = 'begin'
-            if s.find('/', p) >= 0:
-                ttype = 'single'
-        return tname, ttype, tattr
+        tag = _quick_tag(s)
+        return tag.name, tag.type, OrderedDict(tag.attrs)
 
     # parse leading text of xhtml and tag
     # returns as tuple (Leading Text, Tag)
@@ -170,31 +239,74 @@ class QuickXHTMLParser(object):
 
 
 
+    # yields leading text, tagpath prefix and a QuickTag
+    # only one of text and tag will have a value, the other will be None
+    # tag prefix is a dotted history of all open parent ("begin') tags
+    def token_iter(self):
+        # joined tagpath prefixes, kept in step with self.tagpath so the
+        # prefix is not rebuilt with a join for every token
+        tpstack = [".".join(self.tagpath)]
+        # tag string -> QuickTag, tags repeat a lot in real books
+        tagcache = {}
+        while True:
+            p = self.pos
+            content = self.content
+            m = _TOKEN.match(content, p)
+            # in streaming mode read on while the token may continue past the
+            # end of the buffer: text, an unterminated comment or cdata, or a
+            # stray '<' with no '>' read yet
+            if self._stream is not None and (m is None
+                    or m.lastindex == 1 and m.end() == len(content)
+                    or m.lastindex > 2 and content.startswith(('<!--', '<![CDATA['), p)
+                    or m.lastindex == 4 and content.find('>', p + 1) == -1):
+                self._fill()
+                continue
+            if m is None or m.lastindex > 2 and content.startswith(('<!--', '<![CDATA['), p) \
+                    or m.lastindex == 4 and content.find('>', p + 1) == -1:
+                # unterminated comments, cdata and tags take the slow path
+                text, tag = self.parseml()
+            elif m.lastindex == 1 or m.lastindex == 4:
+                text, tag = m.group(), None
+                self.pos = m.end()
+            else:
+                text, tag = None, m.group()
+                self.pos = m.end()
+            if text is None and tag is None:
+                break
+            tp = tpstack[-1] if tpstack else ''
+            if tag is None:
+                yield text, tp, None
+                continue
+            qtag = tagcache.get(tag)
+            if qtag is None:
+                qtag = _quick_tag(tag)
+                if len(tagcache) >= _TAG_CACHE_SIZE:
+                    tagcache.clear()
+                tagcache[tag] = qtag
+            tname = qtag.name
+            ttype = qtag.type
+            if ttype == 'end':
+                last_begin = self.tagpath[-1]
+                if last_begin != tname:
+                    print('Warning: Improperly Nested Tags, nesting: ', self.tagpath, ' but parsing end tag: ', tname)
+            yield None, tp, qtag
+            if ttype == 'begin':
+                self.tagpath.append(tname)
+                tpstack.append(tp + '.' + tname if tpstack else tname)
+            elif ttype == 'end':
+                self.tagpath.pop()
+                tpstack.pop()
+
     # yields leading text, tagpath prefix, tag name, tag type, tag attributes
     # tag prefix is a dotted history of all open parent ("begin') tags
     # tag types are "single", "begin", "end", "comment", "xmlheader", and "doctype"
     # tag attributes is a dictionary of key and value pairs
     def parse_iter(self):
-        while True:
-            text, tag = self.parseml()
-            if text is None and tag is None:
-                break
-            tp = ".".join(self.tagpath)
-            if text is not None:
-                tname = ttype = tattr = None
-            if tag is not None:
-                text = None
-                tname, ttype, tattr = self.parsetag(tag)
-                if ttype == 'end':
-                    last_begin = self.tagpath[-1]
-                    if last_begin != tname:
-                        print('Warning: Improperly Nested Tags, nesting: ', self.tagpath, ' but parsing end tag: ', tname)
-            yield text, tp, tname, ttype, tattr
-            if ttype is not None:
-                if ttype == 'begin':
-                    self.tagpath.append(tname)
-                elif ttype == 'end':
-                    self.tagpath.pop()
+        for text, tp, tag in self.token_iter():
+            if tag is None:
+                yield text, tp, None, None, None
+            else:
+                yield None, tp, tag.name, tag.type, OrderedDict(tag.attrs)
 
 
     # create xml tag from tag info
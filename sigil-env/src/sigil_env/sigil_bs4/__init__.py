@@ -240,6 +240,8 @@ class BeautifulSoup(Tag):
         d = dict(self.__dict__)
         if 'builder' in d and not self.builder.picklable:
             del d['builder']
+        # The index is keyed by object ids, rebuild it after unpickling.
+        d.pop('_soup_index', None)
         return d
 
     def _feed(self):
@@ -254,6 +256,7 @@ class BeautifulSoup(Tag):
 
     def reset(self):
         Tag.__init__(self, self, self.builder, self.ROOT_TAG_NAME)
+        self._soup_index = None
         self.hidden = 1
         self.builder.reset()
         self.current_data = []
@@ -262,6 +265,25 @@ class BeautifulSoup(Tag):
         self.preserve_whitespace_tag_stack = []
         self.pushTag(self)
 
+    def enable_index(self):
+        """Speed up find(), find_all() and select() on this soup by
+        keeping its tags indexed by name, id and class.
+
+        The index is built on the first search and rebuilt after the tree
+        changes. It's worth it when a document is searched many times.
+        Changing tag.name or tag.attrs directly (rather than through
+        tag[key] = value) isn't noticed, call reset_index() afterwards.
+        """
+        self._index_enabled = True
+
+    def disable_index(self):
+        self._index_enabled = False
+        self._soup_index = None
+
+    def reset_index(self):
+        """Drop the index, it will be rebuilt on the next search."""
+        self._soup_index = None
+
     def new_tag(self, name, namespace=None, nsprefix=None, **attrs):
         """Create a new tag associated with this soup."""
         return Tag(None, self.builder, name, namespace, nsprefix, attrs)
@@ -5,9 +5,11 @@ except ImportError as e:
 import sys
 from collections import OrderedDict
 
+from functools import partial
 from pdb import set_trace
 import re
 import warnings
+from bisect import bisect_left, bisect_right
 from sigil_bs4.dammit import EntitySubstitution
 
 DEFAULT_OUTPUT_ENCODING = "utf-8"
@@ -53,6 +55,38 @@ def _alias(attr):
         return setattr(self, attr)
     return alias
 
+# The serializers of Tag write their output as a list of string pieces.
+# These work on the pieces from index start on as if they were one string.
+
+def _last_piece(s, start):
+    """Index of the last non-empty piece of s from start on, or None."""
+    i = len(s) - 1
+    while i >= start:
+        if s[i]:
+            return i
+        i -= 1
+    return None
+
+def _lstrip_pieces(s, start):
+    """Strip leading whitespace from the pieces of s from start on."""
+    for i in range(start, len(s)):
+        piece = s[i].lstrip()
+        s[i] = piece
+        if piece:
+            break
+
+def _rstrip_pieces(s, start):
+    """Strip trailing whitespace from the pieces of s from start on."""
+    for i in range(len(s) - 1, start - 1, -1):
+        piece = s[i].rstrip()
+        s[i] = piece
+        if piece:
+            break
+
+def _strip_pieces(s, start):
+    _lstrip_pieces(s, start)
+    _rstrip_pieces(s, start)
+
 
 class NamespacedAttribute(str):
 
@@ -219,6 +253,21 @@ class PageElement(object):
             return self.HTML_FORMATTERS.get(
                 name, HTMLAwareEntitySubstitution.substitute_xml)
 
+    # Search index of a soup, see BeautifulSoup.enable_index(). Defined
+    # here so that looking them up on any element never reaches
+    # __getattr__.
+    _index_enabled = False
+    _soup_index = None
+
+    def _tree_changed(self):
+        """Drop the search index of the soup containing this element, if
+        any. Called before the tree structure changes."""
+        root = self
+        while root.parent is not None:
+            root = root.parent
+        if root._soup_index is not None:
+            root._soup_index = None
+
     def setup(self, parent=None, previous_element=None, next_element=None,
               previous_sibling=None, next_sibling=None):
         """Sets up the initial relations between this element and
@@ -285,6 +334,7 @@ class PageElement(object):
 
     def extract(self):
         """Destructively rips this element out of the tree."""
+        self._tree_changed()
         if self.parent is not None:
             del self.parent.contents[self.parent.index(self)]
 
@@ -333,6 +383,7 @@ class PageElement(object):
             and not isinstance(new_child, NavigableString)):
             new_child = NavigableString(new_child)
 
+        self._tree_changed()
         position = min(position, len(self.contents))
         if hasattr(new_child, 'parent') and new_child.parent is not None:
             # We're 'inserting' an element that's already one
@@ -1015,6 +1066,12 @@ class Tag(PageElement):
         """Setting tag[key] sets the value of the 'key' attribute for the
         tag."""
         self.attrs[key] = value
+        if key in _SoupIndex.ATTRIBUTES:
+            root = self
+            while root.parent is not None:
+                root = root.parent
+            if root._soup_index is not None:
+                root._soup_index.attribute_set(self, key, value)
 
     def __delitem__(self, key):
         "Deleting tag[key] deletes all 'key' attributes for the tag."
@@ -1335,62 +1392,9 @@ class Tag(PageElement):
         # will stop the lookup from happening over and over again.
         if not isinstance(formatter, Callable):
             formatter = self._formatter_for_name(formatter)
-
-        prefix = ''
-        close = ''
-        closeTag = ''
-        attrs = []
-        if self.attrs:
-            for key, val in self.attrs.items():
-                if val is None:
-                    ntext = key
-                else:
-                    if isinstance(val, list) or isinstance(val, tuple):
-                        val = ' '.join(val)
-                    elif not isinstance(val, str):
-                        val = str(val)
-                    elif (isinstance(val, AttributeValueWithCharsetSubstitution) and 
-                          eventual_encoding is not None):
-                        val = val.encode(eventual_encoding)
-                    text = self.format_string(val, formatter)
-                    ntext = (str(key) + '=' + EntitySubstitution.quoted_attribute_value(text))
-                attrs.append(ntext)
-
-        contents = self.serialize_xhtml_contents(eventual_encoding, formatter)
-
-        in_xml_ns = self.namespace != 'http://www.w3.org/1999/xhtml'
-        testcontents = contents.strip()
-
-        if self.prefix:
-            prefix = self.prefix + ":"
-
-        if self.name in VOID_TAGS or (in_xml_ns and testcontents==""):
-            close = '/'
-        else:
-            closeTag = '</%s%s>' % (prefix, self.name)
-
-        # strip extraneous whitespace before the primary closing tag
-        if self.name in SPECIAL_HANDLING_TAGS:
-            contents = contents.strip()
-            contents += "\n"
-
-        if self.hidden:
-            # This is the 'document root' object.
-            s = contents
-        else:
-            s = []
-            attribute_string = ''
-            if attrs:
-                attribute_string = ' ' + ' '.join(attrs)
-            s.append('<%s%s%s%s>' % (prefix, self.name, attribute_string, close))
-            if self.name in SPECIAL_HANDLING_TAGS:
-                s.append("\n")
-            s.append(contents)
-            s.append(closeTag)
-            if self.name in SPECIAL_HANDLING_TAGS:
-                s.append("\n")
-            s = ''.join(s)
-        return s
+        s = []
+        self._serialize_xhtml_into(s, eventual_encoding, formatter, False)
+        return ''.join(s)
 
     def serialize_xhtml_contents(self, eventual_encoding=DEFAULT_OUTPUT_ENCODING, formatter="minimal"):
 
@@ -1398,118 +1402,121 @@ class Tag(PageElement):
         # will stop the lookup from happening over and over again.
         if not isinstance(formatter, Callable):
             formatter = self._formatter_for_name(formatter)
-
         s = []
-        for c in self:
-            text = None
-            if isinstance(c, Comment):
-                text = Comment(c).output_ready(formatter)
-                s.append(text)
-            elif isinstance(c, CData):
-                text = CData(c).output_ready(formatter)
-                s.append(text)
-            elif isinstance(c, NavigableString):
-                text = c.output_ready(formatter)
-                s.append(text)
-            elif isinstance(c, Tag):
-                s.append(c.serialize_xhtml(eventual_encoding, formatter))
+        self._serialize_xhtml_into(s, eventual_encoding, formatter, True)
         return ''.join(s)
 
-    def prettyprint_xhtml(self, indent_level=0, eventual_encoding=DEFAULT_OUTPUT_ENCODING, 
+    def _serialize_xhtml_into(self, s, eventual_encoding, formatter, contents_only):
+        """Append the pieces of serialize_xhtml() (or of
+        serialize_xhtml_contents() if contents_only) to the list s.
+
+        The tree is walked with an explicit stack instead of recursing,
+        and every tag writes into the same list: its start tag goes into
+        a slot reserved before its contents, filled in once we know
+        whether the contents are blank.
+        """
+        stack = []
+        tag = self
+        children = iter(self.contents)
+        # Index of the slot for the start tag, None for the contents only.
+        start = None
+        if not contents_only:
+            start = len(s)
+            s.append('')
+        # Whether the contents so far are more than whitespace.
+        nonblank = False
+        while True:
+            for c in children:
+                if isinstance(c, Tag):
+                    stack.append((tag, children, start, nonblank))
+                    tag = c
+                    children = iter(c.contents)
+                    start = len(s)
+                    s.append('')
+                    nonblank = False
+                    break
+                if type(c) is NavigableString:
+                    text = c if formatter is None else formatter(c)
+                elif isinstance(c, Comment):
+                    text = Comment(c).output_ready(formatter)
+                elif isinstance(c, CData):
+                    text = CData(c).output_ready(formatter)
+                elif isinstance(c, NavigableString):
+                    text = c.output_ready(formatter)
+                else:
+                    continue
+                s.append(text)
+                if not nonblank and text.strip():
+                    nonblank = True
+            else:
+                # All of tag's contents are written out, close it.
+                if start is None:
+                    return
+                name = tag.name
+                if name in SPECIAL_HANDLING_TAGS:
+                    # strip extraneous whitespace before the primary closing tag
+                    _strip_pieces(s, start + 1)
+                    s.append("\n")
+                if tag.hidden:
+                    # This is the 'document root' object.
+                    child_nonblank = nonblank
+                else:
+                    prefix = ''
+                    if tag.prefix:
+                        prefix = tag.prefix + ":"
+                    in_xml_ns = tag.namespace != 'http://www.w3.org/1999/xhtml'
+                    attribute_string = tag._xhtml_attribute_string(eventual_encoding, formatter)
+                    if name in VOID_TAGS or (in_xml_ns and not nonblank):
+                        s[start] = '<%s%s%s/>' % (prefix, name, attribute_string)
+                    else:
+                        s[start] = '<%s%s%s>' % (prefix, name, attribute_string)
+                        s.append('</%s%s>' % (prefix, name))
+                    if name in SPECIAL_HANDLING_TAGS:
+                        s[start] += "\n"
+                        s.append("\n")
+                    child_nonblank = True
+                if not stack:
+                    return
+                tag, children, start, nonblank = stack.pop()
+                nonblank = nonblank or child_nonblank
+
+    def _xhtml_attribute_string(self, eventual_encoding, formatter):
+        """The attributes of this tag for serialize_xhtml() and
+        prettyprint_xhtml(), with a leading space. formatter must already
+        be a function (or None)."""
+        if not self.attrs:
+            return ''
+        attrs = []
+        for key, val in self.attrs.items():
+            if val is None:
+                ntext = key
+            else:
+                if isinstance(val, list) or isinstance(val, tuple):
+                    val = ' '.join(val)
+                elif not isinstance(val, str):
+                    val = str(val)
+                elif (isinstance(val, AttributeValueWithCharsetSubstitution) and
+                      eventual_encoding is not None):
+                    val = val.encode(eventual_encoding)
+                if formatter is not None:
+                    val = formatter(val)
+                ntext = (str(key) + '=' + EntitySubstitution.quoted_attribute_value(val))
+            attrs.append(ntext)
+        return ' ' + ' '.join(attrs)
+
+    def prettyprint_xhtml(self, indent_level=0, eventual_encoding=DEFAULT_OUTPUT_ENCODING,
                formatter="minimal", indent_chars=" "):
 
         # First off, turn a string formatter into a function. This
         # will stop the lookup from happening over and over again.
         if not isinstance(formatter, Callable):
             formatter = self._formatter_for_name(formatter)
+        s = []
+        self._prettyprint_xhtml_into(s, indent_level, eventual_encoding, formatter,
+                                     indent_chars, False)
+        return ''.join(s)
 
-        is_structural = self.name in STRUCTURAL_TAGS
-        is_inline = self.name in NON_BREAKING_INLINE_TAGS
-
-        # build attribute string
-        attribs = []
-        atts = ""
-        if self.attrs:
-            for key, val in self.attrs.items():
-                if val is None:
-                    decoded = key
-                else:
-                    if isinstance(val, list) or isinstance(val, tuple):
-                        val = ' '.join(val)
-                    elif not isinstance(val, str):
-                        val = str(val)
-                    elif (
-                        isinstance(val, AttributeValueWithCharsetSubstitution)
-                        and eventual_encoding is not None):
-                        val = val.encode(eventual_encoding)
-
-                    text = self.format_string(val, formatter)
-                    decoded = (
-                        str(key) + '='
-                        + EntitySubstitution.quoted_attribute_value(text))
-                attribs.append(decoded)
-            atts = " " + " ".join(attribs)
-
-
-        # get tag content
-        contents=""
-        is_void_tag = self.name in VOID_TAGS
-        if not is_void_tag:
-            if is_structural:
-                contents = self.prettyprint_xhtml_contents(indent_level+1, eventual_encoding, formatter, indent_chars)
-            else:
-                contents = self.prettyprint_xhtml_contents(indent_level, eventual_encoding, formatter, indent_chars)
-
-        if self.hidden:
-            # This is the 'document root' object.
-            return contents
-
-        in_xml_ns = self.namespace != 'http://www.w3.org/1999/xhtml'
-        testcontents = contents.strip()
-        single = self.name in VOID_TAGS or (in_xml_ns and testcontents == "")
-
-        prefix = ''
-        if self.prefix:
-            prefix = self.prefix + ":"
-
-        is_keepwhitespace = self.name in PRESERVE_WHITESPACE_TAGS
-        if not is_keepwhitespace and not is_inline:
-            contents = contents.rstrip()
-
-        indent_space = (indent_chars * (indent_level - 1))
-
-        # handle self-closed tags with no content first
-        if single:
-            selfclosetag = '<%s%s%s/>' % (prefix, self.name, atts)
-            if is_inline:
-                # always add newline after br tags when they are children of structural tags
-                if (self.name == "br") and self.parent.name in STRUCTURAL_TAGS:
-                    selfclosetag += "\n"
-                return selfclosetag
-            return indent_space + selfclosetag + "\n"
-
-        # handle the general case
-        starttag = '<%s%s%s>' % (prefix, self.name, atts)
-        closetag = '</%s%s>' % (prefix, self.name)
-        results = ""
-        if is_structural:
-            results = indent_space + starttag
-            if contents != "":
-                results += "\n" + contents + "\n" + indent_space
-            results += closetag + "\n"
-        elif is_inline:
-            results = starttag
-            results += contents
-            results += closetag
-        else:
-            results = indent_space + starttag
-            if not is_keepwhitespace:
-                contents = contents.lstrip()
-            results += contents
-            results += closetag + "\n"
-        return results
-
-    def prettyprint_xhtml_contents(self, indent_level=0, eventual_encoding=DEFAULT_OUTPUT_ENCODING, 
+    def prettyprint_xhtml_contents(self, indent_level=0, eventual_encoding=DEFAULT_OUTPUT_ENCODING,
                         formatter="minimal", indent_chars=" "):
         """Renders the contents of this tag as a Unicode string.
         """
@@ -1517,82 +1524,211 @@ class Tag(PageElement):
         # will stop the lookup from happening over and over again.
         if not isinstance(formatter, Callable):
             formatter = self._formatter_for_name(formatter)
+        s = []
+        self._prettyprint_xhtml_into(s, indent_level, eventual_encoding, formatter,
+                                     indent_chars, True)
+        return ''.join(s)
 
-        is_structural = self.name in STRUCTURAL_TAGS
-        is_inline = self.name in NON_BREAKING_INLINE_TAGS
-        is_keepwhitespace = self.name in PRESERVE_WHITESPACE_TAGS
-        indent_space = (indent_chars * (indent_level - 1))
-        last_char = "x"
-        contains_block_tags = False
+    def _prettyprint_xhtml_into(self, s, indent_level, eventual_encoding, formatter,
+                                indent_chars, contents_only):
+        """Append the pieces of prettyprint_xhtml() (or of
+        prettyprint_xhtml_contents() if contents_only) to the list s.
 
-        if is_structural or self.hidden:
-            last_char = "\n"
+        Like _serialize_xhtml_into(), this walks the tree with an explicit
+        stack. The whitespace fixups that used to strip a child's rendered
+        string are done on the child's pieces at the end of s.
+        """
+        indents = {}
+        def indent_for(level):
+            indent = indents.get(level)
+            if indent is None:
+                indent = indents[level] = indent_chars * (level - 1)
+            return indent
+
+        stack = []
+        tag = self
+        name = self.name
+        start = None
+        if contents_only:
+            level = indent_level
+            children = iter(self.contents)
+        else:
+            start = len(s)
+            s.append('')
+            level = indent_level + 1 if name in STRUCTURAL_TAGS else indent_level
+            if name in VOID_TAGS:
+                children = iter(())
+            else:
+                children = iter(self.contents)
+        # The indent of tag itself and the one of its contents.
+        tag_indent = indent_for(indent_level)
+        indent_space = indent_for(level)
+        is_structural = name in STRUCTURAL_TAGS
+        is_inline = name in NON_BREAKING_INLINE_TAGS
+        is_keepwhitespace = name in PRESERVE_WHITESPACE_TAGS
+        last_char = "\n" if is_structural or self.hidden else "x"
+        contains_block_tags = False
+        # Whether the contents so far are more than whitespace.
+        nonblank = False
+        # Whether the parent strips leading whitespace from tag's output.
+        lstrip = False
 
-        s = []
+        while True:
+            for c in children:
+                if isinstance(c, Tag):
+                    child_name = c.name
+                    child_inline = child_name in NON_BREAKING_INLINE_TAGS
+                    # track if contains block tags and append newline and prepend newline if needed
+                    if not child_inline:
+                        contains_block_tags = True
+                        if last_char != "\n":
+                            s.append("\n")
+                            last_char = "\n"
+                    # if child of a structual tag is inline and follows a newline, indent it properly
+                    child_lstrip = False
+                    if is_structural and child_inline and last_char == '\n':
+                        s.append(indent_space)
+                        child_lstrip = True
+                    stack.append((tag, children, start, level, tag_indent, indent_space,
+                                  is_structural, is_inline, is_keepwhitespace,
+                                  last_char, contains_block_tags, nonblank, lstrip))
+                    tag = c
+                    name = child_name
+                    start = len(s)
+                    s.append('')
+                    tag_indent = indent_space
+                    is_structural = name in STRUCTURAL_TAGS
+                    is_inline = child_inline
+                    is_keepwhitespace = name in PRESERVE_WHITESPACE_TAGS
+                    if is_structural:
+                        level += 1
+                        indent_space = indent_for(level)
+                    if name in VOID_TAGS:
+                        children = iter(())
+                    else:
+                        children = iter(c.contents)
+                    last_char = "\n" if is_structural or c.hidden else "x"
+                    contains_block_tags = False
+                    nonblank = False
+                    lstrip = child_lstrip
+                    break
 
-        for c in self:
-            text = None
-            if isinstance(c, Comment):
-                text = Comment(c).output_ready(formatter)
-                s.append(text)
-            elif isinstance(c, CData):
-                text = CData(c).output_ready(formatter)
-                s.append(text)
-            elif isinstance(c, NavigableString):
-                text = c.output_ready(formatter)
-                tval = text
-                is_whitespace = (tval.strip() == "")
-
-                # handle pure whitespace differently
-                if is_whitespace:
-                    if is_keepwhitespace:
-                        s.append(text)
-                    elif is_inline or self.name in OTHER_TEXTHOLDING_TAGS:
-                        if last_char not in " \t\v\f\r\n":
-                            s.append(" ")
-                        else:
-                            s.append("")
+                if isinstance(c, Comment):
+                    text = Comment(c).output_ready(formatter)
+                elif isinstance(c, CData):
+                    text = CData(c).output_ready(formatter)
+                elif isinstance(c, NavigableString):
+                    if type(c) is NavigableString:
+                        text = c if formatter is None else formatter(c)
                     else:
-                        # ignore this whitespace
-                        s.append("")
+                        text = c.output_ready(formatter)
+
+                    # handle pure whitespace differently
+                    if not text.strip():
+                        if is_keepwhitespace:
+                            pass
+                        elif is_inline or name in OTHER_TEXTHOLDING_TAGS:
+                            if last_char not in " \t\v\f\r\n":
+                                text = " "
+                            else:
+                                continue
+                        else:
+                            # ignore this whitespace
+                            continue
 
-                # handle all other text
+                    # handle all other text
+                    else:
+                        if is_structural and last_char == "\n":
+                            s.append(indent_space)
+                            text = text.lstrip()
                 else:
-                    if is_structural and last_char == "\n":
-                        s.append(indent_space)
-                        text = text.lstrip()
-                    s.append(text)
+                    continue
+                s.append(text)
+                if text != "":
+                    last_char = text[-1:]
+                    if not nonblank and text.strip():
+                        nonblank = True
 
-            # handle tags
-            elif isinstance(c, Tag):
-                val = c.prettyprint_xhtml(indent_level, eventual_encoding, formatter, indent_chars)
-                # track if contains block tags and append newline and prepend newline if needed
-                if not c.name in NON_BREAKING_INLINE_TAGS:
-                    contains_block_tags = True
+            else:
+                # after processing all children, handle inline tags that contain block level tags
+                if is_inline and contains_block_tags:
                     if last_char != "\n":
                         s.append("\n")
-                        last_char = "\n"
-                # if child of a structual tag is inline and follows a newline, indent it properly
-                if is_structural and c.name in NON_BREAKING_INLINE_TAGS and last_char == '\n':
                     s.append(indent_space)
-                    val = val.lstrip()
-                s.append(val)
 
-            else:
-                s.append("")
+                if start is None:
+                    return
+                if tag.hidden:
+                    # This is the 'document root' object.
+                    child_nonblank = nonblank
+                else:
+                    self._close_prettyprint_xhtml_tag(
+                        s, start, tag, tag_indent, nonblank, is_structural, is_inline,
+                        is_keepwhitespace, eventual_encoding, formatter)
+                    child_nonblank = True
+                if not stack:
+                    return
+                child_start = start
+                child_lstrip = lstrip
+                (tag, children, start, level, tag_indent, indent_space,
+                 is_structural, is_inline, is_keepwhitespace,
+                 last_char, contains_block_tags, nonblank, lstrip) = stack.pop()
+                name = tag.name
+                if child_lstrip:
+                    _lstrip_pieces(s, child_start)
+                i = _last_piece(s, child_start)
+                if i is not None:
+                    last_char = s[i][-1:]
+                nonblank = nonblank or child_nonblank
+
+    @staticmethod
+    def _close_prettyprint_xhtml_tag(s, start, tag, indent_space, nonblank, is_structural,
+                                     is_inline, is_keepwhitespace, eventual_encoding,
+                                     formatter):
+        """Wrap the contents of tag, found in s after index start, in its
+        start and end tags for prettyprint_xhtml()."""
+        name = tag.name
+        atts = tag._xhtml_attribute_string(eventual_encoding, formatter)
+        in_xml_ns = tag.namespace != 'http://www.w3.org/1999/xhtml'
+        single = name in VOID_TAGS or (in_xml_ns and not nonblank)
 
-            # update last_char
-            last_element = s[-1]
-            if last_element != "":
-                last_char = last_element[-1:]
+        prefix = ''
+        if tag.prefix:
+            prefix = tag.prefix + ":"
 
-        # after processing all children, handle inline tags that contain block level tags
-        if is_inline and contains_block_tags:
-            if last_char != "\n":
-                s.append("\n")
-            s.append(indent_space)
+        # handle self-closed tags with no content first
+        if single:
+            del s[start + 1:]
+            selfclosetag = '<%s%s%s/>' % (prefix, name, atts)
+            if is_inline:
+                # always add newline after br tags when they are children of structural tags
+                if (name == "br") and tag.parent.name in STRUCTURAL_TAGS:
+                    selfclosetag += "\n"
+                s[start] = selfclosetag
+            else:
+                s[start] = indent_space + selfclosetag + "\n"
+            return
 
-        return ''.join(s)
+        # handle the general case
+        starttag = '<%s%s%s>' % (prefix, name, atts)
+        closetag = '</%s%s>' % (prefix, name)
+        if not is_keepwhitespace and not is_inline:
+            _rstrip_pieces(s, start + 1)
+        if is_structural:
+            if _last_piece(s, start + 1) is not None:
+                s[start] = indent_space + starttag + "\n"
+                s.append("\n" + indent_space + closetag + "\n")
+            else:
+                s[start] = indent_space + starttag
+                s.append(closetag + "\n")
+        elif is_inline:
+            s[start] = starttag
+            s.append(closetag)
+        else:
+            s[start] = indent_space + starttag
+            if not is_keepwhitespace:
+                _lstrip_pieces(s, start + 1)
+            s.append(closetag + "\n")
 
     def encode_contents(
         self, indent_level=None, encoding=DEFAULT_OUTPUT_ENCODING,
@@ -1644,6 +1780,12 @@ class Tag(PageElement):
         string matches for some custom definition of 'matches'. The
         same is true of the tag name."""
 
+        if recursive and text is None and 'string' not in kwargs:
+            index = self._search_index()
+            if index is not None:
+                results = index.find_all(self, name, attrs, limit, kwargs)
+                if results is not None:
+                    return results
         generator = self.descendants
         if not recursive:
             generator = self.children
@@ -1651,6 +1793,18 @@ class Tag(PageElement):
     findAll = find_all       # BS3
     findChildren = find_all  # BS2
 
+    def _search_index(self):
+        """Return the search index of the soup containing this tag,
+        building it if needed, or None if the soup isn't indexed."""
+        root = self
+        while root.parent is not None:
+            root = root.parent
+        if not root._index_enabled:
+            return None
+        if root._soup_index is None:
+            root._soup_index = _SoupIndex(root)
+        return root._soup_index
+
     #Generator methods
     @property
     def children(self):
@@ -1713,6 +1867,8 @@ class Tag(PageElement):
                     print(' Considering token "%s"' % token)
                 recursive_candidate_generator = None
                 tag_name = None
+                # (kind, value) to look up in the soup's search index
+                index_key = None
 
                 # Each operation corresponds to a checker function, a rule
                 # for determining whether a candidate matches the
@@ -1729,6 +1885,7 @@ class Tag(PageElement):
                 elif '#' in token:
                     # ID selector
                     tag_name, tag_id = token.split('#', 1)
+                    index_key = ('id', tag_id)
                     def id_matches(tag):
                         return tag.get('id', None) == tag_id
                     checker = id_matches
@@ -1737,6 +1894,10 @@ class Tag(PageElement):
                     # Class selector
                     tag_name, klass = token.split('.', 1)
                     classes = set(klass.split('.'))
+                    for k in klass.split('.'):
+                        if k:
+                            index_key = ('class', k)
+                            break
                     def classes_match(candidate):
                         return classes.issubset(candidate.get('class', []))
                     checker = classes_match
@@ -1852,7 +2013,21 @@ class Tag(PageElement):
                                 yield child
                         _use_candidate_generator = default_candidate_generator
                     else:
-                        _use_candidate_generator = lambda tag: tag.descendants
+                        if index_key is None and tag_name:
+                            index_key = ('name', tag_name)
+                        index = None
+                        if index_key is not None:
+                            index = self._search_index()
+                        if (index is not None and index_key[0] == 'class'
+                            and index.string_classes):
+                            # A string-valued class attribute matches a
+                            # class selector by substring, which the index
+                            # can't narrow down.
+                            index_key = ('name', tag_name) if tag_name else None
+                        if index is not None and index_key is not None:
+                            _use_candidate_generator = partial(index.candidates, *index_key)
+                        else:
+                            _use_candidate_generator = lambda tag: tag.descendants
                 else:
                     _use_candidate_generator = _candidate_generator
 
@@ -2104,3 +2279,114 @@ class ResultSet(list):
     def __init__(self, source, result=()):
         super(ResultSet, self).__init__(result)
         self.source = source
+
+
+class _SoupIndex(object):
+    """Tags of one soup grouped by name, id and class, in document order.
+
+    Built lazily by Tag._search_index() for soups that called
+    BeautifulSoup.enable_index(), and dropped whenever insert() or
+    extract() (and so replace_with(), wrap(), unwrap(), ...) changes
+    the tree. Setting tag['id'] or tag['class'] adds the tag to the new
+    buckets in place. Lookups only narrow down the candidates: every
+    candidate is still checked against the query, so a tag whose id or
+    class was removed is filtered out. Changing tag.name or tag.attrs
+    directly isn't tracked; call BeautifulSoup.reset_index() afterwards.
+    """
+
+    # Attributes indexed in addition to the tag name.
+    ATTRIBUTES = ('id', 'class')
+
+    def __init__(self, root):
+        # id(element) -> position of every element below root.
+        self.positions = {}
+        # kind -> value -> ([positions], [tags])
+        self.buckets = {'name': {}, 'id': {}, 'class': {}}
+        # Whether some tag has a string (rather than list) class value.
+        self.string_classes = False
+        positions = self.positions
+        names = self.buckets['name']
+        position = 0
+        for element in root.descendants:
+            positions[id(element)] = position
+            if isinstance(element, Tag):
+                self._append(names, element.name, position, element)
+                for key in self.ATTRIBUTES:
+                    value = element.attrs.get(key)
+                    if value:
+                        if key == 'class' and isinstance(value, str):
+                            self.string_classes = True
+                        for v in self._values(value):
+                            self._append(self.buckets[key], v, position, element)
+            position += 1
+
+    @staticmethod
+    def _values(value):
+        if isinstance(value, str):
+            return set(value.split())
+        return set(v for v in value if isinstance(v, str))
+
+    @staticmethod
+    def _append(bucket, value, position, tag):
+        entry = bucket.get(value)
+        if entry is None:
+            bucket[value] = ([position], [tag])
+        elif entry[0][-1] != position:
+            entry[0].append(position)
+            entry[1].append(tag)
+
+    def attribute_set(self, tag, key, value):
+        position = self.positions.get(id(tag))
+        if position is None:
+            return
+        if key == 'class' and isinstance(value, str):
+            self.string_classes = True
+        bucket = self.buckets[key]
+        for v in self._values(value or ()):
+            entry = bucket.get(v)
+            if entry is None:
+                bucket[v] = ([position], [tag])
+                continue
+            i = bisect_left(entry[0], position)
+            if i == len(entry[0]) or entry[0][i] != position:
+                entry[0].insert(i, position)
+                entry[1].insert(i, tag)
+
+    def candidates(self, kind, value, scope):
+        """Tags below scope that may match, in document order."""
+        entry = self.buckets[kind].get(value)
+        if entry is None:
+            return []
+        if scope.parent is None:
+            return entry[1]
+        start = self.positions.get(id(scope))
+        if start is None:
+            return []
+        end = self.positions[id(scope._last_descendant())]
+        return entry[1][bisect_right(entry[0], start):bisect_right(entry[0], end)]
+
+    def find_all(self, scope, name, attrs, limit, kwargs):
+        """Tag.find_all() over the index, or None when the query has
+        nothing the index can narrow down."""
+        if isinstance(name, SoupStrainer):
+            return None
+        strainer = SoupStrainer(name, attrs, None, **kwargs)
+        key = None
+        for kind in self.ATTRIBUTES:
+            value = strainer.attrs.get(kind)
+            if isinstance(value, str) and value.split():
+                key = (kind, value.split()[0])
+                break
+        if key is None:
+            # A prefixed name like 'svg:rect' matches on prefix + name.
+            if (not strainer.name or not isinstance(strainer.name, str)
+                or ':' in strainer.name):
+                return None
+            key = ('name', strainer.name)
+        results = ResultSet(strainer)
+        for tag in self.candidates(key[0], key[1], scope):
+            if strainer.search_tag(tag):
+                results.append(tag)
+                if limit and len(results) >= limit:
+                    break
+        return results
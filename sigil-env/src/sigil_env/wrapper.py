@@ -32,9 +32,15 @@ import re
 from hrefutils import urldecodepart, urlencodepart
 from hrefutils import buildBookPath, startingDir, buildRelativePath
 from hrefutils import ext_mime_map, mime_group_map
+from epub_utils import zip_write_members, zip_update_members, StdLinkRewriter, std_rewrite_in_processes
+from epub_utils import LinkGraph, LINK_SOURCE_MIMES, link_value, link_text
 import unicodedata
 import shutil
 import zipfile
+import io
+from bisect import bisect_left
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 
 def _utf8str(p):
     if p is None:
@@ -52,6 +58,10 @@ def _unicodestr(p):
 
 _launcher_version = 20230315
 
+# files larger than this are streamed in chunks when copied or packed
+_STREAM_MIN_SIZE = 8 * 1024 * 1024
+_COPY_CHUNK_SIZE = 1024 * 1024
+
 _PKG_VER = re.compile(r'''<\s*package[^>]*version\s*=\s*["']([^'"]*)['"][^>]*>''', re.IGNORECASE)
 
 # Wrapper Class is used to peform record keeping for Sigil.  It keeps track of modified,
@@ -96,9 +106,50 @@ def _epub_file_walk(top):
 class WrapperException(Exception):
     pass
 
+
+# Sigil 规范格式中各类文件所在的目录
+_STD_GROUP_PATHS = {
+    "Text"   : ["OEBPS/Text"],
+    "Styles" : ["OEBPS/Styles"],
+    "Fonts"  : ["OEBPS/Fonts"],
+    "Images" : ["OEBPS/Images"],
+    "Audio"  : ["OEBPS/Audio"],
+    "Video"  : ["OEBPS/Video"],
+    "Misc"   : ["OEBPS/Misc"],
+    "ncx"    : ["OEBPS"],
+    "opf"    : ["OEBPS"]
+}
+
+# standardize_epub 的执行计划，由 Wrapper.plan_standardize_epub 只根据 manifest 和文件列表计算。
+# 计划对应计算时的文件列表，应在增删文件之前执行。
+class StandardizePlan(object):
+
+    def __init__(self):
+        self.opf_move = None        # (旧 opf 路径, 新 opf 路径)，不需要移动时为 None
+        self.missing = []           # [id] manifest 中关联文件不存在的条目
+        self.moves = []             # [(id, 旧 bookpath, 新 bookpath)] 需要移动的 manifest 文件
+        self.deletes = []           # [id] 多余的 ncx
+        self.other_moves = []       # [(旧 book_href, 新 book_href)] 移入 META-INF 的 xml
+        self.other_adds = []        # [(旧 book_href, 新 bookpath, id, mime)] 移入标准目录并加入 manifest 的文件
+        self.other_deletes = []     # [book_href] 多余的 opf、ncx 和无法归类的文件
+        self.old_to_basename = {}   # 旧 bookpath（小写） -> 标准化后的文件名
+        self.new_to_old_group = {}  # 新 bookpath -> 文件原来所在的目录
+
+    # 移动过的文件的旧文件名（小写）
+    def moved_basenames(self):
+        moved = [bkpath for _, bkpath, _ in self.moves]
+        moved.extend(bkpath for bkpath, _ in self.other_moves)
+        moved.extend(bkpath for bkpath, _, _, _ in self.other_adds)
+        return {os.path.basename(bkpath).lower() for bkpath in moved}
+
+    def __repr__(self):
+        return "StandardizePlan(opf_move=%r, moves=%d, deletes=%d, other_moves=%d, other_adds=%d, other_deletes=%d, missing=%d)" % (
+            self.opf_move, len(self.moves), len(self.deletes), len(self.other_moves),
+            len(self.other_adds), len(self.other_deletes), len(self.missing))
+
 class Wrapper(object):
 
-    def __init__(self, ebook_root, epub_src, outdir, op, plugin_dir, plugin_name, debug=False):
+    def __init__(self, ebook_root, epub_src, outdir, op, plugin_dir, plugin_name, debug=False, backend='disk'):
         self._debug = debug
         self.ebook_root = os.fsdecode(ebook_root)
         # plugins and plugin containers can get name and user plugin dir
@@ -107,6 +158,23 @@ class Wrapper(object):
         self.outdir = os.fsdecode(outdir)
         self.epub_filepath = epub_src
 
+        # backend 'disk' works on an extracted copy of the epub in ebook_root
+        # backend 'zip' reads unmodified files directly from the source epub
+        # backend 'memory' keeps the source epub and all changed files in memory
+        self.backend = backend
+        self.epub = None
+        # archive holding the compressed data of all files not changed since the last save
+        self._source_epub = epub_src
+        self._last_saved = None
+        self._memfiles = {}
+        if backend == 'zip':
+            self.epub = zipfile.ZipFile(epub_src, 'r')
+        elif backend == 'memory':
+            with open(epub_src, 'rb') as fp:
+                self.epub = zipfile.ZipFile(io.BytesIO(fp.read()), 'r')
+        elif backend != 'disk':
+            raise WrapperException('Unsupported backend')
+
         # initialize the sigil cofiguration info passed in outdir with sigil.cfg
         self.opfbookpath = None
         self.appdir = None
@@ -153,7 +221,22 @@ class Wrapper(object):
         self.id_to_bookpath = OrderedDict()
         self.href_to_id = OrderedDict()
         self.bookpath_to_id = OrderedDict()
+        # 二级索引：小写（casefold）文件名 -> [id]，小写 bookpath -> [id]，按加入顺序排列
+        self._basename_ci_to_ids = {}
+        self._bookpath_ci_to_ids = {}
+        # manifest 序列化缓存：id -> 渲染好的 <item> 行，按 id 排序的列表，以及整个 manifest 节点
+        # 修改某个 id 的 manifest 信息后须调用 _manifest_changed(id)
+        self._manifest_items = {}
+        self._manifest_ids = None
+        self._manifest_xml = None
+        # 链接图在第一次查询时建立，之后只重新扫描 _link_dirty 中内容或路径变化过的文件
+        self._link_graph = None
+        self._link_dirty = set()
         self.spine_ppd = None
+        self._spine_items = []
+        self._spine_pos = None
+        self._spine_holes = 0
+        self._spine_shared = False
         self.spine = []
         self.guide = []
         self.bindings = []
@@ -164,17 +247,19 @@ class Wrapper(object):
         self.metadataxml = ''
         self.op = op
         if self.op is not None:
-            # copy in data from parsing of initial opf
+            # take over data from parsing of initial opf
+            # the parser is never consulted again after this point, so its
+            # dictionaries are used directly instead of being copied
             self.opf_dir = op.opf_dir
             # Note: manifest hrefs may only point to files (there are no fragments)
             # all manifest relative hrefs have already had their path component url decoded
-            self.id_to_href = op.get_manifest_id_to_href_dict().copy()
-            self.id_to_mime = op.get_manifest_id_to_mime_dict().copy()
-            self.id_to_props = op.get_manifest_id_to_properties_dict().copy()
-            self.id_to_fall = op.get_manifest_id_to_fallback_dict().copy()
-            self.id_to_over = op.get_manifest_id_to_overlay_dict().copy()
-            self.id_to_bookpath = op.get_manifest_id_to_bookpath_dict().copy()
-            self.group_paths = op.get_group_paths().copy()
+            self.id_to_href = op.get_manifest_id_to_href_dict()
+            self.id_to_mime = op.get_manifest_id_to_mime_dict()
+            self.id_to_props = op.get_manifest_id_to_properties_dict()
+            self.id_to_fall = op.get_manifest_id_to_fallback_dict()
+            self.id_to_over = op.get_manifest_id_to_overlay_dict()
+            self.id_to_bookpath = op.get_manifest_id_to_bookpath_dict()
+            self.group_paths = op.get_group_paths()
             self.spine_ppd = op.get_spine_ppd()
             self.spine = op.get_spine()
             # since guide hrefs may contain framents they are kept in url encoded form
@@ -188,6 +273,7 @@ class Wrapper(object):
                 self.href_to_id[v] = k
             for k, v in self.id_to_bookpath.items():
                 self.bookpath_to_id[v] = k
+                self._index_bookpath(k, v)
             # self.href_to_id = {v: k for k, v in self.id_to_href.items()}
             # self.bookpath_to_id = {v: k for k, v in self.id_to_bookpath.items()}
             # self.metadata = op.get_metadata()
@@ -198,10 +284,13 @@ class Wrapper(object):
         self.modified = OrderedDict()
         self.added = []
         self.deleted = []
+        # zip 和 memory 模式下移动过、但内容仍在源epub中的文件：id（或 book href）-> 源epub中的文件名
+        # 这些文件虽然记为新增，读取和保存时仍直接使用源epub中的数据
+        self._moved_from = {}
 
         # walk the ebook directory tree building up initial list of
         # all unmanifested (other) files
-        for filepath in _epub_file_walk(ebook_root):
+        for filepath in self._source_file_walk():
             book_href = filepath.replace(os.sep, "/")
             # OS X file names and paths use NFD form. The EPUB
             # spec requires all text including filenames to be in NFC form.
@@ -214,6 +303,130 @@ class Wrapper(object):
             else:
                 self.id_to_filepath[id] = filepath
 
+    # list all files of the original epub as relative platform paths
+    def _source_file_walk(self):
+        if self.epub is not None:
+            return [zi.filename.replace("/", os.sep) for zi in self.epub.infolist() if not zi.is_dir()]
+        return _epub_file_walk(self.ebook_root)
+
+    # added or modified files live in outdir, or in memory for the memory backend
+    def _write_out_file(self, filepath, data):
+        if self.backend == 'memory':
+            self._memfiles[filepath] = bytes(data)
+            return
+        filepath = os.path.join(self.outdir, filepath)
+        base = os.path.dirname(filepath)
+        if not os.path.exists(base):
+            os.makedirs(base)
+        with open(filepath, 'wb') as fp:
+            fp.write(data)
+
+    # write many (filepath, data) pairs, creating each directory only once
+    def _write_out_files(self, files, workers=None):
+        if self.backend == 'memory':
+            for filepath, data in files:
+                self._memfiles[filepath] = bytes(data)
+            return
+        for base in {os.path.dirname(filepath) for filepath, data in files}:
+            base = os.path.join(self.outdir, base)
+            if not os.path.exists(base):
+                os.makedirs(base)
+
+        def write_file(file):
+            filepath, data = file
+            with open(os.path.join(self.outdir, filepath), 'wb') as fp:
+                fp.write(data)
+
+        if workers is not None and workers <= 1:
+            for file in files:
+                write_file(file)
+            return
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # list() re-raises the first write error
+            list(pool.map(write_file, files))
+
+    def _remove_out_file(self, filepath):
+        if self.backend == 'memory':
+            self._memfiles.pop(filepath, None)
+            return
+        filepath = os.path.join(self.outdir, filepath)
+        if os.path.exists(filepath) and os.path.isfile(filepath):
+            os.remove(filepath)
+
+    def _out_file_exists(self, filepath):
+        if self.backend == 'memory':
+            return filepath in self._memfiles
+        return os.path.isfile(os.path.join(self.outdir, filepath))
+
+    # True when the current contents of a file live in outdir (or in memory)
+    def _in_outdir(self, id):
+        return (id in self.added or id in self.modified) and id not in self._moved_from
+
+    # read the current contents of a file, added or modified files live in outdir
+    # while unmodified files come from ebook_root or the source epub itself
+    def _read_book_file(self, id, filepath):
+        if self.backend == 'memory' and self._in_outdir(id):
+            data = self._memfiles.get(filepath, None)
+            if data is None:
+                raise WrapperException('File Does Not Exist')
+            return data
+        fp, size = self._open_book_file(id, filepath)
+        with fp:
+            return fp.read()
+
+    # returns the path of the file holding the current contents on disk, or None
+    # if the contents only exist inside an archive or in memory
+    def _book_file_path(self, id, filepath):
+        if self._in_outdir(id):
+            if self.backend == 'memory':
+                return None
+            return os.path.join(self.outdir, filepath)
+        if self.epub is not None:
+            return None
+        return os.path.join(self.ebook_root, filepath)
+
+    # open the current contents of a file as a binary file object, returns (fileobj, size)
+    def _open_book_file(self, id, filepath):
+        realpath = self._book_file_path(id, filepath)
+        if realpath is not None:
+            if not os.path.exists(realpath):
+                raise WrapperException('File Does Not Exist')
+            fp = open(realpath, 'rb')
+            return fp, os.fstat(fp.fileno()).st_size
+        if self._in_outdir(id):
+            data = self._memfiles.get(filepath, None)
+            if data is None:
+                raise WrapperException('File Does Not Exist')
+            return io.BytesIO(data), len(data)
+        try:
+            zinfo = self.epub.getinfo(self._moved_from.get(id) or filepath.replace(os.sep, "/"))
+        except KeyError:
+            raise WrapperException('File Does Not Exist')
+        return self.epub.open(zinfo), zinfo.file_size
+
+    # used when packing: small files are returned as data and compressed in the
+    # worker pool, larger files as (fileobj, size) so they are streamed in chunks
+    def _load_book_file(self, id, filepath):
+        fp, size = self._open_book_file(id, filepath)
+        if size > _STREAM_MIN_SIZE:
+            return fp, size
+        with fp:
+            return fp.read()
+
+    # copy a file to destpath without loading it into memory or decoding it
+    def _copy_book_file(self, id, filepath, destpath):
+        base = os.path.dirname(destpath)
+        if not os.path.exists(base):
+            os.makedirs(base)
+        realpath = self._book_file_path(id, filepath)
+        if realpath is not None and os.path.exists(realpath):
+            # lets the os copy the data directly (sendfile, fcopyfile, CopyFile2)
+            shutil.copyfile(realpath, destpath)
+            return
+        fp, size = self._open_book_file(id, filepath)
+        with fp, open(destpath, 'wb') as dst_fp:
+            shutil.copyfileobj(fp, dst_fp, _COPY_CHUNK_SIZE)
+
     def getversion(self):
         global _launcher_version
         return _launcher_version
@@ -314,29 +527,64 @@ class Wrapper(object):
         return self.package_tag
 
     def build_manifest_xml(self):
+        if self._manifest_xml is not None:
+            return self._manifest_xml
+        ids = self._manifest_ids
+        if ids is None or len(ids) != len(self.id_to_mime):
+            ids = self._manifest_ids = sorted(self.id_to_mime)
+        items = self._manifest_items
         manout = []
         manout.append('  <manifest>\n')
-        for id in sorted(self.id_to_mime):
-            href = self.id_to_href[id]
-            # relative manifest hrefs must have no fragments
-            if href.find(':') == -1:
-                href = urlencodepart(href)
-            mime = self.id_to_mime[id]
-            props = ''
-            properties = self.id_to_props[id]
-            if properties is not None:
-                props = ' properties="%s"' % properties
-            fall = ''
-            fallback = self.id_to_fall[id]
-            if fallback is not None:
-                fall = ' fallback="%s"' % fallback
-            over = ''
-            overlay = self.id_to_over[id]
-            if overlay is not None:
-                over = ' media-overlay="%s"' % overlay
-            manout.append('    <item id="%s" href="%s" media-type="%s"%s%s%s />\n' % (id, href, mime, props, fall, over))
+        for id in ids:
+            item = items.get(id)
+            if item is None:
+                item = items[id] = self._build_manifest_item(id)
+            manout.append(item)
         manout.append('  </manifest>\n')
-        return "".join(manout)
+        self._manifest_xml = "".join(manout)
+        return self._manifest_xml
+
+    def _build_manifest_item(self, id):
+        href = self.id_to_href[id]
+        # relative manifest hrefs must have no fragments
+        if href.find(':') == -1:
+            href = urlencodepart(href)
+        mime = self.id_to_mime[id]
+        props = ''
+        properties = self.id_to_props[id]
+        if properties is not None:
+            props = ' properties="%s"' % properties
+        fall = ''
+        fallback = self.id_to_fall[id]
+        if fallback is not None:
+            fall = ' fallback="%s"' % fallback
+        over = ''
+        overlay = self.id_to_over[id]
+        if overlay is not None:
+            over = ' media-overlay="%s"' % overlay
+        return '    <item id="%s" href="%s" media-type="%s"%s%s%s />\n' % (id, href, mime, props, fall, over)
+
+    # 使 id 的缓存 <item> 行失效，并把 id 加入或移出排序列表（id 已不在 manifest 中时移出）
+    def _manifest_changed(self, id):
+        self._links_changed(id)
+        self._manifest_xml = None
+        self._manifest_items.pop(id, None)
+        ids = self._manifest_ids
+        if ids is None:
+            return
+        pos = bisect_left(ids, id)
+        found = pos < len(ids) and ids[pos] == id
+        if id in self.id_to_mime:
+            if not found:
+                ids.insert(pos, id)
+        elif found:
+            del ids[pos]
+
+    # 所有 href 都改变时（如 opf 移动）丢弃全部缓存
+    def _manifest_reset(self):
+        self._manifest_xml = None
+        self._manifest_items.clear()
+        self._manifest_ids = None
 
     def build_spine_xml(self):
         spineout = []
@@ -352,7 +600,7 @@ class Wrapper(object):
         if pagemapid is not None:
             map = ' page-map="%s"' % pagemapid
         spineout.append('  <spine%s%s%s>\n' % (ppd, ncx, map))
-        for (id, linear, properties) in self.spine:
+        for (id, linear, properties) in self._spine_entries():
             lin = ''
             if linear is not None:
                 lin = ' linear="%s"' % linear
@@ -398,13 +646,8 @@ class Wrapper(object):
     def write_opf(self):
         if self.op is not None:
             platpath = self.opfbookpath.replace('/', os.sep)
-            filepath = os.path.join(self.outdir, platpath)
-            base = os.path.dirname(filepath)
-            if not os.path.exists(base):
-                os.makedirs(base)
-            with open(filepath, 'wb') as fp:
-                data = _utf8str(self.build_opf())
-                fp.write(data)
+            data = _utf8str(self.build_opf())
+            self._write_out_file(platpath, data)
 
 
     # routines to help find the manifest id of toc.ncx and page-map.xml
@@ -439,9 +682,57 @@ class Wrapper(object):
 
     # routines to manipulate the spine
 
+    # spine 内部以列表加 id -> 位置 索引保存，删除时只在原位置留下空位（None），
+    # 下次访问 self.spine 时再一次性压缩，使连续删除不必每次重建整个列表。
+    # self.spine 返回的列表会被调用者持有甚至直接修改，因此交出之后（_spine_shared）：
+    # 不再使用位置索引，删除和中间插入像以前一样换成新列表，绝不在交出的列表里留下空位。
+    @property
+    def spine(self):
+        if self._spine_holes:
+            self._spine_items = [item for item in self._spine_items if item is not None]
+            self._spine_holes = 0
+        self._spine_pos = None
+        self._spine_shared = True
+        return self._spine_items
+
+    @spine.setter
+    def spine(self, new_spine):
+        self._spine_items = list(new_spine)
+        self._spine_pos = None
+        self._spine_holes = 0
+        self._spine_shared = False
+
+    # returns the positions of idref in the spine, the index is rebuilt only when stale
+    def _spine_positions(self, idref):
+        if self._spine_shared:
+            # the caller may have changed the list since, so don't cache
+            return [i for i, item in enumerate(self._spine_items) if item[0] == idref]
+        if self._spine_pos is None:
+            self._spine_pos = {}
+            for i, item in enumerate(self._spine_items):
+                if item is not None:
+                    self._spine_pos.setdefault(item[0], []).append(i)
+        return self._spine_pos.get(idref, ())
+
+    # the spine entries in order, for reading without handing out the list
+    def _spine_entries(self):
+        if self._spine_holes:
+            return [item for item in self._spine_items if item is not None]
+        return self._spine_items
+
+    def _spine_append(self, item):
+        if not self._spine_shared:
+            # appending keeps the position index valid, holes or not
+            self._spine_positions(item[0])
+            self._spine_pos.setdefault(item[0], []).append(len(self._spine_items))
+        self._spine_items.append(item)
+
+    def spine_contains(self, idref):
+        return len(self._spine_positions(_unicodestr(idref))) > 0
+
     def getspine(self):
         osp = []
-        for (sid, linear, properties) in self.spine:
+        for (sid, linear, properties) in self._spine_entries():
             osp.append((sid, linear))
         return osp
 
@@ -510,13 +801,18 @@ class Wrapper(object):
             properties = None
         if sid not in self.id_to_mime:
             raise WrapperException('that spine idref does not exist in manifest')
-        n = len(self.spine)
-        if pos == 0:
-            self.spine = [(sid, linear, properties)] + self.spine
-        elif pos == -1 or pos >= n:
-            self.spine.append((sid, linear, properties))
+        item = (sid, linear, properties)
+        if pos == -1 or pos >= len(self._spine_items) - self._spine_holes:
+            self._spine_append(item)
+        elif self._spine_shared:
+            # a handed out list has no holes, so pos is inside it
+            spine = self._spine_items
+            self.spine = spine[0:pos] + [item] + spine[pos:]
         else:
-            self.spine = self.spine[0:pos] + [(sid, linear, properties)] + self.spine[pos:]
+            if self._spine_holes:
+                self.spine = self._spine_entries()
+            self._spine_items.insert(pos, item)
+            self._spine_pos = None
         self.modified[self.opfbookpath] = 'file'
 
     def getspine_ppd(self):
@@ -535,16 +831,10 @@ class Wrapper(object):
         properties = _unicodestr(properties)
         if properties is not None and properties == "":
             properties = None
-        pos = -1
-        i = 0
-        for (sid, slinear, sproperties) in self.spine:
-            if sid == idref:
-                pos = i
-                break
-            i += 1
-        if pos == -1:
+        positions = self._spine_positions(idref)
+        if not positions:
             raise WrapperException('that idref is not exist in the spine')
-        self.spine[pos] = (sid, linear, properties)
+        self._spine_items[positions[0]] = (idref, linear, properties)
         self.modified[self.opfbookpath] = 'file'
 
 
@@ -609,15 +899,7 @@ class Wrapper(object):
         if filepath is None:
             raise WrapperException('Id does not exist in manifest')
         # already added or modified it will be in outdir
-        basedir = self.ebook_root
-        if id in self.added or id in self.modified:
-            basedir = self.outdir
-        filepath = os.path.join(basedir, filepath)
-        if not os.path.exists(filepath):
-            raise WrapperException('File Does Not Exist')
-        data = ''
-        with open(filepath, 'rb') as fp:
-            data = fp.read()
+        data = self._read_book_file(id, filepath)
         mime = self.id_to_mime.get(id, '')
         if mime in TEXT_MIMETYPES:
             data = _unicodestr(data)
@@ -631,20 +913,39 @@ class Wrapper(object):
         if filepath is None:
             raise WrapperException('Id does not exist in manifest')
         mime = self.id_to_mime.get(id, '')
-        filepath = os.path.join(self.outdir, filepath)
-        base = os.path.dirname(filepath)
-        if not os.path.exists(base):
-            os.makedirs(base)
         if mime in TEXT_MIMETYPES or isinstance(data, str):
             data = _utf8str(data)
-        with open(filepath, 'wb') as fp:
-            fp.write(data)
+        self._write_out_file(filepath, data)
+        self._moved_from.pop(id, None)
         self.modified[id] = 'file'
+        self._links_changed(id)
 
 
     def addfile(self, uniqueid, basename, data, mime=None, properties=None, fallback=None, overlay=None):
+        uniqueid, bookpath, href, mime, data = self._check_new_file(uniqueid, basename, data, mime)
+        # now actually write out the new file
+        filepath = bookpath.replace("/", os.sep)
+        self.id_to_filepath[uniqueid] = filepath
+        self._write_out_file(filepath, data)
+        self.id_to_href[uniqueid] = href
+        self.id_to_mime[uniqueid] = mime
+        self.id_to_props[uniqueid] = properties
+        self.id_to_fall[uniqueid] = fallback
+        self.id_to_over[uniqueid] = overlay
+        self.id_to_bookpath[uniqueid] = bookpath
+        self.href_to_id[href] = uniqueid
+        self.bookpath_to_id[bookpath] = uniqueid
+        self._index_bookpath(uniqueid, bookpath)
+        self._manifest_changed(uniqueid)
+        self.added.append(uniqueid)
+        self.modified[self.opfbookpath] = 'file'
+        return uniqueid
+
+    # addfile 和 addfiles 共用的检查，返回 (uniqueid, bookpath, href, mime, data)
+    # new_ids、new_hrefs 为同一批中已经检查过、尚未加入 manifest 的 id 和 href
+    def _check_new_file(self, uniqueid, basename, data, mime, new_ids=(), new_hrefs=()):
         uniqueid = _unicodestr(uniqueid)
-        if uniqueid in self.id_to_href:
+        if uniqueid in self.id_to_href or uniqueid in new_ids:
             raise WrapperException('Manifest Id is not unique')
         basename = _unicodestr(basename)
         mime = _unicodestr(mime)
@@ -662,30 +963,47 @@ class Wrapper(object):
         if default_path != "":
             bookpath = default_path + "/" + basename
         href = buildRelativePath(self.opfbookpath, bookpath)
-        if href in self.href_to_id:
+        if href in self.href_to_id or href in new_hrefs:
             raise WrapperException('Basename already exists')
-        # now actually write out the new file
-        filepath = bookpath.replace("/", os.sep)
-        self.id_to_filepath[uniqueid] = filepath
-        filepath = os.path.join(self.outdir, filepath)
-        base = os.path.dirname(filepath)
-        if not os.path.exists(base):
-            os.makedirs(base)
         if mime in TEXT_MIMETYPES or isinstance(data, str):
             data = _utf8str(data)
-        with open(filepath, 'wb') as fp:
-            fp.write(data)
-        self.id_to_href[uniqueid] = href
-        self.id_to_mime[uniqueid] = mime
-        self.id_to_props[uniqueid] = properties
-        self.id_to_fall[uniqueid] = fallback
-        self.id_to_over[uniqueid] = overlay
-        self.id_to_bookpath[uniqueid] = bookpath
-        self.href_to_id[href] = uniqueid
-        self.bookpath_to_id[bookpath] = uniqueid
-        self.added.append(uniqueid)
-        self.modified[self.opfbookpath] = 'file'
-        return uniqueid
+        return uniqueid, bookpath, href, mime, data
+
+
+    # 批量添加文件，files 的每一项为 addfile 的参数元组：
+    # (uniqueid, basename, data[, mime[, properties[, fallback[, overlay]]]])
+    # 所有 id 和 href 在写入任何文件前一次性检查，任一项不合法则全部不添加。
+    # 文件内容由线程池并发写出，manifest、索引和 spine 只更新一次。
+    def addfiles(self, files, spine=False, workers=None):
+        items = []
+        new_ids = set()
+        new_hrefs = set()
+        for file_args in files:
+            uniqueid, basename, data, mime, properties, fallback, overlay = (tuple(file_args) + (None,) * 4)[:7]
+            uniqueid, bookpath, href, mime, data = self._check_new_file(uniqueid, basename, data, mime, new_ids, new_hrefs)
+            new_ids.add(uniqueid)
+            new_hrefs.add(href)
+            items.append((uniqueid, bookpath, href, mime, properties, fallback, overlay, data))
+        # now actually write out the new files
+        self._write_out_files([(bookpath.replace("/", os.sep), data) for (_, bookpath, _, _, _, _, _, data) in items], workers)
+        for (uniqueid, bookpath, href, mime, properties, fallback, overlay, data) in items:
+            self.id_to_filepath[uniqueid] = bookpath.replace("/", os.sep)
+            self.id_to_href[uniqueid] = href
+            self.id_to_mime[uniqueid] = mime
+            self.id_to_props[uniqueid] = properties
+            self.id_to_fall[uniqueid] = fallback
+            self.id_to_over[uniqueid] = overlay
+            self.id_to_bookpath[uniqueid] = bookpath
+            self.href_to_id[href] = uniqueid
+            self.bookpath_to_id[bookpath] = uniqueid
+            self._index_bookpath(uniqueid, bookpath)
+            self._manifest_changed(uniqueid)
+            self.added.append(uniqueid)
+            if spine:
+                self._spine_append((uniqueid, None, None))
+        if items:
+            self.modified[self.opfbookpath] = 'file'
+        return [item[0] for item in items]
 
 
     # new in Sigil 1.0
@@ -712,14 +1030,9 @@ class Wrapper(object):
         # now actually write out the new file
         filepath = bookpath.replace("/", os.sep)
         self.id_to_filepath[uniqueid] = filepath
-        filepath = os.path.join(self.outdir, filepath)
-        base = os.path.dirname(filepath)
-        if not os.path.exists(base):
-            os.makedirs(base)
         if mime in TEXT_MIMETYPES or isinstance(data, str):
             data = _utf8str(data)
-        with open(filepath, 'wb') as fp:
-            fp.write(data)
+        self._write_out_file(filepath, data)
         self.id_to_href[uniqueid] = href
         self.id_to_mime[uniqueid] = mime
         self.id_to_props[uniqueid] = None
@@ -728,6 +1041,8 @@ class Wrapper(object):
         self.id_to_bookpath[uniqueid] = bookpath
         self.href_to_id[href] = uniqueid
         self.bookpath_to_id[bookpath] = uniqueid
+        self._index_bookpath(uniqueid, bookpath)
+        self._manifest_changed(uniqueid)
         self.added.append(uniqueid)
         self.modified[self.opfbookpath] = 'file'
         return uniqueid
@@ -745,9 +1060,9 @@ class Wrapper(object):
         add_to_deleted = True
         # if file was added or modified, delete file from outdir
         if id in self.added or id in self.modified:
-            filepath = os.path.join(self.outdir, filepath)
-            if os.path.exists(filepath) and os.path.isfile(filepath):
-                os.remove(filepath)
+            if self._in_outdir(id):
+                self._remove_out_file(filepath)
+            self._moved_from.pop(id, None)
             if id in self.added:
                 self.added.remove(id)
                 add_to_deleted = False
@@ -764,16 +1079,19 @@ class Wrapper(object):
         del self.id_to_bookpath[id]
         del self.href_to_id[href]
         del self.bookpath_to_id[bookpath]
+        self._unindex_bookpath(id, bookpath)
+        self._manifest_changed(id)
         # remove from spine
-        new_spine = []
-        was_modified = False
-        for sid, linear, properties in self.spine:
-            if sid != id:
-                new_spine.append((sid, linear, properties))
+        positions = self._spine_positions(id)
+        if positions:
+            if self._spine_shared:
+                self.spine = [item for item in self._spine_items if item[0] != id]
             else:
-                was_modified = True
-        if was_modified:
-            self.setspine_epub3(new_spine)
+                for i in positions:
+                    self._spine_items[i] = None
+                self._spine_holes += len(positions)
+                del self._spine_pos[id]
+            self.modified[self.opfbookpath] = 'file'
         if add_to_deleted:
             self.deleted.append(('manifest', id, bookpath))
             self.modified[self.opfbookpath] = 'file'
@@ -798,11 +1116,190 @@ class Wrapper(object):
         self.id_to_props[id] = properties
         self.id_to_fall[id] = fallback
         self.id_to_over[id] = overlay
+        self._manifest_changed(id)
         self.modified[self.opfbookpath] = 'file'
 
 
     # helpful mapping routines for file info from the opf manifest
 
+    # routines to query the link graph of manifest files
+
+    def _links_changed(self, id):
+        if self._link_graph is not None:
+            self._link_dirty.add(id)
+
+    def _scan_links(self, graph, id):
+        mime = self.id_to_mime.get(id)
+        if mime not in LINK_SOURCE_MIMES:
+            graph.remove(id)
+            return
+        data = self._read_book_file(id, self.id_to_filepath[id])
+        graph.add(id, self.id_to_bookpath[id], mime, _unicodestr(data))
+
+    def _sync_link_graph(self):
+        graph = self._link_graph
+        if graph is None:
+            graph = LinkGraph()
+            for id in self.id_to_mime:
+                self._scan_links(graph, id)
+            self._link_graph = graph
+            self._link_dirty.clear()
+        elif self._link_dirty:
+            for id in self._link_dirty:
+                self._scan_links(graph, id)
+            self._link_dirty.clear()
+        return graph
+
+    def build_link_graph(self):
+        self._sync_link_graph()
+
+    def links_from(self, id):
+        id = _unicodestr(id)
+        if id not in self.id_to_href:
+            raise WrapperException('Id does not exist in manifest')
+        return self._sync_link_graph().links_from(id)
+
+    def links_to_bookpath(self, bookpath):
+        bookpath = _unicodestr(bookpath)
+        return self._sync_link_graph().links_to(bookpath)
+
+    def links_to(self, id):
+        id = _unicodestr(id)
+        if id not in self.id_to_href:
+            raise WrapperException('Id does not exist in manifest')
+        return self.links_to_bookpath(self.id_to_bookpath[id])
+
+    def linking_ids(self, id):
+        id = _unicodestr(id)
+        if id not in self.id_to_href:
+            raise WrapperException('Id does not exist in manifest')
+        return self._sync_link_graph().sources_of(self.id_to_bookpath[id])
+
+    # href 中路径之后的 "?..." 或 "#..." 部分
+    @staticmethod
+    def _href_suffix(href):
+        end = len(href)
+        for c in "?#":
+            i = href.find(c)
+            if i != -1 and i < end:
+                end = i
+        return href[:end], href[end:]
+
+    # 链接所在文件（类型为 mime）移到 src_bookpath 后，指向 target 的新链接文本，原链接仍然有效时保持不变
+    def _moved_href(self, href, mime, src_bookpath, target):
+        path, suffix = self._href_suffix(href)
+        if buildBookPath(urldecodepart(link_value(mime, path)), startingDir(src_bookpath)) == target:
+            return href
+        new_path = buildRelativePath(src_bookpath, target)
+        if new_path == "":
+            new_path = target.split("/")[-1]
+        return link_text(mime, urlencodepart(new_path)) + suffix
+
+    # 批量移动 manifest 中的文件，mapping 为 {旧 bookpath: 新 bookpath}，id、属性和 spine 位置保持不变。
+    # 所有引用了被移动文件的 xhtml、svg、css、ncx 以及被移动文件自身的相对链接都会改写，guide 同时更新。
+    # 先检查全部路径并计算好改写结果再修改，检查不通过时不做任何改动。返回内容被改写的 id 列表。
+    def move_files(self, mapping, workers=None):
+        moves = {}
+        for old_bookpath, new_bookpath in mapping.items():
+            old_bookpath = _unicodestr(old_bookpath)
+            new_bookpath = _unicodestr(new_bookpath)
+            id = self.bookpath_to_id.get(old_bookpath)
+            if id is None:
+                raise WrapperException('Bookpath does not exist in manifest: %s' % old_bookpath)
+            if old_bookpath == new_bookpath:
+                continue
+            segments = new_bookpath.split("/")
+            if new_bookpath.startswith("/") or "" in segments or "." in segments or ".." in segments:
+                raise WrapperException('Invalid bookpath: %s' % new_bookpath)
+            if new_bookpath in PROTECTED_FILES or new_bookpath == self.opfbookpath:
+                raise WrapperException('attempt to move onto protected file: %s' % new_bookpath)
+            moves[old_bookpath] = new_bookpath
+        if not moves:
+            return []
+        targets = set(moves.values())
+        if len(targets) != len(moves):
+            raise WrapperException('Duplicate destination bookpaths')
+        for new_bookpath in targets:
+            if new_bookpath in moves:
+                continue
+            if new_bookpath in self.bookpath_to_id or new_bookpath in self.book_href_to_filepath:
+                raise WrapperException('Bookpath already exists: %s' % new_bookpath)
+
+        # 计算需要改写的文件：引用了被移动文件的文件，以及被移动的文件本身
+        graph = self._sync_link_graph()
+        affected = []
+        seen = set()
+        for old_bookpath in moves:
+            for id in graph.sources_of(old_bookpath) + [self.bookpath_to_id[old_bookpath]]:
+                if id not in seen:
+                    seen.add(id)
+                    affected.append(id)
+
+        def rewrite_file(id):
+            links = graph.links_from(id)
+            if not links:
+                return None
+            src_bookpath = self.id_to_bookpath[id]
+            new_src_bookpath = moves.get(src_bookpath, src_bookpath)
+            mime = self.id_to_mime[id]
+            text = _unicodestr(self._read_book_file(id, self.id_to_filepath[id]))
+            pieces = []
+            pos = len(text)
+            # 从后往前替换，前面链接的位置不受影响
+            for target, fragment, href, kind, start, end in reversed(links):
+                if src_bookpath == new_src_bookpath and target not in moves:
+                    continue
+                new_href = self._moved_href(href, mime, new_src_bookpath, moves.get(target, target))
+                if new_href == href:
+                    continue
+                pieces.append(text[end:pos])
+                pieces.append(new_href)
+                pos = start
+            if not pieces:
+                return None
+            pieces.append(text[:pos])
+            return "".join(reversed(pieces))
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(rewrite_file, affected))
+        changed = [(id, _utf8str(data)) for id, data in zip(affected, results) if data is not None]
+
+        # 目标路径正被另一个文件占用时（如两个文件互换位置），先移到临时路径
+        pending = []
+        taken = set(self.bookpath_to_id)
+        taken.update(self.book_href_to_filepath)
+        for old_bookpath, new_bookpath in moves.items():
+            id = self.bookpath_to_id[old_bookpath]
+            if old_bookpath in targets:
+                n = 0
+                temp_bookpath = "%s.moving" % old_bookpath
+                while temp_bookpath in taken or temp_bookpath in targets:
+                    n += 1
+                    temp_bookpath = "%s.moving%d" % (old_bookpath, n)
+                taken.add(temp_bookpath)
+                self._move_manifest_file(id, temp_bookpath, id in self.added or id in self.modified)
+            pending.append((id, new_bookpath))
+        for id, new_bookpath in pending:
+            self._move_manifest_file(id, new_bookpath, id in self.added or id in self.modified)
+
+        self._write_out_files([(self.id_to_filepath[id], data) for id, data in changed], workers)
+        for id, data in changed:
+            self._moved_from.pop(id, None)
+            self.modified[id] = 'file'
+            self._links_changed(id)
+
+        # guide 中的 href 相对于 opf
+        new_guide = []
+        for (type, title, href) in self.guide:
+            path, suffix = self._href_suffix(href)
+            bookpath = buildBookPath(urldecodepart(path), startingDir(self.opfbookpath))
+            if bookpath in moves:
+                href = urlencodepart(buildRelativePath(self.opfbookpath, moves[bookpath])) + suffix
+            new_guide.append((type, title, href))
+        self.guide = new_guide
+        self.modified[self.opfbookpath] = 'file'
+        return [id for id, data in changed]
+
     def map_href_to_id(self, href, ow):
         href = _unicodestr(href)
         href = urldecodepart(href)
@@ -813,13 +1310,39 @@ class Wrapper(object):
         bookpath = _unicodestr(bookpath)
         return self.bookpath_to_id.get(bookpath, ow)
 
-    def map_basename_to_id(self, basename, ow):
-        for bookpath in self.bookpath_to_id:
-            filename = bookpath.split("/")[-1]
-            if filename == basename:
-                return self.bookpath_to_id[bookpath]
+    def map_basename_to_id(self, basename, ow, ci=False):
+        basename = _unicodestr(basename)
+        ids = self._basename_ci_to_ids.get(basename.casefold())
+        if not ids:
+            return ow
+        if ci:
+            return ids[0]
+        for id in ids:
+            if self.id_to_bookpath[id].split("/")[-1] == basename:
+                return id
         return ow
 
+    def map_bookpath_ci_to_id(self, bookpath, ow):
+        bookpath = _unicodestr(bookpath)
+        ids = self._bookpath_ci_to_ids.get(bookpath.casefold())
+        if not ids:
+            return ow
+        return ids[0]
+
+    def _index_bookpath(self, id, bookpath):
+        basename = bookpath.split("/")[-1]
+        self._basename_ci_to_ids.setdefault(basename.casefold(), []).append(id)
+        self._bookpath_ci_to_ids.setdefault(bookpath.casefold(), []).append(id)
+
+    def _unindex_bookpath(self, id, bookpath):
+        basename = bookpath.split("/")[-1]
+        for index, key in ((self._basename_ci_to_ids, basename.casefold()),
+                           (self._bookpath_ci_to_ids, bookpath.casefold())):
+            ids = index[key]
+            ids.remove(id)
+            if not ids:
+                del index[key]
+
     def map_id_to_href(self, id, ow):
         id = _unicodestr(id)
         return self.id_to_href.get(id, ow)
@@ -878,19 +1401,11 @@ class Wrapper(object):
         filepath = self.book_href_to_filepath.get(id, None)
         if filepath is None:
             raise WrapperException('Book href does not exist')
-        basedir = self.ebook_root
-        if id in self.added or id in self.modified:
-            basedir = self.outdir
-        filepath = os.path.join(basedir, filepath)
-        if not os.path.exists(filepath):
-            raise WrapperException('File Does Not Exist')
         basename = os.path.basename(filepath)
         ext = os.path.splitext(basename)[1]
         ext = ext.lower()
         mime = ext_mime_map.get(ext, "")
-        data = b''
-        with open(filepath, 'rb') as fp:
-            data = fp.read()
+        data = self._read_book_file(id, filepath)
         if mime in TEXT_MIMETYPES:
             data = _unicodestr(data)
         return data
@@ -907,14 +1422,10 @@ class Wrapper(object):
             raise WrapperException('Book href does not exist')
         if id in PROTECTED_FILES or id == self.opfbookpath:
             raise WrapperException('Attempt to modify protected file')
-        filepath = os.path.join(self.outdir, filepath)
-        base = os.path.dirname(filepath)
-        if not os.path.exists(base):
-            os.makedirs(base)
         if isinstance(data, str):
             data = _utf8str(data)
-        with open(filepath, 'wb') as fp:
-            fp.write(data)
+        self._write_out_file(filepath, data)
+        self._moved_from.pop(id, None)
         self.modified[id] = 'file'
 
     def addotherfile(self, book_href, data) :
@@ -925,16 +1436,11 @@ class Wrapper(object):
         if id in self.other:
             raise WrapperException('Book href must be unique')
         desired_path = id.replace("/", os.sep)
-        filepath = os.path.join(self.outdir, desired_path)
-        if os.path.isfile(filepath):
+        if self._out_file_exists(desired_path):
             raise WrapperException('Desired path already exists')
-        base = os.path.dirname(filepath)
-        if not os.path.exists(base):
-            os.makedirs(base)
         if isinstance(data, str):
             data = _utf8str(data)
-        with open(filepath, 'wb')as fp:
-            fp.write(data)
+        self._write_out_file(desired_path, data)
         self.other.append(id)
         self.added.append(id)
         self.book_href_to_filepath[id] = desired_path
@@ -954,9 +1460,9 @@ class Wrapper(object):
         add_to_deleted = True
         # if file was added or modified delete file from outdir
         if id in self.added or id in self.modified:
-            filepath = os.path.join(self.outdir, filepath)
-            if os.path.exists(filepath) and os.path.isfile(filepath):
-                os.remove(filepath)
+            if self._in_outdir(id):
+                self._remove_out_file(filepath)
+            self._moved_from.pop(id, None)
             if id in self.added:
                 self.added.remove(id)
                 add_to_deleted = False
@@ -978,26 +1484,19 @@ class Wrapper(object):
             raise WrapperException('destination directory does not exist')
         for id in self.id_to_filepath:
             rpath = self.id_to_filepath[id]
-            data = self.readfile(id)
-            filepath = os.path.join(destdir, rpath)
-            base = os.path.dirname(filepath)
-            if not os.path.exists(base):
-                os.makedirs(base)
-            if isinstance(data, str):
-                data = _utf8str(data)
-            with open(filepath, 'wb') as fp:
-                fp.write(data)
+            self._copy_book_file(id, rpath, os.path.join(destdir, rpath))
         for id in self.book_href_to_filepath:
             rpath = self.book_href_to_filepath[id]
-            data = self.readotherfile(id)
             filepath = os.path.join(destdir, rpath)
-            base = os.path.dirname(filepath)
-            if not os.path.exists(base):
-                os.makedirs(base)
-            if isinstance(data, str):
-                data = _utf8str(data)
-            with open(filepath, 'wb') as fp:
-                fp.write(data)
+            # a modified opf only exists as the in memory manifest until written
+            if id == self.opfbookpath and id in self.modified:
+                base = os.path.dirname(filepath)
+                if not os.path.exists(base):
+                    os.makedirs(base)
+                with open(filepath, 'wb') as fp:
+                    fp.write(_utf8str(self.build_opf()))
+                continue
+            self._copy_book_file(id, rpath, filepath)
 
     def get_dictionary_dirs(self):
         apaths = []
@@ -1043,17 +1542,86 @@ class Wrapper(object):
     # 以下均为添加的方法，非Sigil插件原生方法
     #====================================================================================
 
-    def save_as(self,save_path=""):
+    def save_as(self,save_path="",workers=None,compress_policy=None,incremental=False):
 
         self.write_opf()
 
-        def copy_file(src_path,dst_path):
+        if save_path == '':
+            epub_name = os.path.basename(self.epub_filepath)
+            save_path = os.path.join(os.path.dirname(self.epub_filepath),'OUTPUT',epub_name)
+        dirname = os.path.dirname(save_path)
+        if dirname != '' and not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        # 增量保存仅适用于覆盖上一次保存的epub，memory 模式直接在内存中打包
+        if incremental:
+            incremental = self.backend != 'memory' and self._last_saved is not None \
+                and os.path.exists(save_path) \
+                and os.path.realpath(save_path) == os.path.realpath(self._last_saved)
+
+        if self.epub is None:
+            srczip = zipfile.ZipFile(self._source_epub,'r')
+        else:
+            srczip = self.epub
+        tmp_path = save_path + '.tmp'
+        try:
+            members = self._epub_members(srczip)
+            if incremental:
+                # 只重写第一个改动文件之后的部分和中央目录，结果与完整保存相同
+                zip_update_members(save_path, srczip, members, workers, compress_policy)
+            elif self.backend == 'memory':
+                outbuf = io.BytesIO()
+                with zipfile.ZipFile(outbuf,'w') as outfile:
+                    zip_write_members(outfile, members, workers, compress_policy)
+                with open(tmp_path,'wb') as fp:
+                    fp.write(outbuf.getbuffer())
+            else:
+                with zipfile.ZipFile(tmp_path,'w') as outfile:
+                    zip_write_members(outfile, members, workers, compress_policy)
+            if not incremental:
+                os.replace(tmp_path, save_path)
+        except BaseException:
+            # 保存失败时保留打开的源epub，未保存的改动仍可读取，之后可以再次保存
+            if srczip is not self.epub:
+                srczip.close()
+            elif incremental:
+                # 增量保存已关闭源epub，失败时文件已恢复原样，重新打开
+                srczip.close()
+                self.epub = zipfile.ZipFile(save_path,'r')
+            if not incremental and os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+            raise
+        srczip.close()
+        if self.backend == 'disk':
+            self._sync_ebook_root()
+        elif self.backend == 'memory':
+            # 内存中打包好的epub即为新的源文件
+            self.epub = zipfile.ZipFile(outbuf,'r')
+            self._memfiles.clear()
+        elif self.backend == 'zip':
+            self.epub = zipfile.ZipFile(save_path,'r')
+            shutil.rmtree(self.outdir)
+            os.makedirs(self.outdir)
+        # 保存后的epub即为未改动文件的新来源，因此允许直接覆盖源epub
+        self._source_epub = save_path
+        self._last_saved = save_path
+
+        self.deleted.clear()
+        self.added.clear()
+        self.modified.clear()
+        self._moved_from.clear()
+
+    # disk 模式：epub写出后将改动同步到解压目录，保证保存后仍能正确读取文件
+    # outdir 与解压目录位于同一工作区，直接移动文件而不复制数据
+    def _sync_ebook_root(self):
+
+        def move_file(src_path,dst_path):
+            if not os.path.exists(src_path):
+                return
             dst_dir = os.path.dirname(dst_path)
             if not os.path.exists(dst_dir):
                 os.makedirs(dst_dir)
-            with open(src_path,"rb") as src_fp:
-                with open(dst_path,"wb") as dst_fp:
-                    dst_fp.write(src_fp.read())
+            os.replace(src_path,dst_path)
 
         for ftype, id, bookhref in self.deleted:
             filepath = os.path.join(self.ebook_root,bookhref)
@@ -1079,7 +1647,7 @@ class Wrapper(object):
                 bookhref = id
             src_path = os.path.join(self.outdir,bookhref)
             dst_path = os.path.join(self.ebook_root,bookhref)
-            copy_file(src_path,dst_path)
+            move_file(src_path,dst_path)
 
         for id in self.modified:
             if self.id_to_bookpath.get(id):
@@ -1088,360 +1656,372 @@ class Wrapper(object):
                 bookhref = id
             src_path = os.path.join(self.outdir,bookhref)
             dst_path = os.path.join(self.ebook_root,bookhref)
-            copy_file(src_path,dst_path)
-
-        if save_path == '':
-            epub_name = os.path.basename(self.epub_filepath)
-            save_path = os.path.join(os.path.dirname(self.epub_filepath),'OUTPUT',epub_name)
-        dirname = os.path.dirname(save_path)
-        if dirname != '' and not os.path.exists(dirname):
-            os.makedirs(dirname)
-
-        with zipfile.ZipFile(save_path,'w',zipfile.ZIP_DEFLATED) as outfile:
-            for bookpath in _epub_file_walk(self.ebook_root):
-                realpath = os.path.join(self.ebook_root,bookpath)
-                with open(realpath,'rb') as f:
-                    data = f.read()
-                outfile.writestr(bookpath, data, zipfile.ZIP_DEFLATED)
-
-        self.deleted.clear()
-        self.added.clear()
-        self.modified.clear()
+            move_file(src_path,dst_path)
+
+    # 按保存顺序列出epub中的文件：新增和修改的文件在线程池中并行压缩，
+    # 未改动的文件直接复制源epub中已压缩的数据，不再解压后重新压缩
+    def _epub_members(self,srczip):
+        entries = list(self.id_to_filepath.items()) + list(self.book_href_to_filepath.items())
+        # mimetype 必须是第一个文件且不压缩
+        entries.sort(key=lambda entry: entry[1] != 'mimetype')
+        members = []
+        for id, filepath in entries:
+            arcname = filepath.replace(os.sep, "/")
+            if not self._in_outdir(id):
+                src_info = srczip.NameToInfo.get(self._moved_from.get(id) or arcname)
+                if src_info is not None and (arcname != 'mimetype' or src_info.compress_type == zipfile.ZIP_STORED):
+                    members.append((arcname, (srczip, src_info)))
+                    continue
+            members.append((arcname, partial(self._load_book_file, id, filepath)))
+        return members
 
     def __del__(self):
+        if self.epub is not None:
+            self.epub.close()
         if self.ebook_root:
-            workspace = os.path.dirname(self.ebook_root)
-            shutil.rmtree(workspace)
+            # 只删除本书的临时目录，同一工作区中可能还有其它 Ebook 正在使用
+            for tempdir in (self.ebook_root, self.outdir):
+                shutil.rmtree(tempdir, ignore_errors=True)
+            try:
+                os.rmdir(os.path.dirname(self.ebook_root))
+            except OSError:
+                pass
             print("Wrapper: 程序运行结束，已删除临时目录。")
 
+    # 返回保存在内存中的文件数据大小（字节），memory 模式下包括整个源epub
+    def memory_usage(self):
+        usage = sum(len(data) for data in self._memfiles.values())
+        if self.backend == 'memory':
+            usage += self.epub.fp.getbuffer().nbytes
+        return usage
+
+
+    # 把文件的当前内容移到 outdir（memory 模式下为内存）中的新位置。
+    # changed 表示文件已新增或修改过。磁盘上的文件直接 os.replace ，不经过 Python 复制数据，
+    # 只有跨文件系统时才复制。内容仍在源epub中时只在 _moved_from 中记下源文件名，
+    # 读取和保存时直接使用源epub中的数据。
+    def _relocate_book_file(self, key, filepath, new_filepath, changed):
+        if key in self._moved_from:
+            changed = False
+        if not changed and self.epub is not None:
+            # 内容仍在源epub中，只记录对应关系，不复制数据
+            if key not in self._moved_from:
+                self._moved_from[key] = filepath.replace(os.sep, "/")
+            return
+        if self.backend == 'memory':
+            if changed:
+                data = self._memfiles.pop(filepath, None)
+                if data is None:
+                    raise WrapperException('File Does Not Exist')
+            else:
+                data = self._read_book_file(key, filepath)
+            self._memfiles[new_filepath] = data
+            return
+        destpath = os.path.join(self.outdir, new_filepath)
+        base = os.path.dirname(destpath)
+        if not os.path.exists(base):
+            os.makedirs(base)
+        if changed:
+            realpath = os.path.join(self.outdir, filepath)
+        elif self.epub is None:
+            realpath = os.path.join(self.ebook_root, filepath)
+        else:
+            realpath = None
+        if realpath is not None:
+            if not os.path.exists(realpath):
+                raise WrapperException('File Does Not Exist')
+            try:
+                os.replace(realpath, destpath)
+                return
+            except OSError:
+                pass
+        fp, size = self._open_book_file(key, filepath)
+        with fp, open(destpath, 'wb') as dst_fp:
+            shutil.copyfileobj(fp, dst_fp, _COPY_CHUNK_SIZE)
+        if changed:
+            os.remove(realpath)
+
+    # 把 manifest 中的文件移到 new_bookpath ，id、属性和 spine 位置都保持不变。
+    # 记录方式与 deletefile + addfile 相同：旧路径记为删除，新路径记为新增。
+    def _move_manifest_file(self, id, new_bookpath, changed):
+        bookpath = self.id_to_bookpath[id]
+        href = self.id_to_href[id]
+        filepath = self.id_to_filepath[id]
+        new_filepath = new_bookpath.replace("/", os.sep)
+        self._relocate_book_file(id, filepath, new_filepath, changed)
+        new_href = buildRelativePath(self.opfbookpath, new_bookpath)
+        del self.href_to_id[href]
+        del self.bookpath_to_id[bookpath]
+        self._unindex_bookpath(id, bookpath)
+        self.id_to_href[id] = new_href
+        self.id_to_bookpath[id] = new_bookpath
+        self.id_to_filepath[id] = new_filepath
+        self.href_to_id[new_href] = id
+        self.bookpath_to_id[new_bookpath] = id
+        self._index_bookpath(id, new_bookpath)
+        self._manifest_changed(id)
+        if id in self.added:
+            self.added.remove(id)
+        else:
+            self.deleted.append(('manifest', id, bookpath))
+        self.modified.pop(id, None)
+        self.added.append(id)
+        self.modified[self.opfbookpath] = 'file'
 
-    def standardize_epub(self):
+    # 把 manifest 外的文件移到 new_book_href ，记录方式与 deleteotherfile + addotherfile 相同
+    def _move_other_file(self, book_href, new_book_href, changed):
+        filepath = self.book_href_to_filepath[book_href]
+        new_filepath = new_book_href.replace("/", os.sep)
+        self._relocate_book_file(book_href, filepath, new_filepath, changed)
+        moved_from = self._moved_from.pop(book_href, None)
+        self._forget_other_file(book_href)
+        if moved_from is not None:
+            self._moved_from[new_book_href] = moved_from
+        self.other.append(new_book_href)
+        self.added.append(new_book_href)
+        self.book_href_to_filepath[new_book_href] = new_filepath
+        return new_filepath
+
+    def _forget_other_file(self, book_href):
+        if book_href in self.added:
+            self.added.remove(book_href)
+        else:
+            self.deleted.append(('other', book_href, book_href))
+        self.modified.pop(book_href, None)
+        self._moved_from.pop(book_href, None)
+        self.other.remove(book_href)
+        del self.book_href_to_filepath[book_href]
+
+    # 计算 standardize_epub 需要做的文件移动和删除，只使用 manifest 和文件列表，不读取文件内容。
+    # 已经是标准格式时返回 None 。
+    def plan_standardize_epub(self):
         if self.epub_is_standard():
-            return
-        opfpath = "OEBPS/content.opf"
-        # group_paths 会影响到 addfile 添加文件的目录
-        self.group_paths = std_group_paths = {
-            "Text"   : ["OEBPS/Text"],
-            "Styles" : ["OEBPS/Styles"],
-            "Fonts"  : ["OEBPS/Fonts"],
-            "Images" : ["OEBPS/Images"],
-            "Audio"  : ["OEBPS/Audio"],
-            "Video"  : ["OEBPS/Video"],
-            "Misc"   : ["OEBPS/Misc"],
-            "ncx"    : ["OEBPS"],
-            "opf"    : ["OEBPS"]
-        }
+            return None
+        plan = StandardizePlan()
+        std_group_paths = _STD_GROUP_PATHS
         std_opfpath = "OEBPS/content.opf"
         std_tocpath = "OEBPS/toc.ncx"
-        deleted = [] # [(id,bkpath,mime,prop,fall,over)]
-        basename_list = [] # [basename]
         toc_id = self.gettocid()
-        oldBkpath_to_newBasename = {} # [ old_bkpath.lower() : new_basename ]
-        newBkpath_to_oldGroup = {} # [ new_bkpath : old_group ]
-        old_opfpath = self.opfbookpath
+        basenames = set()
+        ids = set(self.id_to_bookpath)
+        old_to_basename = plan.old_to_basename
+        new_to_old_group = plan.new_to_old_group
 
         def no_repeat_basename(basename):
-            nonlocal basename_list
-            while basename in basename_list:
+            while basename in basenames:
                 nameWithoutExt, ext = os.path.splitext(basename)
-                nameWithoutExt += "_"
-                basename = nameWithoutExt + ext
-            basename_list.append(basename)
+                basename = nameWithoutExt + "_" + ext
+            basenames.add(basename)
             return basename
 
-        # 清理关联文件不存在的ID。
-        ids_not_in_manifest = []
-        for id in self.id_to_bookpath.keys():
+        # 关联文件不存在的ID
+        for id in self.id_to_bookpath:
             if self.id_to_filepath.get(id) is None:
-                ids_not_in_manifest.append(id)
-        for id in ids_not_in_manifest:
-            href = self.id_to_href[id]
-            bookpath = self.id_to_bookpath[id]
-            del self.id_to_href[id]
-            del self.id_to_mime[id]
-            del self.id_to_props[id]
-            del self.id_to_fall[id]
-            del self.id_to_over[id]
-            del self.id_to_bookpath[id]
-            del self.href_to_id[href]
-            del self.bookpath_to_id[bookpath]
+                plan.missing.append(id)
+        missing = set(plan.missing)
 
-        # 检测并修改 opf 文件归档路径
+        # opf 文件归档路径
         if self.opfbookpath != std_opfpath:
-            if std_opfpath in self.other:
-                self.deleteotherfile(std_opfpath)
-            opf_data = self.readotherfile(self.opfbookpath)
-            self.addotherfile(std_opfpath,opf_data)
-            self.opfbookpath = std_opfpath # 先修改 self.opfbookpath，删除旧opf才不会受限。
-            self.opf_dir = "OEBPS"
-            self.deleteotherfile(old_opfpath)
-            self.other.remove(old_opfpath)
-            basename_list.append(os.path.dirname(self.opfbookpath))
-
-        # 检查并修改 toc 文件归档路径
-        if toc_id is not None:
-            toc_bkpath = self.id_to_bookpath.get(toc_id)
-            if self.id_to_bookpath.get(toc_id) != std_tocpath:
-                mime = "application/x-dtbncx+xml"
-                self.id_to_mime[toc_id] = ""
-                data = self.readfile(toc_id)
-                self.deletefile(toc_id)
-                epub_version = self.epub_version
-                self.epub_version = "" # 暂时修改epub_version以绕过epub2对ncx文件的操作限制
-                self.addfile(toc_id,"toc.ncx",data,mime)
-                self.epub_version = epub_version # 恢复 epub_version
-                basename_list.append("toc.ncx")
-            oldBkpath_to_newBasename[toc_bkpath.lower()] = "toc.ncx"
-            newBkpath_to_oldGroup["OEBPS/toc.ncx"] = os.path.dirname(toc_bkpath)
-
-        # 检查 manifest 文件归档路径
+            plan.opf_move = (self.opfbookpath, std_opfpath)
+            basenames.add("OEBPS")
+
+        # toc 文件归档路径
+        if toc_id is not None and toc_id not in missing:
+            toc_bkpath = self.id_to_bookpath[toc_id]
+            if toc_bkpath != std_tocpath:
+                plan.moves.append((toc_id, toc_bkpath, std_tocpath))
+                basenames.add("toc.ncx")
+            old_to_basename[toc_bkpath.lower()] = "toc.ncx"
+            new_to_old_group[std_tocpath] = os.path.dirname(toc_bkpath)
+
+        # manifest 文件归档路径，先登记不需要移动的文件名，移动的文件再依次避开重名
+        to_move = []
         for id, bkpath in self.id_to_bookpath.items():
+            if id in missing or id == toc_id:
+                continue
             mime = self.id_to_mime[id]
-            cur_group_path = os.path.dirname(bkpath)
-            std_group = mime_group_map.get(mime)
-            std_group_path = std_group_paths.get(std_group)[0]
-
             if mime == "application/x-dtbncx+xml":
-                if id != toc_id:
-                    deleted.append((id,bkpath,mime,prop,fall,over))
+                plan.deletes.append(id)
                 continue
-
-            if cur_group_path != std_group_path:
-                prop = self.id_to_props.get(id)
-                fall = self.id_to_fall.get(id)
-                over = self.id_to_over.get(id)
-                deleted.append((id,bkpath,mime,prop,fall,over))
+            std_group_path = std_group_paths[mime_group_map.get(mime, "Misc")][0]
+            if os.path.dirname(bkpath) != std_group_path:
+                to_move.append((id, bkpath, std_group_path))
             else:
                 basename = os.path.basename(bkpath)
-                basename_list.append(basename)
-                oldBkpath_to_newBasename[bkpath.lower()] = basename
-                newBkpath_to_oldGroup[bkpath] = os.path.dirname(bkpath)
+                basenames.add(basename)
+                old_to_basename[bkpath.lower()] = basename
+                new_to_old_group[bkpath] = os.path.dirname(bkpath)
 
-        # 检查非 manifest 文件归档路径
+        # manifest 外的文件，META-INF 中的文件和 mimetype 保持不变
+        other_to_move = []
         for bkpath in self.other:
             cur_group_path = os.path.dirname(bkpath)
-            # META-INF 里除了有 xml，可能还有calibre书签txt文件，某些阅读器的js文件。
-            # 所有置于该目录下的文件都不处理。
-            if cur_group_path == "META-INF":
-                basename = os.path.dirname(bkpath)
-                basename_list.append(basename)
-                oldBkpath_to_newBasename[bkpath.lower()] = basename
-                newBkpath_to_oldGroup[bkpath] = os.path.dirname(bkpath)
+            if cur_group_path == "META-INF" or bkpath == "mimetype":
+                basenames.add(cur_group_path)
+                if cur_group_path == "META-INF":
+                    old_to_basename[bkpath.lower()] = cur_group_path
+                    new_to_old_group[bkpath] = cur_group_path
                 continue
-
             if bkpath == self.opfbookpath:
                 continue
-
-            if bkpath == "mimetype":
-                basename = os.path.dirname(bkpath)
-                basename_list.append(basename)
+            other_to_move.append(bkpath)
+
+        for id, bkpath, std_group_path in to_move:
+            basename = no_repeat_basename(os.path.basename(bkpath))
+            new_bkpath = std_group_path + "/" + basename
+            plan.moves.append((id, bkpath, new_bkpath))
+            old_to_basename[bkpath.lower()] = basename
+            new_to_old_group[new_bkpath] = os.path.dirname(bkpath)
+
+        for bkpath in other_to_move:
+            basename = no_repeat_basename(os.path.basename(bkpath))
+            ext = os.path.splitext(basename)[1].lower()
+            if ext == ".xml":
+                plan.other_moves.append((bkpath, "META-INF/" + basename))
+                continue
+            mime = ext_mime_map.get(ext)
+            std_group = mime_group_map.get(mime)
+            # 多余的 opf 和 ncx 以及无法归类的文件直接删除
+            if ext in (".opf", ".ncx") or std_group is None:
+                plan.other_deletes.append(bkpath)
                 continue
+            id = basename
+            while id in ids:
+                id = "_" + id
+            ids.add(id)
+            new_bkpath = std_group_paths[std_group][0] + "/" + basename
+            plan.other_adds.append((bkpath, new_bkpath, id, mime))
+            old_to_basename[bkpath.lower()] = basename
+            new_to_old_group[new_bkpath] = os.path.dirname(bkpath)
+        return plan
+
+    # 改写 toc、xhtml 和 css 文件中的链接，只写回内容有变化的文件。
+    # 先在字节层面扫描，跳过既没有移动、也不引用移动过的文件的文件。
+    # 默认在线程池中并发读取和改写；processes 为 True 时在主进程中读取和扫描文件，
+    # 交给子进程分批改写，再由主进程统一写回。
+    def _std_rewrite_links(self, rewriter, toc_id, workers=None, processes=False):
+        ids = [id for id, mime in self.id_to_mime.items() if mime in ("application/xhtml+xml", "text/css")]
+        if toc_id is not None:
+            ids.insert(0, toc_id)
 
-            id = mime = prop = fall = over = None
-            deleted.append((id,bkpath,mime,prop,fall,over))
+        if processes:
+            # 文件在提交给子进程时才读取，同时在内存中的只有在途批次的数据
+            rewritten = []
 
-        # 暂时清空 spine 列表是为了避免每次使用deletefile方法遍历一次spine列表，这可能导致文件量大时效率低下。
-        spine_bak = self.spine.copy()
-        self.spine = []
-        # 纠正不标准的归档路径
-        for id,bkpath,mime,prop,fall,over in deleted: # files in manifest
-            if id is not None: # manifest_id
-                if mime == "application/x-dtbncx+xml": # 多余的 ncx 文件，直接删除
-                    self.id_to_mime[id] = ""
-                    self.deletefile(id)
-                    continue
-                std_group = mime_group_map.get(mime)
-                if std_group is not None:
-                    std_group_path = std_group_paths[std_group][0]
-                    data = self.readfile(id)
-                    self.deletefile(id)
-                    basename = no_repeat_basename(os.path.basename(bkpath))
-                    oldBkpath_to_newBasename[bkpath.lower()] = basename
-                    new_bkpath = std_group_path + "/" + basename
-                    newBkpath_to_oldGroup[new_bkpath] = os.path.dirname(bkpath)
-                    self.addfile(id,basename,data,mime,prop,fall,over)
-                else:
-                    self.deletefile(id)
-                continue
+            def files():
+                for id in ids:
+                    file = (self.id_to_mime[id], self._read_book_file(id, self.id_to_filepath[id]), self.id_to_bookpath[id])
+                    if rewriter.needs_rewrite(*file):
+                        rewritten.append(id)
+                        yield file
 
-            else: # files not in manifest
-                basename = no_repeat_basename(os.path.basename(bkpath))
-                data = self.readotherfile(bkpath)
-                self.deleteotherfile(bkpath)
-                self.other.remove(bkpath)
-                _,ext = os.path.splitext(basename)
-                if ext.lower() == "xml":
-                    self.addotherfile("META-INF/%s"%(basename),data)
-                    continue
-                if ext.lower() in ["opf","ncx"]: # 多余的 opf 和 ncx，直接删除
-                    continue
-                id = basename
-                mime = ext_mime_map.get(ext)
-                std_group = mime_group_map.get(mime)
-                if std_group is not None: # files can register in manifest
-                    std_group_path = std_group_paths[std_group][0]
-                    oldBkpath_to_newBasename[bkpath.lower()] = basename
-                    new_bkpath = std_group_path + "/" + basename
-                    newBkpath_to_oldGroup[new_bkpath] = os.path.dirname(bkpath)
-                    self.addfile(id,basename,data,mime,None,None,None)
-                    if mime == ext_mime_map[".xhtml"]:
-                        spine_bak.append((id,None,None))
-                else:
-                    continue
+            results = std_rewrite_in_processes(rewriter, files(), workers)
+            ids = rewritten
+        else:
+            def rewrite_file(id):
+                data = self._read_book_file(id, self.id_to_filepath[id])
+                return rewriter.rewrite_data(self.id_to_mime[id], data, self.id_to_bookpath[id])
+
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(rewrite_file, ids))
+        changed = [(id, data) for id, data in zip(ids, results) if data is not None]
+        self._write_out_files([(self.id_to_filepath[id], data) for id, data in changed], workers)
+        for id, data in changed:
+            self._moved_from.pop(id, None)
+            self.modified[id] = 'file'
+            self._links_changed(id)
+
+    # 按 plan 重构EPUB为Sigil规范格式，plan 默认由 plan_standardize_epub 计算，返回执行的计划
+    def standardize_epub(self, workers=None, processes=False, plan=None):
+        if plan is None:
+            plan = self.plan_standardize_epub()
+        if plan is None:
+            return None
+        # group_paths 会影响到 addfile 添加文件的目录
+        self.group_paths = {group: list(paths) for group, paths in _STD_GROUP_PATHS.items()}
+        toc_id = self.gettocid()
+        old_opfpath = self.opfbookpath
+        changed = set(self.added)
+        changed.update(self.modified)
 
-        # 修改 toc 关联链接
-        if toc_id is not None:
-            toc = self.readfile(toc_id)
-            tocpath = self.id_to_bookpath[toc_id]
-            old_toc_dir = newBkpath_to_oldGroup[tocpath]
-            def sub_toc_href(match):
-                href = match.group(2)
-                if href == "" or href.startswith(("http:","https:","res:","file:","data:")):
-                    return match.group()
-                href = urldecodepart(href).strip()
-                if "#" in href:
-                    href,target_id = href.split('#')
-                    target_id = '#' + target_id
-                else:
-                    target_id = ''
-                bkpath = self.build_bookpath(href, old_toc_dir)
-                if oldBkpath_to_newBasename.get(bkpath.lower()):
-                    basename = oldBkpath_to_newBasename[bkpath.lower()]
-                    return 'src="Text/' + basename + '"' + target_id
-                else:
-                    return match.group()    
-            toc = re.sub(r'src=([\'\"])(.*?)\1',sub_toc_href,toc)
-            self.writefile(toc_id,toc)
-
-        # 修改 xhtml 关联链接
-        for id,bkpath in self.id_to_bookpath.items():
-            if self.id_to_mime.get(id) != "application/xhtml+xml":
-                continue
-            text = self.readfile(id)
-            if not text.startswith('<?xml'):
-                text = '<?xml version="1.0" encoding="utf-8"?>\n'+ text
-            if not re.match(r'(?s).*<!DOCTYPE html',text):
-                if self.epub_version.startswith("2"):
-                    text = re.sub(r'(<\?xml.*?>)\n*',r'\1\n<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN"\n  "http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd">\n',text,1)
-                elif self.epub_version.startswith("3"):
-                    text = re.sub(r'(<\?xml.*?>)\n*',r'\1\n<!DOCTYPE html>\n',text,1)
-             #修改a[href]
-
-            def sub_href(match):
-                href = match.group(3)
-                if href == "" or href.startswith(("http:","https:","res:","file:","data:")):
-                    return match.group()
-                href = urldecodepart(href).strip()
-                if "#" in href:
-                    href,target_id = href.split('#')
-                    target_id = '#' + target_id
-                else:
-                    target_id = ''
-                old_group = newBkpath_to_oldGroup[bkpath]
-                old_bkpath = self.build_bookpath(href,old_group)
-                if not old_bkpath:
-                    return match.group()
-
-                if href.lower().endswith(('.jpg','.jpeg','.png','.bmp','.gif','.webp','.svg')):
-                    filename = oldBkpath_to_newBasename[old_bkpath.lower()]
-                    return match.group(1) + '../Images/' + filename + match.group(4)
-                elif href.lower().endswith('.css'):
-                    filename = oldBkpath_to_newBasename[old_bkpath.lower()]
-                    return '<link href="../Styles/' + filename +'" type="text/css" rel="stylesheet"/>'
-                elif href.lower().endswith(('.xhtml','.html','.htm')):
-                    filename = oldBkpath_to_newBasename[old_bkpath.lower()]
-                    return match.group(1) + filename + target_id + match.group(4)
-                else:
-                    return match.group()    
-            text = re.sub(r'(<[^>]*href=([\'\"]))(.*?)(\2[^>]*>)',sub_href,text)
-
-            #修改src
-            def re_src(match):
-                href = match.group(3)
-                if href == "" or href.startswith(("http:","https:","res:","file:","data:")):
-                    return match.group()
-                href = urldecodepart(href).strip()
-                old_group = newBkpath_to_oldGroup[bkpath]
-                old_bkpath = self.build_bookpath(href, old_group)
-                if not old_bkpath:
-                    return match.group()
-
-                if href.lower().endswith(('.jpg','.jpeg','.png','.bmp','.gif','.webp','.svg')):
-                    filename = oldBkpath_to_newBasename[old_bkpath.lower()]
-                    return match.group(1) + '../Images/' + filename + match.group(4)
-                elif href.lower().endswith('.mp3'):
-                    filename = oldBkpath_to_newBasename[old_bkpath.lower()]
-                    return match.group(1) + '../Audio/' + filename + match.group(4)
-                elif href.lower().endswith('.mp4'):
-                    filename = oldBkpath_to_newBasename[old_bkpath.lower()]
-                    return match.group(1) + '../Video/' + filename + match.group(4)
-                elif href.lower().endswith('.js'):
-                    filename = oldBkpath_to_newBasename[old_bkpath.lower()]
-                    return match.group(1) + '../Misc/' + filename + match.group(4)
-                else:
-                    return match.group()
-            text = re.sub(r'(<[^>]* src=([\'\"]))(.*?)(\2[^>]*>)',re_src,text)
-
-            #修改 url
-            def re_url(match):
-                url = match.group(2)
-                if url == "" or url.startswith(("http:","https:","res:","file:","data:")):
-                    return match.group()
-                url = urldecodepart(url).strip()
-                old_group = newBkpath_to_oldGroup[bkpath]
-                old_bkpath = self.build_bookpath(url,old_group)
-                if not old_bkpath:
-                    return match.group()
-
-                if url.lower().endswith(('.ttf','.otf')):
-                    filename = oldBkpath_to_newBasename[old_bkpath.lower()]
-                    return match.group(1) + '../Fonts/' + filename + match.group(3)
-                elif url.lower().endswith(('.jpg','.jpeg','.png','.bmp','.gif','.webp','.svg')):
-                    filename = oldBkpath_to_newBasename[old_bkpath.lower()]
-                    return match.group(1) + '../Images/' + filename + match.group(3)
-                else:
-                    return match.group()
-            text = re.sub(r'(url\([\'\"]?)(.*?)([\'\"]?\))',re_url,text)
-            self.writefile(id, text)
-        
-        # 修改css文件关联链接
-        for id,bkpath in self.id_to_bookpath.items():
-            if self.id_to_mime.get(id) != "text/css":
-                continue
-            css = self.readfile(id)
-            #修改 @import 
-            def re_import(match):
-                if match.group(2):
-                    href = match.group(2)
-                else:
-                    href = match.group(3)
-                href = urldecodepart(href).strip()
-                if not href.lower().endswith('.css'):
-                    return match.group()
-                filename = os.path.basename(href)
-                return '@import "' + filename + '"'
-            css = re.sub(r'@import ([\'\"])(.*?)\1|@import url\([\'\"]?(.*?)[\'\"]?\)',re_import,css)
-            #修改 css的url
-            def re_css_url(match):
-                url = match.group(2)
-                if url == "" or url.startswith(("http:","https:","res:","file:","data:")):
-                    return match.group()
-                url = urldecodepart(url).strip()
-                old_group = newBkpath_to_oldGroup[bkpath]
-                old_bkpath = self.build_bookpath(url,old_group)
-                if not old_bkpath:
-                    return match.group()
-                
-                if url.lower().endswith(('.ttf','.otf')):
-                    filename = oldBkpath_to_newBasename[old_bkpath.lower()]
-                    return match.group(1) + '../Fonts/' + filename + match.group(3)
-                elif url.lower().endswith(('.jpg','.jpeg','.png','.bmp','.gif','.webp','.svg')):
-                    filename = oldBkpath_to_newBasename[old_bkpath.lower()]
-                    return match.group(1) + '../Images/' + filename + match.group(3)
-                else:
-                    return match.group()
-            css = re.sub(r'(url\([\'\"]?)(.*?)([\'\"]?\))',re_css_url,css)
-            self.writefile(id,css)
+        # 清理关联文件不存在的ID。
+        for id in plan.missing:
+            href = self.id_to_href[id]
+            bookpath = self.id_to_bookpath[id]
+            del self.id_to_href[id]
+            del self.id_to_mime[id]
+            del self.id_to_props[id]
+            del self.id_to_fall[id]
+            del self.id_to_over[id]
+            del self.id_to_bookpath[id]
+            del self.href_to_id[href]
+            del self.bookpath_to_id[bookpath]
+            self._unindex_bookpath(id, bookpath)
+            self._manifest_changed(id)
+
+        # 修改 opf 文件归档路径，opf 保存时重新生成，不需要移动文件内容
+        if plan.opf_move is not None:
+            old_opfpath, std_opfpath = plan.opf_move
+            if std_opfpath in self.other:
+                self._remove_out_file(self.book_href_to_filepath[std_opfpath])
+                self._forget_other_file(std_opfpath)
+            self._forget_other_file(old_opfpath)
+            self.opfbookpath = std_opfpath
+            self.opf_dir = "OEBPS"
+            self.other.append(std_opfpath)
+            self.added.append(std_opfpath)
+            self.book_href_to_filepath[std_opfpath] = std_opfpath.replace("/", os.sep)
+            self.modified[std_opfpath] = 'file'
+            # manifest 中的 href 相对于 opf ，全部重新计算
+            self.href_to_id.clear()
+            for id, bookpath in self.id_to_bookpath.items():
+                href = buildRelativePath(std_opfpath, bookpath)
+                self.id_to_href[id] = href
+                self.href_to_id[href] = id
+            self._manifest_reset()
+
+        # 删除多余的 ncx 文件
+        for id in plan.deletes:
+            self.id_to_mime[id] = "" # 绕过epub2对ncx文件的操作限制
+            self._manifest_changed(id)
+            self.deletefile(id)
+
+        # 纠正不标准的归档路径
+        for id, bkpath, new_bkpath in plan.moves:
+            self._move_manifest_file(id, new_bkpath, id in changed)
+        for bkpath, new_bkpath in plan.other_moves:
+            self._move_other_file(bkpath, new_bkpath, bkpath in changed)
+        for bkpath in plan.other_deletes:
+            if self._in_outdir(bkpath):
+                self._remove_out_file(self.book_href_to_filepath[bkpath])
+            self._forget_other_file(bkpath)
+        for bkpath, new_bkpath, id, mime in plan.other_adds:
+            filepath = new_bkpath.replace("/", os.sep)
+            self._relocate_book_file(bkpath, self.book_href_to_filepath[bkpath], filepath, bkpath in changed)
+            moved_from = self._moved_from.pop(bkpath, None)
+            self._forget_other_file(bkpath)
+            if moved_from is not None:
+                self._moved_from[id] = moved_from
+            href = buildRelativePath(self.opfbookpath, new_bkpath)
+            self.id_to_filepath[id] = filepath
+            self.id_to_href[id] = href
+            self.id_to_mime[id] = mime
+            self.id_to_props[id] = None
+            self.id_to_fall[id] = None
+            self.id_to_over[id] = None
+            self.id_to_bookpath[id] = new_bkpath
+            self.href_to_id[href] = id
+            self.bookpath_to_id[new_bkpath] = id
+            self._index_bookpath(id, new_bkpath)
+            self._manifest_changed(id)
+            self.added.append(id)
+            self.modified[self.opfbookpath] = 'file'
+            if mime == ext_mime_map[".xhtml"]:
+                self.spine_insert_before(-1, id, None)
+
+        # 修改 toc、xhtml 和 css 的关联链接
+        rewriter = StdLinkRewriter(plan.old_to_basename, plan.new_to_old_group, self.epub_version, plan.moved_basenames())
+        self._std_rewrite_links(rewriter, toc_id, workers, processes)
 
         # 修改 opf 的 guide 节点引用链接
         new_guide = []
@@ -1453,7 +2033,7 @@ class Wrapper(object):
                 continue
             old_opf_dir = os.path.dirname(old_opfpath)
             old_bkpath = self.build_bookpath(href,old_opf_dir)
-            new_basename = oldBkpath_to_newBasename.get(old_bkpath.lower())
+            new_basename = plan.old_to_basename.get(old_bkpath.lower())
             if new_basename is None:
                 new_guide.append((type,title,href))
                 continue
@@ -1463,16 +2043,13 @@ class Wrapper(object):
         
         self.guide = new_guide
 
-        # 恢复 spine 
-        self.spine = spine_bak
-
         # 绕过文件保护，强制改写 container.xml
         container_xml_path = "META-INF/container.xml"
         xml_data = _unicodestr(self.readotherfile(container_xml_path))
-        xml_data = re.sub(r'(<rootfile[^>]*full-path="){0}("[^>]*>)'.format(old_opfpath),r"\1"+std_opfpath+r"\2",xml_data)
+        xml_data = re.sub(r'(<rootfile[^>]*full-path="){0}("[^>]*>)'.format(re.escape(old_opfpath)),r"\1"+self.opfbookpath+r"\2",xml_data)
         xmlpath = self.book_href_to_filepath.get(container_xml_path, None)
         if xmlpath is None:
             raise WrapperException('Book href does not exist')
-        xmlpath = os.path.join(self.ebook_root, xmlpath)
-        with open(xmlpath, 'wb') as fp:
-            fp.write(_utf8str(xml_data))
\ No newline at end of file
+        self._write_out_file(xmlpath, _utf8str(xml_data))
+        self.modified[container_xml_path] = 'file'
+        return plan
@@ -0,0 +1,116 @@
+import os
+import posixpath
+import sys
+import zipfile
+
+import pytest
+
+# the plugin modules import each other by bare name, as Sigil's plugin_launchers do
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "sigil_env"))
+
+from opf_parser import Opf_Parser
+from wrapper import Wrapper
+
+CONTAINER_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+'''
+
+XHTML = '''<?xml version="1.0" encoding="utf-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml"><head><title>%d</title></head>
+<body><p>%d</p></body></html>
+'''
+
+
+def write_epub(path, chapters, spine=None):
+    """An epub3 with chapters Text/c0.xhtml ... in the manifest (ids c0 ...),
+    and the spine idrefs given (all chapters in order by default)."""
+    if spine is None:
+        spine = ["c%d" % i for i in range(chapters)]
+    items = "".join('    <item id="c%d" href="Text/c%d.xhtml" media-type="application/xhtml+xml"/>\n' % (i, i)
+                    for i in range(chapters))
+    itemrefs = "".join('    <itemref idref="%s"/>\n' % idref for idref in spine)
+    opf = ('<?xml version="1.0" encoding="utf-8"?>\n'
+           '<package version="3.0" unique-identifier="uid" xmlns="http://www.idpf.org/2007/opf">\n'
+           '  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">\n'
+           '    <dc:identifier id="uid">test</dc:identifier>\n'
+           '    <dc:title>test</dc:title>\n'
+           '    <dc:language>en</dc:language>\n'
+           '  </metadata>\n'
+           '  <manifest>\n%s  </manifest>\n'
+           '  <spine>\n%s  </spine>\n'
+           '</package>\n') % (items, itemrefs)
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("mimetype", "application/epub+zip", zipfile.ZIP_STORED)
+        zf.writestr("META-INF/container.xml", CONTAINER_XML)
+        zf.writestr("OEBPS/content.opf", opf)
+        for i in range(chapters):
+            zf.writestr("OEBPS/Text/c%d.xhtml" % i, XHTML % (i, i))
+    return path
+
+
+@pytest.fixture
+def make_wrapper(tmp_path):
+    """make_wrapper(chapters, spine=None) -> a memory backend Wrapper."""
+    def make(chapters, spine=None):
+        epub_src = write_epub(str(tmp_path / "book.epub"), chapters, spine)
+        with zipfile.ZipFile(epub_src) as zf:
+            opf_data = zf.read("OEBPS/content.opf")
+        op = Opf_Parser("OEBPS/content.opf", "OEBPS/content.opf", opf_data=opf_data)
+        return Wrapper("", epub_src, "", op, "", "", backend="memory")
+    return make
+
+
+def write_book(path, files, manifest, spine=None, guide=()):
+    """An epub3 with OEBPS/content.opf and the given files {bookpath: data}.
+    manifest is [(id, bookpath, mime)], spine the idrefs (all xhtml items by
+    default), guide [(type, title, href relative to the opf)]."""
+    if spine is None:
+        spine = [id for id, bookpath, mime in manifest if mime == "application/xhtml+xml"]
+    items = "".join('    <item id="%s" href="%s" media-type="%s"/>\n' % (id, posixpath.relpath(bookpath, "OEBPS"), mime)
+                    for id, bookpath, mime in manifest)
+    itemrefs = "".join('    <itemref idref="%s"/>\n' % idref for idref in spine)
+    references = "".join('    <reference type="%s" title="%s" href="%s"/>\n' % ref for ref in guide)
+    opf = ('<?xml version="1.0" encoding="utf-8"?>\n'
+           '<package version="3.0" unique-identifier="uid" xmlns="http://www.idpf.org/2007/opf">\n'
+           '  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">\n'
+           '    <dc:identifier id="uid">test</dc:identifier>\n'
+           '    <dc:title>test</dc:title>\n'
+           '    <dc:language>en</dc:language>\n'
+           '  </metadata>\n'
+           '  <manifest>\n%s  </manifest>\n'
+           '  <spine>\n%s  </spine>\n'
+           '  <guide>\n%s  </guide>\n'
+           '</package>\n') % (items, itemrefs, references)
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("mimetype", "application/epub+zip", zipfile.ZIP_STORED)
+        zf.writestr("META-INF/container.xml", CONTAINER_XML)
+        zf.writestr("OEBPS/content.opf", opf)
+        for bookpath, data in files.items():
+            zf.writestr(bookpath, data)
+    return path
+
+
+@pytest.fixture(params=["disk", "zip", "memory"])
+def make_book(request, tmp_path):
+    """make_book(files, manifest, spine=None, guide=()) -> a Wrapper on each backend."""
+    backend = request.param
+
+    def make(files, manifest, spine=None, guide=()):
+        epub_src = write_book(str(tmp_path / "book.epub"), files, manifest, spine, guide)
+        ebook_root = outdir = ""
+        if backend != "memory":
+            outdir = str(tmp_path / "outdir")
+            os.makedirs(outdir)
+        with zipfile.ZipFile(epub_src) as zf:
+            opf_data = zf.read("OEBPS/content.opf")
+            if backend == "disk":
+                ebook_root = str(tmp_path / "ebook")
+                zf.extractall(ebook_root)
+        opf_path = os.path.join(ebook_root, "OEBPS", "content.opf")
+        op = Opf_Parser(opf_path, "OEBPS/content.opf", opf_data=opf_data)
+        return Wrapper(ebook_root, epub_src, outdir, op, "", "", backend=backend)
+    return make
@@ -0,0 +1,35 @@
+import pytest
+
+from wrapper import WrapperException
+
+XHTML = '<?xml version="1.0" encoding="utf-8"?>\n<html xmlns="http://www.w3.org/1999/xhtml"><body><p>%s</p></body></html>\n'
+
+
+@pytest.mark.parametrize("bad, message", [
+    (("c0", "new.xhtml", XHTML % "x"), "Manifest Id is not unique"),
+    (("n1", "x.xhtml", XHTML % "x"), "Manifest Id is not unique"),
+    (("new", "c0.xhtml", XHTML % "x"), "Basename already exists"),
+    (("new", "x.xhtml", XHTML % "x"), "Basename already exists"),
+    (("new", "noext", b"x"), "Mime Type Missing"),
+])
+def test_addfile_and_addfiles_reject_the_same_files(make_wrapper, bad, message):
+    w = make_wrapper(1)
+    w.addfile("n1", "x.xhtml", XHTML % "x")
+    with pytest.raises(WrapperException, match=message):
+        w.addfile(*bad)
+    # the whole batch is rejected before anything is added
+    before = dict(w.id_to_bookpath)
+    with pytest.raises(WrapperException, match=message):
+        w.addfiles([("ok", "ok.xhtml", XHTML % "ok"), bad])
+    assert dict(w.id_to_bookpath) == before
+
+
+def test_addfiles_rejects_duplicates_within_the_batch(make_wrapper):
+    w = make_wrapper(1)
+    with pytest.raises(WrapperException, match="Manifest Id is not unique"):
+        w.addfiles([("n", "n1.xhtml", XHTML % "1"), ("n", "n2.xhtml", XHTML % "2")])
+    with pytest.raises(WrapperException, match="Basename already exists"):
+        w.addfiles([("n1", "n.xhtml", XHTML % "1"), ("n2", "n.xhtml", XHTML % "2")])
+    assert w.addfiles([("n1", "n1.xhtml", XHTML % "1"), ("n2", "n2.css", "p {}")]) == ["n1", "n2"]
+    assert w.id_to_bookpath["n2"] == "OEBPS/Styles/n2.css"
+    assert w.readfile("n1") == XHTML % "1"
@@ -0,0 +1,97 @@
+import zipfile
+
+import pytest
+
+import epub_utils
+from epub_utils import zip_write_members, zip_update_members, zip_compress_data
+
+MEMBERS = [
+    ("mimetype", b"application/epub+zip"),
+    ("OEBPS/content.opf", b"<package/>" * 50),
+    ("OEBPS/Images/a.png", b"\x89PNG" + bytes(range(256)) * 20),
+    ("OEBPS/Text/c1.xhtml", "<p>é</p>" * 100),
+]
+
+
+def loader(data):
+    return lambda: data
+
+
+def contents(path):
+    with zipfile.ZipFile(path) as zf:
+        assert zf.testzip() is None
+        return [(info.filename, info.compress_type, zf.read(info)) for info in zf.infolist()]
+
+
+def write(path, members=MEMBERS, **kwargs):
+    with zipfile.ZipFile(path, "w") as outzip:
+        zip_write_members(outzip, [(name, loader(data)) for name, data in members], **kwargs)
+    return path
+
+
+@pytest.fixture(params=[True, False], ids=["raw", "fallback"])
+def raw_writable(request, monkeypatch):
+    if not request.param:
+        monkeypatch.setattr(epub_utils, "_zip_raw_writable", lambda zf: False)
+    return request.param
+
+
+def test_write_members(tmp_path, raw_writable):
+    result = contents(write(str(tmp_path / "a.epub"), workers=2))
+    assert [name for name, ctype, data in result] == [name for name, data in MEMBERS]
+    assert result[0][1] == zipfile.ZIP_STORED
+    assert result[2][1] == zipfile.ZIP_STORED
+    assert result[1][1] == zipfile.ZIP_DEFLATED
+    assert result[3][2] == MEMBERS[3][1].encode("utf-8")
+
+
+def test_copy_and_update_members(tmp_path, raw_writable):
+    path = write(str(tmp_path / "a.epub"))
+    srczip = zipfile.ZipFile(path)
+    infos = srczip.infolist()
+    members = [(info.filename, (srczip, info)) for info in infos]
+    members[2] = ("OEBPS/Text/c1.xhtml", loader(b"<p>new</p>"))
+    members[3] = ("OEBPS/Images/a.png", (srczip, infos[2]))
+    zip_update_members(path, srczip, members)
+    result = contents(path)
+    assert [name for name, ctype, data in result] == [
+        "mimetype", "OEBPS/content.opf", "OEBPS/Text/c1.xhtml", "OEBPS/Images/a.png"]
+    assert result[2][2] == b"<p>new</p>"
+    assert result[3][2] == MEMBERS[2][1]
+
+
+def test_unsupported_compress_type_is_rejected_up_front(tmp_path):
+    with pytest.raises(ValueError):
+        zip_compress_data(b"x", zipfile.ZIP_BZIP2)
+    path = str(tmp_path / "a.epub")
+    with pytest.raises(ValueError):
+        write(path, compress_policy=lambda name: zipfile.ZIP_LZMA if name.endswith(".xhtml") else zipfile.ZIP_STORED)
+    with zipfile.ZipFile(path) as zf:
+        assert zf.namelist() == []
+
+
+def test_failed_update_leaves_the_archive_as_it_was(tmp_path, monkeypatch):
+    path = write(str(tmp_path / "a.epub"))
+    with open(path, "rb") as fp:
+        before = fp.read()
+    srczip = zipfile.ZipFile(path)
+    infos = srczip.infolist()
+    members = [(info.filename, (srczip, info)) for info in infos]
+    members[1] = ("OEBPS/content.opf", loader(b"<package>new</package>"))
+    write_raw = epub_utils._zip_write_raw
+    written = []
+
+    # the disk fills up after the first tail member has overwritten the old data
+    def fail_second_write(outzip, zinfo, chunks):
+        if written:
+            raise OSError("No space left on device")
+        written.append(zinfo.filename)
+        return write_raw(outzip, zinfo, chunks)
+
+    monkeypatch.setattr(epub_utils, "_zip_write_raw", fail_second_write)
+    with pytest.raises(OSError):
+        zip_update_members(path, srczip, members, workers=1)
+    assert written == ["OEBPS/content.opf"]
+    with open(path, "rb") as fp:
+        assert fp.read() == before
+    assert not (tmp_path / "a.epub.tail").exists()
@@ -0,0 +1,90 @@
+XHTML = ('<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n'
+         '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>t</title>%s</head>\n'
+         '<body>%s</body></html>\n')
+FILES = {
+    "OEBPS/Text/a.xhtml": XHTML % ('<link href="../Styles/s.css" rel="stylesheet" type="text/css"/>',
+                                   '<p><a href="b.xhtml#x">b</a><img src="../Images/i.png" alt=""/></p>'),
+    "OEBPS/Text/b.xhtml": XHTML % ("", '<p id="x"><a href="a.xhtml">a</a><a href="http://example.com/">x</a></p>'),
+    "OEBPS/Styles/s.css": '@import "t.css";\np { background: url(../Images/i.png); }\n',
+    "OEBPS/Styles/t.css": "p { margin: 0; }\n",
+    "OEBPS/Images/i.png": b"\x89PNG",
+}
+MANIFEST = [
+    ("a", "OEBPS/Text/a.xhtml", "application/xhtml+xml"),
+    ("b", "OEBPS/Text/b.xhtml", "application/xhtml+xml"),
+    ("s", "OEBPS/Styles/s.css", "text/css"),
+    ("t", "OEBPS/Styles/t.css", "text/css"),
+    ("i", "OEBPS/Images/i.png", "image/png"),
+]
+
+
+def test_links_between_files(make_book):
+    w = make_book(FILES, MANIFEST)
+    assert [(target, fragment, kind) for target, fragment, href, kind, start, end in w.links_from("a")] == [
+        ("OEBPS/Styles/s.css", None, "href"), ("OEBPS/Text/b.xhtml", "x", "href"), ("OEBPS/Images/i.png", None, "src")]
+    text = w.readfile("a")
+    for target, fragment, href, kind, start, end in w.links_from("a"):
+        assert text[start:end] == href
+    assert sorted(w.linking_ids("i")) == ["a", "s"]
+    assert [(source, kind) for source, fragment, href, kind, start, end in w.links_to("t")] == [("s", "import")]
+    assert [(source, href) for source, fragment, href, kind, start, end in w.links_to("b")] == [("a", "b.xhtml#x")]
+    assert w.links_from("i") == []
+
+
+def test_writefile_updates_links(make_book):
+    w = make_book(FILES, MANIFEST)
+    assert w.linking_ids("b") == ["a"]
+    w.writefile("a", XHTML % ("", '<p><img src="../Images/i.png" alt=""/></p>'))
+    assert w.linking_ids("b") == []
+    assert w.linking_ids("s") == []
+    assert sorted(w.linking_ids("i")) == ["a", "s"]
+    w.writefile("b", XHTML % ("", '<p><a href="b.xhtml#x">self</a></p>'))
+    assert w.linking_ids("a") == []
+    assert w.links_to("b") == [("b", "x", "b.xhtml#x", "href", w.links_from("b")[0][4], w.links_from("b")[0][5])]
+
+
+def test_addfile_and_deletefile_update_links(make_book):
+    w = make_book(FILES, MANIFEST)
+    assert w.linking_ids("t") == ["s"]
+    w.addfile("c", "c.xhtml", XHTML % ("", '<p><a href="a.xhtml">a</a><a href="../Styles/t.css">t</a></p>'))
+    assert sorted(w.linking_ids("a")) == ["b", "c"]
+    assert sorted(w.linking_ids("t")) == ["c", "s"]
+    w.deletefile("s")
+    assert w.linking_ids("t") == ["c"]
+    assert w.linking_ids("i") == ["a"]
+    # links to a deleted file are still found by bookpath
+    assert [source for source, fragment, href, kind, start, end in w.links_to_bookpath("OEBPS/Styles/s.css")] == ["a"]
+    w.deletefile("c")
+    assert w.linking_ids("a") == ["b"]
+    assert w.linking_ids("t") == []
+
+
+def test_entities_in_markup_links_are_unescaped(make_book):
+    files = {
+        "OEBPS/Text/a.xhtml": XHTML % ('<link href="../Styles/s&amp;t.css" rel="stylesheet" type="text/css"/>',
+                                       "<p><a href='b&amp;c.xhtml#x&#38;y'>b</a></p>"),
+        "OEBPS/Text/b&c.xhtml": XHTML % ("", '<p id="x&amp;y">b</p>'),
+        "OEBPS/Styles/s&t.css": "p { background: url(../Images/i&amp;j.png); }\n",
+        "OEBPS/Images/i&amp;j.png": b"\x89PNG",
+    }
+    manifest = [
+        ("a", "OEBPS/Text/a.xhtml", "application/xhtml+xml"),
+        ("bc", "OEBPS/Text/b&c.xhtml", "application/xhtml+xml"),
+        ("st", "OEBPS/Styles/s&t.css", "text/css"),
+        ("ij", "OEBPS/Images/i&amp;j.png", "image/png"),
+    ]
+    w = make_book(files, manifest)
+    assert [(target, fragment, href) for target, fragment, href, kind, start, end in w.links_from("a")] == [
+        ("OEBPS/Styles/s&t.css", None, "../Styles/s&amp;t.css"), ("OEBPS/Text/b&c.xhtml", "x&y", "b&amp;c.xhtml#x&#38;y")]
+    # css has no entities, the url is taken as written
+    assert w.linking_ids("ij") == ["st"]
+
+
+def test_links_above_the_book_warn_every_time(capsys):
+    from epub_utils import LinkGraph
+    graph = LinkGraph()
+    text = XHTML % ("", '<p><img src="../../x.png" alt=""/></p>')
+    graph.add("a", "OEBPS/a.xhtml", "application/xhtml+xml", text)
+    graph.add("b", "OEBPS/b.xhtml", "application/xhtml+xml", text)
+    assert capsys.readouterr().out.count("Error resolving relative path segments") == 2
+    assert graph.links_from("a")[0][0] == graph.links_from("b")[0][0] == "x.png"
@@ -0,0 +1,53 @@
+XHTML = ('<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n'
+         '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>t</title></head>\n'
+         '<body><p>%s</p></body></html>\n')
+# not standard: everything sits next to the opf
+FILES = {
+    "OEBPS/a.xhtml": XHTML % '<a href="b.xhtml">b</a><img src="i.png" alt=""/>',
+    "OEBPS/b.xhtml": XHTML % '<a href="a.xhtml">a</a>',
+    "OEBPS/s.css": "p { background: url(i.png); }\n",
+    "OEBPS/i.png": b"\x89PNG",
+}
+MANIFEST = [
+    ("a", "OEBPS/a.xhtml", "application/xhtml+xml"),
+    ("b", "OEBPS/b.xhtml", "application/xhtml+xml"),
+    ("s", "OEBPS/s.css", "text/css"),
+    ("i", "OEBPS/i.png", "image/png"),
+]
+
+
+def fresh_manifest_xml(w):
+    """build_manifest_xml() rendered without any of the cached state, which is left as it was."""
+    saved = w._manifest_items, w._manifest_ids, w._manifest_xml
+    w._manifest_items, w._manifest_ids, w._manifest_xml = {}, None, None
+    try:
+        return w.build_manifest_xml()
+    finally:
+        w._manifest_items, w._manifest_ids, w._manifest_xml = saved
+
+
+def test_cached_manifest_matches_a_fresh_render(make_book):
+    w = make_book(FILES, MANIFEST)
+    steps = [
+        lambda: w.addfile("c", "c.xhtml", XHTML % "c"),
+        lambda: w.addfiles([("0first", "first.xhtml", XHTML % "0"), ("zz", "z z.css", "p {}\n"),
+                            ("m", "m.svg", '<svg xmlns="http://www.w3.org/2000/svg"/>', None, None, "a")]),
+        lambda: w.deletefile("b"),
+        lambda: w.set_manifest_epub3_attributes("a", properties="svg", fallback="c", overlay=None),
+        lambda: w.move_files({"OEBPS/a.xhtml": "OEBPS/part/a.xhtml", "OEBPS/i.png": "OEBPS/img/i.png"}),
+        lambda: w.standardize_epub(),
+        lambda: w.deletefile("0first"),
+        lambda: w.addfile("b", "b.xhtml", XHTML % "b again"),
+    ]
+    previous = w.build_manifest_xml()
+    assert previous == fresh_manifest_xml(w)
+    for step in steps:
+        step()
+        rendered = w.build_manifest_xml()
+        assert rendered != previous
+        assert rendered == fresh_manifest_xml(w)
+        # the opf is built from the same cached render
+        assert rendered in w.build_opf()
+        previous = rendered
+    assert 'href="Text/a.xhtml" media-type="application/xhtml+xml" properties="svg" fallback="c"' in previous
+    assert 'href="Styles/z%20z.css"' in previous
@@ -0,0 +1,111 @@
+import pytest
+
+from bookcontainer import BookContainer
+from wrapper import WrapperException
+
+XHTML = ('<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n'
+         '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>t</title>%s</head>\n'
+         '<body>%s</body></html>\n')
+FILES = {
+    "OEBPS/Text/a.xhtml": XHTML % ('<link href="../Styles/s.css" rel="stylesheet" type="text/css"/>',
+                                   '<p><a href="b.xhtml#x">b</a><a href="b.xhtml?v=1#x">b</a>'
+                                   '<img src="../Images/i.png" alt=""/></p>'),
+    "OEBPS/Text/b.xhtml": XHTML % ("", '<p id="x"><a href="a.xhtml#top">a</a></p>'),
+    "OEBPS/Styles/s.css": '@import "t.css";\np { background: url("../Images/i.png"); }\n',
+    "OEBPS/Styles/t.css": "p { background: url(../Images/i.png); }\n",
+    "OEBPS/Images/i.png": b"\x89PNG",
+}
+MANIFEST = [
+    ("a", "OEBPS/Text/a.xhtml", "application/xhtml+xml"),
+    ("b", "OEBPS/Text/b.xhtml", "application/xhtml+xml"),
+    ("s", "OEBPS/Styles/s.css", "text/css"),
+    ("t", "OEBPS/Styles/t.css", "text/css"),
+    ("i", "OEBPS/Images/i.png", "image/png"),
+]
+GUIDE = [("cover", "Cover", "Text/a.xhtml"), ("text", "Start", "Text/b.xhtml#x")]
+
+
+def state(w):
+    return (dict(w.id_to_bookpath), dict(w.id_to_href), w.getguide(),
+            {id: w.readfile(id) for id in w.id_to_bookpath})
+
+
+def test_swap_two_files(make_book):
+    w = make_book(FILES, MANIFEST, guide=GUIDE)
+    changed = w.move_files({"OEBPS/Text/a.xhtml": "OEBPS/Text/b.xhtml", "OEBPS/Text/b.xhtml": "OEBPS/Text/a.xhtml"})
+    assert sorted(changed) == ["a", "b"]
+    assert w.id_to_bookpath["a"] == "OEBPS/Text/b.xhtml"
+    assert w.id_to_bookpath["b"] == "OEBPS/Text/a.xhtml"
+    assert w.map_bookpath_to_id("OEBPS/Text/a.xhtml", None) == "b"
+    assert [sid for sid, linear, properties in w.getspine_epub3()] == ["a", "b"]
+    assert '<a href="a.xhtml#x">' in w.readfile("a")
+    assert '<a href="b.xhtml#top">' in w.readfile("b")
+    assert w.getguide() == [("cover", "Cover", "Text/b.xhtml"), ("text", "Start", "Text/a.xhtml#x")]
+    assert w.linking_ids("b") == ["a"]
+
+
+def test_book_container_move_files(make_book):
+    bk = BookContainer(make_book(FILES, MANIFEST))
+    assert bk.move_files({"OEBPS/Images/i.png": "OEBPS/i.png"}) == ["a", "s", "t"]
+    assert bk.id_to_bookpath("i") == "OEBPS/i.png"
+    assert sorted(bk.linking_ids("i")) == ["a", "s", "t"]
+
+
+def test_fragment_and_query_are_kept(make_book):
+    w = make_book(FILES, MANIFEST, guide=GUIDE)
+    assert w.move_files({"OEBPS/Text/b.xhtml": "OEBPS/Text/part/b 2.xhtml"}) == ["a", "b"]
+    text = w.readfile("a")
+    assert '<a href="part/b%202.xhtml#x">' in text
+    assert '<a href="part/b%202.xhtml?v=1#x">' in text
+    assert '<a href="../a.xhtml#top">' in w.readfile("b")
+    assert w.getguide()[1] == ("text", "Start", "Text/part/b%202.xhtml#x")
+    assert w.getguide()[0] == GUIDE[0]
+
+
+def test_css_url_and_import_are_rewritten(make_book):
+    w = make_book(FILES, MANIFEST)
+    w.move_files({"OEBPS/Images/i.png": "OEBPS/Images/cover/i.png", "OEBPS/Styles/t.css": "OEBPS/t.css"})
+    assert w.readfile("s") == '@import "../t.css";\np { background: url("../Images/cover/i.png"); }\n'
+    assert w.readfile("t") == "p { background: url(Images/cover/i.png); }\n"
+    assert '<img src="../Images/cover/i.png"' in w.readfile("a")
+    # files moved along with the links they hold
+    w.move_files({"OEBPS/Styles/s.css": "OEBPS/s.css"})
+    assert w.readfile("s") == '@import "t.css";\np { background: url("Images/cover/i.png"); }\n'
+    assert '<link href="../s.css"' in w.readfile("a")
+
+
+@pytest.mark.parametrize("mapping", [
+    {"OEBPS/Text/a.xhtml": "OEBPS/Text/c.xhtml", "OEBPS/Text/b.xhtml": "OEBPS/Text/c.xhtml"},
+    {"OEBPS/Text/a.xhtml": "OEBPS/content.opf"},
+    {"OEBPS/Text/a.xhtml": "META-INF/container.xml"},
+    {"OEBPS/Text/a.xhtml": "OEBPS/Styles/s.css"},
+    {"OEBPS/Text/a.xhtml": "OEBPS/Text/../c.xhtml"},
+    {"OEBPS/Text/a.xhtml": "OEBPS/Text/c.xhtml", "OEBPS/Text/missing.xhtml": "OEBPS/Text/d.xhtml"},
+], ids=["duplicate", "opf", "protected", "existing", "dot-segments", "missing-source"])
+def test_rejected_moves_change_nothing(make_book, mapping):
+    w = make_book(FILES, MANIFEST, guide=GUIDE)
+    w.linking_ids("a")
+    before = state(w)
+    with pytest.raises(WrapperException):
+        w.move_files(mapping)
+    assert state(w) == before
+    assert not w.modified and not w.added
+    assert sorted(w.linking_ids("i")) == ["a", "s", "t"]
+
+
+def test_entities_in_links_are_kept_valid(make_book):
+    files = {
+        "OEBPS/Text/a.xhtml": XHTML % ("", '<p><a href="b&amp;c.xhtml#x">b</a></p>'),
+        "OEBPS/Text/b&c.xhtml": XHTML % ("", '<p id="x"><a href="a.xhtml">a</a></p>'),
+    }
+    manifest = [("a", "OEBPS/Text/a.xhtml", "application/xhtml+xml"),
+                ("bc", "OEBPS/Text/b&c.xhtml", "application/xhtml+xml")]
+    w = make_book(files, manifest)
+    # moved together the links between them still resolve and are left as written
+    assert w.move_files({"OEBPS/Text/a.xhtml": "OEBPS/Text/part/a.xhtml",
+                         "OEBPS/Text/b&c.xhtml": "OEBPS/Text/part/b&c.xhtml"}) == []
+    assert '<a href="b&amp;c.xhtml#x">' in w.readfile("a")
+    assert w.move_files({"OEBPS/Text/part/b&c.xhtml": "OEBPS/Text/b&c.xhtml"}) == ["a", "bc"]
+    assert '<a href="../b%26c.xhtml#x">' in w.readfile("a")
+    assert '<a href="part/a.xhtml">' in w.readfile("bc")
+    assert w.linking_ids("bc") == ["a"]
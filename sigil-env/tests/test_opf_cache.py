@@ -0,0 +1,100 @@
+import os
+import zipfile
+
+from conftest import write_book
+from opf_cache import OpfCache
+from opf_parser import Opf_Parser, _SNAPSHOT_FIELDS
+from wrapper import Wrapper
+
+XHTML = '<?xml version="1.0" encoding="utf-8"?>\n<html xmlns="http://www.w3.org/1999/xhtml"><body><p>%s</p></body></html>\n'
+FILES = {"OEBPS/Text/a.xhtml": XHTML % "a", "OEBPS/Text/b.xhtml": XHTML % "b",
+         "OEBPS/Styles/s.css": "p { margin: 0; }\n", "OEBPS/Images/i.png": b"\x89PNG"}
+MANIFEST = [("a", "OEBPS/Text/a.xhtml", "application/xhtml+xml"), ("b", "OEBPS/Text/b.xhtml", "application/xhtml+xml"),
+            ("s", "OEBPS/Styles/s.css", "text/css"), ("i", "OEBPS/Images/i.png", "image/png")]
+GUIDE = [("cover", "Cover", "Text/a.xhtml")]
+
+
+def parse(epub_src):
+    with zipfile.ZipFile(epub_src) as zf:
+        return Opf_Parser("OEBPS/content.opf", "OEBPS/content.opf", opf_data=zf.read("OEBPS/content.opf"))
+
+
+def cache_key(cache, epub_src):
+    with zipfile.ZipFile(epub_src) as zf:
+        return cache.make_key(epub_src, "OEBPS/content.opf", zf.getinfo("OEBPS/content.opf"))
+
+
+def wrapper_state(epub_src, op):
+    w = Wrapper("", epub_src, "", op, "", "", backend="memory")
+    return (w.build_opf(), dict(w.id_to_href), dict(w.id_to_mime), dict(w.id_to_bookpath),
+            dict(w.id_to_props), w.getspine_epub3(), w.getguide(), w.group_paths)
+
+
+def test_cache_hit_restores_the_same_wrapper(tmp_path):
+    epub_src = write_book(str(tmp_path / "book.epub"), FILES, MANIFEST, spine=["b", "a"], guide=GUIDE)
+    cache = OpfCache(str(tmp_path / "cache"))
+    key = cache_key(cache, epub_src)
+    assert cache.load(epub_src, key) is None
+    # stored before a Wrapper takes over the parser's dicts, as Ebook does
+    op = parse(epub_src)
+    cache.store(epub_src, key, op.get_snapshot())
+    snapshot = cache.load(epub_src, key)
+    assert snapshot is not None
+    assert wrapper_state(epub_src, Opf_Parser.from_snapshot(snapshot)) == wrapper_state(epub_src, parse(epub_src))
+
+
+def test_changed_opf_or_epub_misses(tmp_path):
+    epub_src = write_book(str(tmp_path / "book.epub"), FILES, MANIFEST)
+    cache = OpfCache(str(tmp_path / "cache"))
+    key = cache_key(cache, epub_src)
+    cache.store(epub_src, key, parse(epub_src).get_snapshot())
+    assert cache.load(epub_src, key) is not None
+    with zipfile.ZipFile(epub_src) as zf:
+        zinfo = zf.getinfo("OEBPS/content.opf")
+    zinfo.CRC ^= 1
+    assert cache.load(epub_src, cache.make_key(epub_src, "OEBPS/content.opf", zinfo)) is None
+    zinfo.CRC ^= 1
+    zinfo.file_size += 1
+    assert cache.load(epub_src, cache.make_key(epub_src, "OEBPS/content.opf", zinfo)) is None
+
+    # a rewritten opf
+    st = os.stat(epub_src)
+    write_book(epub_src, FILES, MANIFEST, spine=["b"])
+    os.utime(epub_src, ns=(st.st_atime_ns, st.st_mtime_ns))
+    new_key = cache_key(cache, epub_src)
+    assert new_key != key
+    assert cache.load(epub_src, new_key) is None
+
+    # the same epub touched
+    cache.store(epub_src, new_key, parse(epub_src).get_snapshot())
+    os.utime(epub_src, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    touched_key = cache_key(cache, epub_src)
+    assert touched_key != new_key
+    assert cache.load(epub_src, touched_key) is None
+
+
+def test_corrupt_cache_file_misses(tmp_path):
+    epub_src = write_book(str(tmp_path / "book.epub"), FILES, MANIFEST)
+    cache = OpfCache(str(tmp_path / "cache"))
+    key = cache_key(cache, epub_src)
+    snapshot = parse(epub_src).get_snapshot()
+    cache.store(epub_src, key, snapshot)
+    path = cache._cache_path(epub_src)
+    with open(path, "rb") as fp:
+        data = fp.read()
+    for broken in (data[:len(data) // 2], b"not a pickle"):
+        with open(path, "wb") as fp:
+            fp.write(broken)
+        assert cache.load(epub_src, key) is None
+    # and is overwritten by the next store
+    cache.store(epub_src, key, snapshot)
+    assert cache.load(epub_src, key) == snapshot
+
+
+def test_snapshot_fields_cover_the_parsed_state(tmp_path):
+    op = parse(write_book(str(tmp_path / "book.epub"), FILES, MANIFEST, guide=GUIDE))
+    # the raw opf text, the parse position and the folder counts are only used while parsing
+    transient = {"_debug", "opf", "opos", "group_count"}
+    assert set(vars(op)) - transient == set(_SNAPSHOT_FIELDS)
+    restored = Opf_Parser.from_snapshot(op.get_snapshot())
+    assert set(vars(restored)) == set(vars(op))
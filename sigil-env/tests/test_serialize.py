@@ -0,0 +1,30 @@
+import sys
+
+from sigil_bs4 import BeautifulSoup
+
+
+def nested_divs(depth):
+    return "<div>" * depth + "<p>x</p>" + "</div>" * depth
+
+
+def pretty_nested_divs(depth):
+    # a div inside another is indented one space more, except the outermost two
+    opens = ["%s<div>\n" % (" " * max(level - 1, 0)) for level in range(depth)]
+    closes = ["%s</div>\n" % (" " * max(level - 1, 0)) for level in reversed(range(depth))]
+    return "".join(opens) + " " * (depth - 1) + "<p>x</p>\n" + "".join(closes)
+
+
+def test_nested_output():
+    for depth in (1, 2, 3, 10):
+        div = BeautifulSoup(nested_divs(depth), "html.parser").div
+        assert div.serialize_xhtml() == nested_divs(depth)
+        assert div.prettyprint_xhtml() == pretty_nested_divs(depth)
+
+
+def test_tree_deeper_than_the_recursion_limit():
+    depth = sys.getrecursionlimit() + 200
+    soup = BeautifulSoup(nested_divs(depth), "html.parser")
+    assert soup.div.serialize_xhtml() == nested_divs(depth)
+    assert soup.div.serialize_xhtml_contents() == nested_divs(depth)[5:-6]
+    assert soup.div.prettyprint_xhtml() == pretty_nested_divs(depth)
+    assert soup.serialize_xhtml().endswith(nested_divs(depth))
@@ -0,0 +1,39 @@
+import gc
+
+from sigil_bs4 import BeautifulSoup
+
+HTML = '<div id="a" class="x y"><p class="x">1</p><p>2</p></div><span class="y">3</span>'
+
+
+def test_index_results_match_tree_walk():
+    plain = BeautifulSoup(HTML, "html.parser")
+    indexed = BeautifulSoup(HTML, "html.parser")
+    indexed.enable_index()
+    for soup in (plain, indexed):
+        soup.find("span").extract()
+        soup.find(id="a")["class"] = "z"
+    queries = [
+        lambda s: s.find_all("p"),
+        lambda s: s.find_all(class_="x"),
+        lambda s: s.find_all(class_="z"),
+        lambda s: s.select("#a p.x"),
+        lambda s: s.find(id="a").find_all(class_="y"),
+    ]
+    for query in queries:
+        assert [str(t) for t in query(indexed)] == [str(t) for t in query(plain)]
+
+
+def test_changes_drop_the_index_whatever_other_soups_do():
+    soup = BeautifulSoup(HTML, "html.parser")
+    soup.enable_index()
+    assert len(soup.find_all("p")) == 2
+    # other soups enabling, disabling or going away don't affect this one
+    other = BeautifulSoup(HTML, "html.parser")
+    other.enable_index()
+    other.disable_index()
+    del other
+    gc.collect()
+    soup.find("p").extract()
+    assert len(soup.find_all("p")) == 1
+    soup.find("p")["id"] = "b"
+    assert [str(t) for t in soup.select("#b")] == ["<p id=\"b\">2</p>"]
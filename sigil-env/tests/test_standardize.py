@@ -0,0 +1,51 @@
+from functools import partial
+
+import pytest
+
+import epub_utils
+import wrapper
+
+XHTML = ('<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n'
+         '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>a</title></head>\n'
+         '<body><p><img src="%s" alt=""/></p></body></html>\n')
+
+
+@pytest.mark.parametrize("filename, href", [
+    ("img(1).png", "../img(1).png"),
+    ("my pic.png", "../my pic.png"),
+    ("my pic.png", "../my%20pic.png"),
+])
+def test_links_to_moved_files_with_parens_or_spaces(make_book, filename, href):
+    # the xhtml is already standard, only the image it links to moves
+    w = make_book({"OEBPS/Text/a.xhtml": XHTML % href, "OEBPS/" + filename: b"\x89PNG"},
+                  [("a", "OEBPS/Text/a.xhtml", "application/xhtml+xml"), ("img", "OEBPS/" + filename, "image/png")])
+    w.standardize_epub()
+    assert w.id_to_bookpath["img"] == "OEBPS/Images/" + filename
+    assert 'src="../Images/%s"' % filename in w.readfile("a")
+
+
+@pytest.mark.parametrize("url", ['url("../my pic.png")', "url(../my pic.png)"])
+def test_css_url_to_moved_file_with_spaces(make_book, url):
+    w = make_book({"OEBPS/Text/a.xhtml": XHTML % "../Images/b.png", "OEBPS/Styles/s.css": "p { background: %s; }\n" % url,
+                   "OEBPS/my pic.png": b"\x89PNG"},
+                  [("a", "OEBPS/Text/a.xhtml", "application/xhtml+xml"), ("s", "OEBPS/Styles/s.css", "text/css"),
+                   ("img", "OEBPS/my pic.png", "image/png")])
+    w.standardize_epub()
+    assert "../Images/my pic.png" in w.readfile("s")
+
+
+
+@pytest.mark.parametrize("processes", [False, True], ids=["threads", "processes"])
+def test_many_files_are_rewritten_in_order(make_book, monkeypatch, processes):
+    files = {"OEBPS/c%d.xhtml" % i: XHTML % ("img%d.png" % i) for i in range(40)}
+    files.update({"OEBPS/img%d.png" % i: b"\x89PNG" for i in range(40)})
+    manifest = [("c%d" % i, "OEBPS/c%d.xhtml" % i, "application/xhtml+xml") for i in range(40)]
+    manifest += [("img%d" % i, "OEBPS/img%d.png" % i, "image/png") for i in range(40)]
+    w = make_book(files, manifest)
+    # small batches with few of them in flight, results must still line up with the files
+    monkeypatch.setattr(wrapper, "std_rewrite_in_processes",
+                        partial(epub_utils.std_rewrite_in_processes, batch_size=3, max_in_flight=2))
+    w.standardize_epub(workers=2, processes=processes)
+    for i in range(40):
+        assert w.id_to_bookpath["c%d" % i] == "OEBPS/Text/c%d.xhtml" % i
+        assert 'src="../Images/img%d.png"' % i in w.readfile("c%d" % i)
@@ -0,0 +1,72 @@
+import os
+import time
+import zipfile
+
+import pytest
+
+import epub_utils
+
+XHTML = '<?xml version="1.0" encoding="utf-8"?>\n<html xmlns="http://www.w3.org/1999/xhtml"><body><p>%s</p></body></html>\n'
+FILES = {"OEBPS/Text/a.xhtml": XHTML % "a", "OEBPS/Text/b.xhtml": XHTML % "b"}
+MANIFEST = [("a", "OEBPS/Text/a.xhtml", "application/xhtml+xml"), ("b", "OEBPS/Text/b.xhtml", "application/xhtml+xml")]
+
+
+def test_failed_save_keeps_the_book_usable(make_book, tmp_path):
+    w = make_book(FILES, MANIFEST)
+    w.writefile("a", XHTML % "changed")
+    # a directory in the way of the target makes the final replace fail
+    bad_target = tmp_path / "out" / "book.epub"
+    os.makedirs(str(bad_target))
+    with pytest.raises(OSError):
+        w.save_as(str(bad_target))
+    assert not os.path.exists(str(bad_target) + ".tmp")
+    assert "changed" in w.readfile("a")
+    assert "b" in w.readfile("b")
+
+    save_path = str(tmp_path / "out" / "saved.epub")
+    w.save_as(save_path)
+    with zipfile.ZipFile(save_path) as zf:
+        assert "changed" in zf.read("OEBPS/Text/a.xhtml").decode("utf-8")
+        assert zf.read("OEBPS/Text/b.xhtml").decode("utf-8") == FILES["OEBPS/Text/b.xhtml"]
+    assert "changed" in w.readfile("a")
+
+
+def test_saving_twice_gives_the_same_bytes(make_book, tmp_path, monkeypatch):
+    w = make_book(FILES, MANIFEST)
+    w.writefile("a", XHTML % "changed")
+    first = str(tmp_path / "first.epub")
+    w.save_as(first)
+    # an hour later, across any timestamp resolution boundary
+    now = time.time() + 3600
+    monkeypatch.setattr(time, "time", lambda: now)
+    w.writefile("a", XHTML % "changed")
+    second = str(tmp_path / "second.epub")
+    w.save_as(second)
+    with open(first, "rb") as fp1, open(second, "rb") as fp2:
+        assert fp1.read() == fp2.read()
+
+
+def test_failed_incremental_save_keeps_the_book_usable(make_book, tmp_path, monkeypatch):
+    w = make_book(FILES, MANIFEST)
+    save_path = str(tmp_path / "saved.epub")
+    w.save_as(save_path)
+    with open(save_path, "rb") as fp:
+        before = fp.read()
+    w.writefile("a", XHTML % "changed")
+
+    def disk_full(outzip, zinfo, chunks):
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(epub_utils, "_zip_write_raw", disk_full)
+    with pytest.raises(OSError):
+        w.save_as(save_path, incremental=True)
+    with open(save_path, "rb") as fp:
+        assert fp.read() == before
+    assert "changed" in w.readfile("a")
+    assert "b" in w.readfile("b")
+
+    monkeypatch.undo()
+    w.save_as(save_path, incremental=True)
+    with zipfile.ZipFile(save_path) as zf:
+        assert "changed" in zf.read("OEBPS/Text/a.xhtml").decode("utf-8")
+        assert zf.read("OEBPS/Text/b.xhtml").decode("utf-8") == FILES["OEBPS/Text/b.xhtml"]
@@ -0,0 +1,111 @@
+import random
+
+
+def ids(w):
+    return [sid for (sid, linear, properties) in w.getspine_epub3()]
+
+
+def test_held_spine_list_survives_deletefile(make_wrapper):
+    w = make_wrapper(300)
+    sp = w.getspine_epub3()
+    victim = sp[1][0]
+    w.deletefile(victim)
+    assert None not in sp
+    assert len(sp) == 300
+    w.setspine_epub3([x for x in sp if x[0] != victim])
+    assert len(w.getspine_epub3()) == 299
+    assert victim not in ids(w)
+
+
+def test_held_spine_list_survives_insert_in_the_middle(make_wrapper):
+    w = make_wrapper(5, spine=["c0", "c1", "c2"])
+    sp = w.getspine_epub3()
+    w.spine_insert_before(1, "c3", None)
+    assert [x[0] for x in sp] == ["c0", "c1", "c2"]
+    assert ids(w) == ["c0", "c3", "c1", "c2"]
+
+
+def test_handed_out_spine_has_no_holes(make_wrapper):
+    w = make_wrapper(10)
+    for sid in ("c2", "c5", "c7"):
+        w.deletefile(sid)
+    sp = w.getspine_epub3()
+    assert None not in sp
+    assert [x[0] for x in sp] == ["c0", "c1", "c3", "c4", "c6", "c8", "c9"]
+    w.deletefile("c0")
+    assert None not in sp
+
+
+def test_caller_edits_to_spine_list_are_seen(make_wrapper):
+    w = make_wrapper(4, spine=["c0", "c1"])
+    w.spine_contains("c0")
+    sp = w.getspine_epub3()
+    sp.insert(0, ("c3", None, None))
+    w.setspine_itemref_epub3_attributes("c1", "no", None)
+    assert w.getspine_epub3()[2] == ("c1", "no", None)
+    assert w.spine_contains("c3")
+    w.deletefile("c3")
+    assert ids(w) == ["c0", "c1"]
+
+
+def test_delete_insert_set_attributes_with_duplicate_idrefs(make_wrapper):
+    w = make_wrapper(6, spine=["c0", "c1", "c2", "c1", "c3", "c2"])
+    w.deletefile("c0")
+    assert not w.spine_contains("c0")
+    # inserts after a delete are positions in the spine without holes
+    w.spine_insert_before(1, "c4", "yes")
+    assert ids(w) == ["c1", "c4", "c2", "c1", "c3", "c2"]
+    w.deletefile("c3")
+    w.spine_insert_before(-1, "c5", None, "page-spread-left")
+    w.spine_insert_before(100, "c1", None)
+    assert ids(w) == ["c1", "c4", "c2", "c1", "c2", "c5", "c1"]
+    # only the first itemref of a duplicated idref is updated
+    w.setspine_itemref_epub3_attributes("c1", "no", "page-spread-right")
+    w.setspine_itemref_epub3_attributes("c2", "yes", None)
+    assert w.getspine_epub3() == [
+        ("c1", "no", "page-spread-right"),
+        ("c4", "yes", None),
+        ("c2", "yes", None),
+        ("c1", None, None),
+        ("c2", None, None),
+        ("c5", None, "page-spread-left"),
+        ("c1", None, None),
+    ]
+    w.deletefile("c1")
+    assert ids(w) == ["c4", "c2", "c2", "c5"]
+    assert w.getspine() == [("c4", "yes"), ("c2", "yes"), ("c2", None), ("c5", None)]
+
+
+def test_random_spine_edits_match_a_plain_list(make_wrapper):
+    rng = random.Random(7)
+    chapters = 60
+    spine = ["c%d" % rng.randrange(chapters) for i in range(120)]
+    w = make_wrapper(chapters, spine=spine)
+    expected = [(sid, None, None) for sid in spine]
+    alive = set("c%d" % i for i in range(chapters))
+    for step in range(300):
+        op = rng.random()
+        if op < 0.3 and alive:
+            sid = rng.choice(sorted(alive))
+            w.deletefile(sid)
+            alive.discard(sid)
+            expected = [x for x in expected if x[0] != sid]
+        elif op < 0.6 and alive:
+            sid = rng.choice(sorted(alive))
+            pos = rng.choice([-1, 0, rng.randrange(len(expected) + 2)])
+            w.spine_insert_before(pos, sid, None)
+            if pos == -1 or pos >= len(expected):
+                expected.append((sid, None, None))
+            else:
+                expected.insert(pos, (sid, None, None))
+        elif op < 0.9 and expected:
+            sid = rng.choice(expected)[0]
+            linear = rng.choice(["yes", "no", None])
+            w.setspine_itemref_epub3_attributes(sid, linear, None)
+            i = [x[0] for x in expected].index(sid)
+            expected[i] = (sid, linear, None)
+        else:
+            assert w.getspine_epub3() == expected
+        for sid in rng.sample(sorted(alive), min(3, len(alive))):
+            assert w.spine_contains(sid) == any(x[0] == sid for x in expected)
+    assert w.getspine_epub3() == expected